@@ -0,0 +1,436 @@
+# bench_easymsx.py
+#
+# Benchmarks EasyMSX against the in-process EMSX simulator.
+#
+#   python benchmarks/bench_easymsx.py --sizes 1000,10000 --label "my change"
+#
+# Every run is appended to benchmarks/results.jsonl so that results can be
+# compared over time; --compare prints the change against the previous run
+# of each case.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import sysconfig
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+
+import blpapi  # noqa: E402
+from easymsx import easymsx  # noqa: E402
+from easymsx.rules import Rule, RuleEngine  # noqa: E402
+from easymsx.simulator import EMSXSimulator, FIRST_SEQUENCE  # noqa: E402
+
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def start_easymsx(simulator):
+    emsx = easymsx.EasyMSX(session_factory=simulator.create_session)
+    emsx.start()
+    return emsx
+
+
+def bench_init_paint(size, args):
+    simulator = EMSXSimulator(num_orders=size, routes_per_order=args.routes_per_order, messages_per_event=args.messages_per_event)
+
+    t0 = time.perf_counter()
+    emsx = easymsx.EasyMSX(session_factory=simulator.create_session)
+    t1 = time.perf_counter()
+    emsx.start()
+    t2 = time.perf_counter()
+    emsx.stop()
+
+    result = {
+        "initialize_s": t1 - t0,
+        "paint_s": t2 - t1,
+        "orders_per_s": size / (t2 - t1),
+    }
+    for row in emsx.startup_report()["phases"]:
+        result[row["phase"] + "_ms"] = row["duration_ms"]
+    return result
+
+
+def bench_update_throughput(size, args):
+    simulator = EMSXSimulator(num_orders=size, routes_per_order=args.routes_per_order, messages_per_event=args.messages_per_event)
+    emsx = start_easymsx(simulator)
+
+    notifications = [0]
+
+    def count(notification):
+        notifications[0] += 1
+
+    emsx.add_notification_handler(count)
+
+    t0 = time.perf_counter()
+    simulator.inject_updates(args.updates)
+    simulator.wait_idle()
+    elapsed = time.perf_counter() - t0
+    emsx.stop()
+
+    return {
+        "updates": args.updates,
+        "elapsed_s": elapsed,
+        "updates_per_s": args.updates / elapsed,
+        "notifications": notifications[0],
+    }
+
+
+def uninstrumented_handler(emsx):
+
+    # subscription data goes straight to the order and route handlers, skipping every metrics,
+    # latency and tracing check in process_event, as if the instrumentation had never been added
+    handlers = emsx.subscription_message_handlers
+
+    def handle(event, session):
+        if event.eventType() != blpapi.Event.SUBSCRIPTION_DATA:
+            return emsx.process_event(event, session)
+        for msg in event:
+            handler = handlers.get(msg.correlationIds()[0].value())
+            if handler is not None:
+                handler(msg)
+
+    return handle
+
+
+def bench_metrics_overhead(size, args):
+    simulator = EMSXSimulator(num_orders=size, routes_per_order=args.routes_per_order, messages_per_event=args.messages_per_event)
+    emsx = start_easymsx(simulator)
+    emsx.add_notification_handler(lambda notification: None)
+    instrumented = emsx.session.event_handler
+    uninstrumented = uninstrumented_handler(emsx)
+
+    rates = {}
+    for mode in ("uninstrumented", "disabled", "enabled") * 2:
+        emsx.session.event_handler = uninstrumented if mode == "uninstrumented" else instrumented
+        if mode == "enabled":
+            emsx.metrics.enable()
+        else:
+            emsx.metrics.disable()
+        t0 = time.perf_counter()
+        simulator.inject_updates(args.updates)
+        simulator.wait_idle()
+        rate = args.updates / (time.perf_counter() - t0)
+        rates[mode] = max(rate, rates.get(mode, 0.0))
+
+    emsx.session.event_handler = instrumented
+    emsx.stop()
+
+    return {
+        "uninstrumented_updates_per_s": rates["uninstrumented"],
+        "disabled_updates_per_s": rates["disabled"],
+        "enabled_updates_per_s": rates["enabled"],
+        "disabled_overhead_pct": 100.0 * (rates["uninstrumented"] - rates["disabled"]) / rates["uninstrumented"],
+        "enabled_overhead_pct": 100.0 * (rates["disabled"] - rates["enabled"]) / rates["disabled"],
+    }
+
+
+def bench_request_round_trip(size, args):
+    simulator = EMSXSimulator(num_orders=size, routes_per_order=args.routes_per_order, messages_per_event=args.messages_per_event)
+    emsx = start_easymsx(simulator)
+
+    samples = []
+    for i in range(0, args.requests):
+        req = emsx.create_request("CreateOrder")
+        req.set("EMSX_TICKER", "IBM US Equity")
+        req.set("EMSX_AMOUNT", 100 + i)
+        req.set("EMSX_ORDER_TYPE", "MKT")
+        req.set("EMSX_TIF", "DAY")
+        req.set("EMSX_HAND_INSTRUCTION", "ANY")
+        req.set("EMSX_SIDE", "BUY")
+        t0 = time.perf_counter()
+        emsx.send_request(req)
+        samples.append(time.perf_counter() - t0)
+
+    simulator.wait_idle()
+    emsx.stop()
+
+    return {
+        "requests": args.requests,
+        "p50_ms": percentile(samples, 50) * 1000.0,
+        "p99_ms": percentile(samples, 99) * 1000.0,
+        "max_ms": max(samples) * 1000.0,
+    }
+
+
+def bench_bulk_basket(size, args):
+    # a 1ms simulated round trip, so the result shows how well the basket is pipelined
+    simulator = EMSXSimulator(num_orders=size, routes_per_order=args.routes_per_order,
+                              messages_per_event=args.messages_per_event, response_latency=0.001)
+    emsx = start_easymsx(simulator)
+
+    basket = [{"EMSX_TICKER": "IBM US Equity", "EMSX_AMOUNT": 100 + i, "EMSX_ORDER_TYPE": "MKT", "EMSX_TIF": "DAY",
+               "EMSX_HAND_INSTRUCTION": "ANY", "EMSX_SIDE": "BUY", "EMSX_BROKER": "BMTB"} for i in range(args.requests)]
+    result = emsx.orders.create_and_route_orders(basket, window=50)
+    summary = result.summary()
+
+    simulator.wait_idle()
+    emsx.stop()
+
+    return {
+        "items": summary["count"],
+        "failed": len(result.failed()),
+        "elapsed_ms": summary["elapsed_ms"],
+        "items_per_s": summary["per_second"],
+        "mean_latency_ms": summary["mean_latency_ms"],
+    }
+
+
+def bench_memory(size, args):
+    simulator = EMSXSimulator(num_orders=size, routes_per_order=args.routes_per_order, messages_per_event=args.messages_per_event)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    emsx = start_easymsx(simulator)
+    after = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # only count what EasyMSX allocated, not the simulator or the tracer itself
+    package = os.path.dirname(os.path.abspath(easymsx.__file__))
+    retained = sum(s.size_diff for s in after.compare_to(before, "filename")
+                   if s.traceback[0].filename.startswith(package)
+                   and not s.traceback[0].filename.endswith("simulator.py"))
+    dictionary = emsx.memory_report()["total"]
+    emsx.stop()
+
+    rows = size * (1 + args.routes_per_order)
+    return {
+        "retained_bytes": retained,
+        "bytes_per_row": retained / float(rows),
+        "peak_bytes": peak,
+        "dictionary_saved_bytes": dictionary["saved_bytes"],
+    }
+
+
+def bench_dispatch_shards(size, args):
+
+    # per-notification CPU work stands in for application handlers; with the GIL the shards
+    # mostly show their overhead, a free-threaded build is where they can scale
+    def work(notification):
+        total = 0
+        for i in range(0, args.handler_work):
+            total += i
+        return total
+
+    result = {
+        "free_threaded": 1 if sysconfig.get_config_var("Py_GIL_DISABLED") else 0,
+        "gil_enabled": 1 if getattr(sys, "_is_gil_enabled", lambda: True)() else 0,
+    }
+    for shards in (0, 1, 2, 4):
+        simulator = EMSXSimulator(num_orders=size, routes_per_order=args.routes_per_order, messages_per_event=args.messages_per_event)
+        emsx = easymsx.EasyMSX(session_factory=simulator.create_session)
+        emsx.set_dispatch_shards(shards)
+        emsx.start()
+        emsx.add_notification_handler(work)
+
+        t0 = time.perf_counter()
+        simulator.inject_updates(args.updates)
+        simulator.wait_idle()
+        emsx.wait_dispatched()
+        result["shards_%d_updates_per_s" % shards] = args.updates / (time.perf_counter() - t0)
+        emsx.stop()
+
+    return result
+
+
+def bench_event_priority(size, args):
+
+    # requests sent straight after an update storm, with and without responses overtaking the queued data
+    def work(notification):
+        total = 0
+        for i in range(0, args.handler_work):
+            total += i
+        return total
+
+    result = {}
+    for name, enabled in (("fifo", False), ("priority", True)):
+        simulator = EMSXSimulator(num_orders=size, routes_per_order=args.routes_per_order, messages_per_event=args.messages_per_event)
+        emsx = easymsx.EasyMSX(session_factory=simulator.create_session)
+        emsx.set_event_prioritization(enabled)
+        emsx.start()
+        emsx.add_notification_handler(work)
+
+        samples = []
+        t0 = time.perf_counter()
+        simulator.inject_updates(args.updates)
+        for i in range(0, args.requests):
+            t1 = time.perf_counter()
+            emsx.send_request(emsx.request_template("ModifyOrderEx").create(EMSX_SEQUENCE=FIRST_SEQUENCE + i % size, EMSX_AMOUNT=100 + i))
+            samples.append(time.perf_counter() - t1)
+        simulator.wait_idle()
+        emsx.wait_dispatched()
+        elapsed = time.perf_counter() - t0
+        emsx.stop()
+
+        result[name + "_request_p50_ms"] = percentile(samples, 50) * 1000.0
+        result[name + "_request_p99_ms"] = percentile(samples, 99) * 1000.0
+        result[name + "_updates_per_s"] = args.updates / elapsed
+
+    return result
+
+
+def bench_rules(size, args):
+
+    # most rules watch fields that updates do not touch, a few watch the fills
+    result = {}
+    for name, count in (("no_rules", 0), ("rules", args.rules)):
+        simulator = EMSXSimulator(num_orders=size, routes_per_order=args.routes_per_order, messages_per_event=args.messages_per_event)
+        emsx = start_easymsx(simulator)
+        engine = RuleEngine()
+        for i in range(0, count):
+            if i % 10:
+                engine.add_rule(Rule("account_%d" % i, "EMSX_ACCOUNT == 'ACCT%d' and EMSX_TRADER == 'TRADER%d'" % (i, i)))
+            else:
+                engine.add_rule(Rule("fill_%d" % i, "EMSX_FILLED > %d" % (i * 10)))
+        emsx.set_rule_engine(engine)
+        painted = sum(s["evaluations"] for s in engine.stats())
+
+        t0 = time.perf_counter()
+        simulator.inject_updates(args.updates)
+        simulator.wait_idle()
+        result[name + "_updates_per_s"] = args.updates / (time.perf_counter() - t0)
+        if count:
+            stats = engine.stats()
+            result["evaluations_per_update"] = (sum(s["evaluations"] for s in stats) - painted) / float(args.updates)
+        emsx.stop()
+
+    return result
+
+
+def bench_history(size, args):
+
+    result = {}
+    for name, enabled in (("off", False), ("on", True)):
+        simulator = EMSXSimulator(num_orders=size, routes_per_order=args.routes_per_order, messages_per_event=args.messages_per_event)
+        emsx = easymsx.EasyMSX(session_factory=simulator.create_session)
+        if enabled:
+            emsx.enable_history()
+        emsx.start()
+
+        t0 = time.perf_counter()
+        simulator.inject_updates(args.updates)
+        simulator.wait_idle()
+        result[name + "_updates_per_s"] = args.updates / (time.perf_counter() - t0)
+        if enabled:
+            memory = emsx.history.memory()
+            result["entries"] = memory["entries"]
+            result["bytes_per_row"] = memory["bytes"] / float(max(1, memory["rows"]))
+        emsx.stop()
+
+    return result
+
+
+CASES = {
+    "init": bench_init_paint,
+    "updates": bench_update_throughput,
+    "requests": bench_request_round_trip,
+    "bulk": bench_bulk_basket,
+    "metrics": bench_metrics_overhead,
+    "memory": bench_memory,
+    "shards": bench_dispatch_shards,
+    "priority": bench_event_priority,
+    "rules": bench_rules,
+    "history": bench_history,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def previous_results(path):
+    previous = {}
+    if not os.path.exists(path):
+        return previous
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                r = json.loads(line)
+                previous[(r["case"], r["size"])] = r
+    return previous
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="EasyMSX benchmarks against the EMSX simulator")
+    parser.add_argument("--sizes", default="1000,10000", help="comma separated blotter sizes (e.g. 1000,10000,100000,1000000)")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma separated cases: " + ", ".join(CASES))
+    parser.add_argument("--routes-per-order", type=int, default=1)
+    parser.add_argument("--messages-per-event", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rules", type=int, default=1000, help="rules registered in the rules case")
+    parser.add_argument("--handler-work", type=int, default=0, help="loop iterations per notification in the shards and priority cases")
+    parser.add_argument("--output", default=DEFAULT_RESULTS, help="results file, one JSON record per line")
+    parser.add_argument("--label", default="", help="free text stored with the results")
+    parser.add_argument("--compare", action="store_true", help="show the change against the previous run of each case")
+    args = parser.parse_args(argv)
+
+    previous = previous_results(args.output) if args.compare else {}
+    run = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "label": args.label,
+    }
+
+    with open(args.output, "a") as out:
+        for case in args.cases.split(","):
+            for size in [int(s) for s in args.sizes.split(",")]:
+                result = CASES[case](size, args)
+                record = dict(run, case=case, size=size, **result)
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+                line = "%-10s %9d  " % (case, size) + "  ".join("%s=%.4g" % (k, v) for k, v in result.items())
+                print(line)
+                prior = previous.get((case, size))
+                if prior is not None:
+                    deltas = ["%s %+.1f%%" % (k, 100.0 * (v - prior[k]) / prior[k])
+                              for k, v in result.items() if prior.get(k)]
+                    print("%21s vs %s: %s" % ("", prior.get("revision") or prior["timestamp"], ", ".join(deltas)))
+
+
+if __name__ == "__main__":
+    main()
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,63 @@
+# batchhandler.py
+
+import time
+
+
+class BatchHandler:
+
+    def __init__(self, handler, interval=None):
+        # interval None hands over every event's notifications, otherwise a time slice in seconds
+        if interval is not None and interval < 0:
+            raise ValueError("Batch interval cannot be negative")
+        self.handler = handler
+        self.interval = interval
+        self.pending = []
+        self.started = 0.0
+
+    def add(self, notifications, now):
+        # True when the notifications open a new time slice
+        if notifications:
+            opened = not self.pending
+            if opened:
+                self.started = now
+            self.pending.extend(notifications)
+            return opened
+        return False
+
+    def due(self, now):
+        return bool(self.pending) and (self.interval is None or now - self.started >= self.interval)
+
+    def flush(self, metrics):
+        batch = self.pending
+        self.pending = []
+        if not batch:
+            return
+        if metrics.enabled:
+            t0 = time.perf_counter_ns()
+            self.handler(batch)
+            metrics.observe("batch_handler_ns", time.perf_counter_ns() - t0)
+            metrics.incr("batched_notifications_total", (), len(batch))
+        else:
+            self.handler(batch)
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -26,7 +26,7 @@ class BrokerStrategyParameters:
         request.set("EMSX_BROKER", self.broker_strategy.parent.broker.name)
         request.set("EMSX_STRATEGY", self.broker_strategy.name)
         request.set("EMSX_ASSET_CLASS", self.broker_strategy.parent.broker.asset_class)
-        logging.info("Sending request: " + str(request))
+        logging.info("Sending request: %s", request)
         
         self.broker_strategy.parent.broker.parent.easymsx.submit_request(request, self.process_message)
 
@@ -0,0 +1,251 @@
+# bulk.py
+
+import blpapi
+import logging
+import threading
+import time
+from .scheduler import RequestScheduler
+
+ERROR_INFO = blpapi.Name("ErrorInfo")
+
+STATUS_PENDING = "PENDING"
+STATUS_OK = "OK"
+STATUS_ERROR = "ERROR"
+STATUS_INVALID = "INVALID"
+STATUS_NO_RESPONSE = "NO_RESPONSE"
+STATUS_NOT_SENT = "NOT_SENT"
+
+# integer and string fields kept from a successful response
+RESULT_INTEGER_FIELDS = ("EMSX_SEQUENCE", "EMSX_ROUTE_ID", "STATUS")
+RESULT_STRING_FIELDS = ("MESSAGE",)
+
+logger = logging.getLogger(__name__)
+
+
+def rows_from_columns(columns):
+
+    names = list(columns.keys())
+    values = [list(columns[n]) for n in names]
+    if len(set(len(v) for v in values)) > 1:
+        raise ValueError("All columns must have the same number of values")
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+
+def as_rows(items):
+    # a mapping is columnar input: field name -> sequence of values
+    if hasattr(items, "keys"):
+        return rows_from_columns(items)
+    return list(items)
+
+
+class BulkItem:
+
+    __slots__ = ("bulk", "index", "values", "status", "error_code", "error_message", "response", "submitted_ns", "completed_ns")
+
+    def __init__(self, bulk, index, values):
+        self.bulk = bulk
+        self.index = index
+        self.values = values
+        self.status = STATUS_PENDING
+        self.error_code = None
+        self.error_message = None
+        self.response = {}
+        self.submitted_ns = None
+        self.completed_ns = None
+
+    def latency_ns(self):
+        if self.submitted_ns is None or self.completed_ns is None:
+            return None
+        return self.completed_ns - self.submitted_ns
+
+    def process_message(self, msg):
+        self.bulk.item_response(self, msg)
+
+    def release(self, sent=True):
+        # called by EasyMSX when the request can no longer be answered, or never left
+        self.bulk.item_lost(self, sent)
+
+    def __repr__(self):
+        return "BulkItem(%d, %s, %s)" % (self.index, self.status, self.error_message or self.response)
+
+
+class BulkResult:
+
+    def __init__(self, operation, items, elapsed_ns):
+        self.operation = operation
+        self.items = items
+        self.elapsed_ns = elapsed_ns
+
+    def __iter__(self):
+        return self.items.__iter__()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def succeeded(self):
+        return [i for i in self.items if i.status == STATUS_OK]
+
+    def failed(self):
+        return [i for i in self.items if i.status != STATUS_OK]
+
+    def ok(self):
+        return all(i.status == STATUS_OK for i in self.items)
+
+    def summary(self):
+
+        latencies = [i.latency_ns() for i in self.items if i.latency_ns() is not None]
+        counts = {}
+        for i in self.items:
+            counts[i.status] = counts.get(i.status, 0) + 1
+
+        return {
+            "operation": self.operation,
+            "count": len(self.items),
+            "status": counts,
+            "elapsed_ms": self.elapsed_ns / 1e6,
+            "per_second": len(self.items) / (self.elapsed_ns / 1e9) if self.elapsed_ns > 0 else 0.0,
+            "mean_latency_ms": sum(latencies) / len(latencies) / 1e6 if latencies else None,
+            "max_latency_ms": max(latencies) / 1e6 if latencies else None,
+        }
+
+
+class BulkOperation:
+
+    def __init__(self, easymsx, operation, items, window=50, priority=None, timeout=None):
+
+        if window < 1:
+            raise ValueError("Bulk window must be at least 1")
+        if priority is not None:
+            RequestScheduler.check_priority(priority)
+
+        self.easymsx = easymsx
+        self.operation = operation
+        self.template = easymsx.request_template(operation)
+        self.items = [BulkItem(self, i, values) for i, values in enumerate(as_rows(items))]
+        self.window = window
+        self.priority = priority
+        self.timeout = timeout
+        self.slots = threading.Semaphore(window)
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.done = threading.Event()
+
+    def run(self):
+
+        emsx = self.easymsx
+        t0 = time.perf_counter_ns()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+
+        self.outstanding = len(self.items)
+        if not self.items:
+            self.done.set()
+
+        for item in self.items:
+
+            # malformed or incomplete items are rejected without taking a slot, and counted as rejected requests
+            try:
+                self.template.check(item.values, complete=True)
+            except ValueError as err:
+                item.status = STATUS_INVALID
+                item.error_message = str(err)
+                self.finish(item, False)
+                continue
+
+            # the window bounds the requests in flight, the next one is built while they are out
+            # in pull mode the ready check itself takes the slot, once the loop has processed a response
+            if not emsx.wait_for(lambda: self.slots.acquire(False), lambda timeout: self.slots.acquire(timeout=timeout), self.remaining(deadline)):
+                break
+
+            req = self.template.build(item.values)
+
+            cid = emsx.next_correlation_id()
+            emsx.request_message_handlers[cid.value()] = item.process_message
+            emsx.response_waiters[cid.value()] = item
+            item.submitted_ns = time.perf_counter_ns()
+            emsx.issue_request(req, cid, self.priority)
+
+        emsx.wait_for(self.done.is_set, self.done.wait, self.remaining(deadline))
+        self.abandon()
+
+        result = BulkResult(self.operation, self.items, time.perf_counter_ns() - t0)
+        if emsx.metrics.enabled:
+            for status, count in result.summary()["status"].items():
+                emsx.metrics.incr("bulk_items_total", (("operation", self.operation), ("status", status)), count)
+        return result
+
+    @staticmethod
+    def remaining(deadline):
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.monotonic())
+
+    def abandon(self):
+
+        # items still pending when the timeout expires are reported and their handlers dropped
+        emsx = self.easymsx
+        for cid, handler in list(emsx.response_waiters.items()):
+            if isinstance(handler, BulkItem) and handler.bulk is self:
+                emsx.response_waiters.pop(cid, None)
+                emsx.request_message_handlers.pop(cid, None)
+        with self.lock:
+            for item in self.items:
+                if item.status == STATUS_PENDING:
+                    item.status = STATUS_NO_RESPONSE if item.submitted_ns is not None else STATUS_NOT_SENT
+
+    def item_response(self, item, msg):
+
+        self.easymsx.response_waiters.pop(msg.correlationIds()[0].value(), None)
+
+        if msg.messageType() == ERROR_INFO:
+            item.status = STATUS_ERROR
+            item.error_code = msg.getElementAsInteger("ERROR_CODE")
+            item.error_message = msg.getElementAsString("ERROR_MESSAGE")
+        else:
+            for name in RESULT_INTEGER_FIELDS:
+                if msg.hasElement(name):
+                    item.response[name] = msg.getElementAsInteger(name)
+            for name in RESULT_STRING_FIELDS:
+                if msg.hasElement(name):
+                    item.response[name] = msg.getElementAsString(name)
+            item.status = STATUS_OK
+
+        self.finish(item)
+
+    def item_lost(self, item, sent=True):
+        if item.status == STATUS_PENDING:
+            item.status = STATUS_NO_RESPONSE if sent else STATUS_NOT_SENT
+            self.finish(item)
+
+    def finish(self, item, release_slot=True):
+        item.completed_ns = time.perf_counter_ns()
+        if release_slot:
+            self.slots.release()
+        with self.lock:
+            self.outstanding -= 1
+            if self.outstanding == 0:
+                self.done.set()
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,375 @@
+# changelog.py
+
+import bisect
+import collections
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".log"
+INDEX_SUFFIX = ".index"
+COMPACTED_SUFFIX = ".compacted"
+
+# record offset, byte position in the segment
+INDEX_ENTRY = struct.Struct("<QQ")
+
+KIND_ORDER = "order"
+KIND_ROUTE = "route"
+
+# record type of compacted rows, which carry every field with no old value
+TYPE_STATE = "STATE"
+
+
+def file_name(base_offset, suffix):
+    return "%020d%s" % (base_offset, suffix)
+
+
+def list_files(directory, suffix):
+    # base offsets of the files with this suffix, in order
+    return sorted(int(n[:-len(suffix)]) for n in os.listdir(directory) if n.endswith(suffix) and n[:-len(suffix)].isdigit())
+
+
+def fold(state, record):
+    key = (record["kind"], record["sequence"], record["route_id"])
+    row = state.get(key)
+    if row is None or record["type"] == TYPE_STATE:
+        row = state[key] = {"kind": record["kind"], "sequence": record["sequence"], "route_id": record["route_id"], "fields": {}}
+    row["offset"] = record["offset"]
+    row["version"] = record["version"]
+    row["type"] = record.get("last_type", record["type"])
+    row["event_ns"] = record["event_ns"]
+    for name, old, new in record["changes"]:
+        row["fields"][name] = new
+
+
+class ChangeLogReader:
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def read_index(self, base):
+        path = os.path.join(self.directory, file_name(base, INDEX_SUFFIX))
+        if not os.path.exists(path):
+            return []
+        with open(path, "rb") as f:
+            data = f.read()
+        count = len(data) // INDEX_ENTRY.size
+        return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(0, count)]
+
+    def records(self, from_offset=0):
+
+        compacted = list_files(self.directory, COMPACTED_SUFFIX)
+        if compacted:
+            # compacted rows keep the offset of the last change folded into them
+            with open(os.path.join(self.directory, file_name(compacted[-1], COMPACTED_SUFFIX)), "rb") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record["offset"] >= from_offset:
+                        yield record
+
+        segments = list_files(self.directory, SEGMENT_SUFFIX)
+        for i, base in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1] <= from_offset:
+                continue
+            position = 0
+            if from_offset > base:
+                # the sparse index gets us to the nearest record at or before the offset
+                index = self.read_index(base)
+                at = bisect.bisect_right(index, (from_offset, float("inf"))) - 1
+                if at >= 0:
+                    position = index[at][1]
+            with open(os.path.join(self.directory, file_name(base, SEGMENT_SUFFIX)), "rb") as f:
+                f.seek(position)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # a record torn by a crash mid write
+                        break
+                    record = json.loads(line)
+                    if record["offset"] >= from_offset:
+                        yield record
+
+    def latest_state(self):
+        state = {}
+        for record in self.records():
+            fold(state, record)
+        return state
+
+
+class ChangeLog:
+
+    def __init__(self, easymsx, directory, segment_bytes=64 * 1024 * 1024, index_interval=64, max_queue=1000000, fsync=False):
+
+        if segment_bytes < 1 or index_interval < 1:
+            raise ValueError("Segment size and index interval must be positive")
+
+        self.easymsx = easymsx
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.max_queue = max_queue
+        self.fsync = fsync
+
+        self.condition = threading.Condition()
+        self.queue = collections.deque()
+        self.captured = 0
+        self.written = 0
+        self.dropped = 0
+        self.closing = False
+        self.thread = None
+
+        # owned by the writer thread once started
+        self.lock = threading.Lock()
+        self.compact_lock = threading.Lock()
+        self.segments = []
+        self.segment = None
+        self.index = None
+        self.segment_base = 0
+        self.segment_size = 0
+        self.next_offset = 0
+        self.versions = {}
+
+    def start(self):
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.recover()
+
+        self.easymsx.orders.add_cache_listener(self.order_changed)
+        self.easymsx.routes.add_cache_listener(self.route_changed)
+        self.easymsx.metrics.set_gauge("changelog_queue_depth", lambda: len(self.queue))
+
+        self.thread = threading.Thread(target=self.run, name="EasyMSXChangeLog", daemon=True)
+        self.thread.start()
+        logger.info("Writing the change log to %s from offset %d", self.directory, self.next_offset)
+
+    def recover(self):
+
+        # offsets and per key versions carry on from whatever is already on disk
+        for record in ChangeLogReader(self.directory).records():
+            self.versions[(record["kind"], record["sequence"], record["route_id"])] = record["version"]
+            self.next_offset = record["offset"] + 1
+
+        self.segments = list_files(self.directory, SEGMENT_SUFFIX)
+        if self.segments:
+            self.open_segment(self.segments[-1])
+            # drop a record torn by a crash so the next one starts on its own line
+            valid = 0
+            with open(self.segment.name, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    valid += len(line)
+            self.segment.truncate(valid)
+            self.segment_size = valid
+        else:
+            self.roll()
+
+    def order_changed(self, o, notification):
+        self.capture(KIND_ORDER, o.sequence, 0, o, notification)
+
+    def route_changed(self, r, notification):
+        self.capture(KIND_ROUTE, r.sequence, r.route_id, r, notification)
+
+    def capture(self, kind, sequence, route_id, row, notification):
+
+        # runs on the event thread, so it only copies the changes and queues them
+        if notification is None:
+            return
+        cached = row.fields.field_index
+        changes = [(fc.field.name(), fc.old_value, fc.new_value) for fc in notification.field_changes if cached.get(fc.field.name()) is fc.field]
+        if not changes:
+            return
+
+        with self.condition:
+            if self.max_queue is not None and len(self.queue) >= self.max_queue:
+                self.dropped += 1
+                if self.easymsx.metrics.enabled:
+                    self.easymsx.metrics.incr("changelog_dropped_total")
+                logger.error("Change log queue is full, dropping the change to %s %d/%d", kind, sequence, route_id)
+                return
+            self.queue.append((kind, sequence, route_id, notification.type.name, time.time_ns(), changes))
+            self.captured += 1
+            self.condition.notify()
+
+    def run(self):
+
+        while True:
+            with self.condition:
+                while not self.queue and not self.closing:
+                    self.condition.wait()
+                if not self.queue:
+                    break
+                batch = self.queue
+                self.queue = collections.deque()
+
+            try:
+                self.write_batch(batch)
+            except (OSError, ValueError) as e:
+                logger.error("Change log write failed: %s", e)
+                self.easymsx.metrics.incr("changelog_write_errors_total")
+
+            with self.condition:
+                self.written += len(batch)
+                self.condition.notify_all()
+
+    def write_batch(self, batch):
+
+        t0 = time.perf_counter_ns()
+
+        with self.lock:
+            for kind, sequence, route_id, notification_type, event_ns, changes in batch:
+
+                key = (kind, sequence, route_id)
+                version = self.versions.get(key, 0) + 1
+                self.versions[key] = version
+
+                line = (json.dumps({
+                    "offset": self.next_offset,
+                    "kind": kind,
+                    "sequence": sequence,
+                    "route_id": route_id,
+                    "type": notification_type,
+                    "version": version,
+                    "event_ns": event_ns,
+                    "written_ns": time.time_ns(),
+                    "changes": changes,
+                }, separators=(",", ":")) + "\n").encode("utf-8")
+
+                if self.segment_size > 0 and self.segment_size + len(line) > self.segment_bytes:
+                    self.roll()
+
+                if (self.next_offset - self.segment_base) % self.index_interval == 0:
+                    self.index.write(INDEX_ENTRY.pack(self.next_offset, self.segment_size))
+
+                self.segment.write(line)
+                self.segment_size += len(line)
+                self.next_offset += 1
+
+            self.segment.flush()
+            self.index.flush()
+            if self.fsync:
+                os.fsync(self.segment.fileno())
+
+        metrics = self.easymsx.metrics
+        if metrics.enabled:
+            metrics.incr("changelog_records_total", (), len(batch))
+            metrics.observe("changelog_write_ns", time.perf_counter_ns() - t0)
+
+    def open_segment(self, base):
+        self.segment = open(os.path.join(self.directory, file_name(base, SEGMENT_SUFFIX)), "ab")
+        self.index = open(os.path.join(self.directory, file_name(base, INDEX_SUFFIX)), "ab")
+        self.segment_base = base
+        self.segment_size = self.segment.tell()
+
+    def roll(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+        self.open_segment(self.next_offset)
+        if not self.segments or self.segments[-1] != self.next_offset:
+            self.segments.append(self.next_offset)
+
+    def flush(self, timeout=None):
+        # waits for everything captured so far to reach the segment files
+        with self.condition:
+            target = self.captured
+            return self.condition.wait_for(lambda: self.written >= target, timeout)
+
+    def compact(self):
+
+        # folds the closed segments, and any earlier compaction, into the latest state per key
+        with self.compact_lock:
+
+            with self.lock:
+                closed = self.segments[:-1]
+                active = self.segments[-1]
+            if not closed:
+                return 0
+
+            state = {}
+            previous = list_files(self.directory, COMPACTED_SUFFIX)
+            reader = ChangeLogReader(self.directory)
+            for record in reader.records():
+                if record["offset"] >= active:
+                    break
+                fold(state, record)
+
+            path = os.path.join(self.directory, file_name(active, COMPACTED_SUFFIX))
+            with open(path + ".tmp", "wb") as f:
+                for row in sorted(state.values(), key=lambda r: r["offset"]):
+                    f.write((json.dumps({
+                        "offset": row["offset"],
+                        "kind": row["kind"],
+                        "sequence": row["sequence"],
+                        "route_id": row["route_id"],
+                        "type": TYPE_STATE,
+                        "last_type": row["type"],
+                        "version": row["version"],
+                        "event_ns": row["event_ns"],
+                        "changes": [[name, None, value] for name, value in row["fields"].items()],
+                    }, separators=(",", ":")) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+
+            for base in previous:
+                if base != active:
+                    os.unlink(os.path.join(self.directory, file_name(base, COMPACTED_SUFFIX)))
+            for base in closed:
+                os.unlink(os.path.join(self.directory, file_name(base, SEGMENT_SUFFIX)))
+                index = os.path.join(self.directory, file_name(base, INDEX_SUFFIX))
+                if os.path.exists(index):
+                    os.unlink(index)
+
+            with self.lock:
+                self.segments = [s for s in self.segments if s not in closed]
+
+            self.easymsx.metrics.incr("changelog_compactions_total")
+            logger.info("Compacted %d change log segments into %d rows", len(closed), len(state))
+            return len(state)
+
+    def reader(self):
+        return ChangeLogReader(self.directory)
+
+    def close(self, timeout=None):
+
+        self.easymsx.orders.remove_cache_listener(self.order_changed)
+        self.easymsx.routes.remove_cache_listener(self.route_changed)
+
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+        with self.lock:
+            if self.segment is not None:
+                self.segment.close()
+                self.index.close()
+                self.segment = None
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,133 @@
+# degradation.py
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+ACTION_CONFLATE = "conflate"
+ACTION_SUPPRESS_FIELD_NOTIFICATIONS = "suppress_field_notifications"
+ACTION_DISABLE_TRACING = "disable_tracing"
+ACTION_DROP_LOW_PRIORITY_HANDLERS = "drop_low_priority_handlers"
+
+ALL_ACTIONS = (ACTION_CONFLATE, ACTION_SUPPRESS_FIELD_NOTIFICATIONS, ACTION_DISABLE_TRACING, ACTION_DROP_LOW_PRIORITY_HANDLERS)
+
+REASON_SLOW_CONSUMER = "slow_consumer"
+REASON_QUEUE_DEPTH = "queue_depth"
+
+
+class DegradationPolicy:
+
+    def __init__(self, actions=ALL_ACTIONS, queue_depth_high=None, queue_depth_low=None, conflation_interval=0.0):
+        for a in actions:
+            if a not in ALL_ACTIONS:
+                raise ValueError("Unknown degradation action: " + str(a))
+        self.actions = tuple(actions)
+        self.queue_depth_high = queue_depth_high
+        self.queue_depth_low = queue_depth_low if queue_depth_low is not None else queue_depth_high
+        self.conflation_interval = conflation_interval
+        self.easymsx = None
+        self.reasons = set()
+        self.saved_tracing = None
+        self.lock = threading.Lock()
+
+    def attach(self, easymsx):
+        self.easymsx = easymsx
+        easymsx.metrics.set_gauge("degraded", lambda: 1 if self.reasons else 0)
+
+    def degraded(self):
+        return len(self.reasons) > 0
+
+    def slow_consumer_warning(self):
+        self.raise_reason(REASON_SLOW_CONSUMER)
+
+    def slow_consumer_warning_cleared(self):
+        self.clear_reason(REASON_SLOW_CONSUMER)
+
+    def observe_queue_depth(self, depth):
+        if self.queue_depth_high is None:
+            return
+        if depth >= self.queue_depth_high:
+            if REASON_QUEUE_DEPTH not in self.reasons:
+                self.raise_reason(REASON_QUEUE_DEPTH)
+        elif depth <= self.queue_depth_low:
+            if REASON_QUEUE_DEPTH in self.reasons:
+                self.clear_reason(REASON_QUEUE_DEPTH)
+
+    def raise_reason(self, reason):
+        with self.lock:
+            was_degraded = self.degraded()
+            self.reasons.add(reason)
+            if not was_degraded:
+                self.enter(reason)
+
+    def clear_reason(self, reason):
+        with self.lock:
+            if reason not in self.reasons:
+                return
+            self.reasons.discard(reason)
+            if self.degraded():
+                return
+            pending = self.leave(reason)
+        # conflated notifications reach the handlers only once the policy lock is released
+        self.easymsx.dispatch_conflated(pending)
+
+    def enter(self, reason):
+
+        emsx = self.easymsx
+        logger.warning("Entering degraded mode (%s): %s", reason, ", ".join(self.actions))
+
+        if ACTION_DISABLE_TRACING in self.actions:
+            self.saved_tracing = emsx.flight_recorder.enabled
+            emsx.flight_recorder.disable()
+        if ACTION_SUPPRESS_FIELD_NOTIFICATIONS in self.actions:
+            emsx.field_notifications_enabled = False
+        if ACTION_DROP_LOW_PRIORITY_HANDLERS in self.actions:
+            emsx.low_priority_handlers_enabled = False
+        if ACTION_CONFLATE in self.actions:
+            emsx.conflation_interval = self.conflation_interval
+            emsx.conflating = True
+
+        emsx.metrics.incr("degradation_transitions_total", (("state", "degraded"), ("reason", reason)))
+
+    def leave(self, reason):
+
+        # returns the conflated notifications still waiting, for the caller to dispatch
+        emsx = self.easymsx
+        logger.warning("Leaving degraded mode (%s)", reason)
+
+        pending = {}
+        if ACTION_CONFLATE in self.actions:
+            emsx.conflating = False
+            pending = emsx.take_conflated()
+        if ACTION_DROP_LOW_PRIORITY_HANDLERS in self.actions:
+            emsx.low_priority_handlers_enabled = True
+        if ACTION_SUPPRESS_FIELD_NOTIFICATIONS in self.actions:
+            emsx.field_notifications_enabled = True
+        if ACTION_DISABLE_TRACING in self.actions and self.saved_tracing:
+            emsx.flight_recorder.enable()
+
+        emsx.metrics.incr("degradation_transitions_total", (("state", "normal"), ("reason", reason)))
+        return pending
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
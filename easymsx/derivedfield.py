@@ -0,0 +1,191 @@
+# derivedfield.py
+
+from .fieldchange import FieldChange
+from .notification import Notification
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DerivedFieldDefinition:
+
+    def __init__(self, name, sources, compute):
+        self.name = name
+        self.sources = tuple(sources)
+        self.compute = compute
+
+
+class DerivedField:
+
+    # looks like a Field to readers; the value is computed on first read and kept until a source changes
+    def __init__(self, parent, definition):
+        self.parent = parent
+        self.definition = definition
+        self.cached = None
+        self.valid = False
+        # moved by every invalidation, a value computed across one is returned but not kept
+        self.generation = 0
+        self.dependents = None
+        self.pending = None
+        self.notification_handlers = []
+
+    def name(self):
+        return self.definition.name
+
+    def value(self):
+        if self.valid:
+            return self.cached
+        generation = self.generation
+        try:
+            value = self.definition.compute(self.parent.owner)
+        except Exception as err:
+            logger.debug("Derived field %s could not be computed: %s", self.definition.name, err)
+            value = None
+        if generation == self.generation:
+            self.cached = value
+            self.valid = True
+        return value
+
+    def effective_value(self):
+        return self.value()
+
+    def pending_value(self):
+        return None
+
+    def invalidate(self):
+        self.generation += 1
+        valid = self.valid
+        self.valid = False
+        if self.dependents is not None:
+            for d in self.dependents:
+                d.invalidate()
+        # a field with handlers is kept computed, so the change can be reported against the old value
+        if valid and self.notification_handlers:
+            self.parent.derived_changed(self, self.cached)
+
+    def add_dependent(self, derived):
+        if self.dependents is None:
+            self.dependents = []
+        self.dependents.append(derived)
+
+    def current_to_old(self):
+        pass
+
+    def get_field_changed(self):
+        return None
+
+    def add_notification_handler(self, handler):
+        self.notification_handlers.append(handler)
+        self.value()
+
+    def notify_changed(self, old):
+        new = self.value()
+        if old != new and self.parent.owner.parent.easymsx.field_notifications_enabled:
+            self.notify(Notification(self.parent.owner.get_notification_category(), Notification.NotificationType.FIELD, self.parent.owner, [FieldChange(self, old, new)]))
+
+    def notify(self, notification):
+        for h in self.notification_handlers:
+            if not notification.consumed:
+                h(notification)
+
+
+def expand_sources(derived_fields, names):
+    # derived fields stand for the raw fields they are computed from
+    found = set()
+    for name in names:
+        definition = derived_fields.get(name)
+        if definition is None:
+            found.add(name)
+        else:
+            found.update(expand_sources(derived_fields, definition.sources))
+    return found
+
+
+def exported_fields(easymsx, names):
+    # each requested derived field is exported for orders, routes or both, wherever it is registered
+    names = list(names)
+    unknown = [n for n in names if n not in easymsx.orders.derived_fields and n not in easymsx.routes.derived_fields]
+    if unknown:
+        raise ValueError("Not a derived field: " + ", ".join(unknown))
+    return [n for n in names if n in easymsx.orders.derived_fields], [n for n in names if n in easymsx.routes.derived_fields]
+
+
+def exported_value(row, name):
+    # exported as EMSX delivers raw values, as strings with "" for no value
+    value = row.field(name).value()
+    return "" if value is None else str(value)
+
+
+def number(row, name):
+    f = row.field(name)
+    value = None if f is None else f.value()
+    if value is None or value == "":
+        return None
+    return float(value)
+
+
+def percent_filled(row):
+    amount = number(row, "EMSX_AMOUNT")
+    filled = number(row, "EMSX_FILLED")
+    if not amount or filled is None:
+        return None
+    return 100.0 * filled / amount
+
+
+def remaining(row):
+    amount = number(row, "EMSX_AMOUNT")
+    filled = number(row, "EMSX_FILLED")
+    if amount is None or filled is None:
+        return None
+    return amount - filled
+
+
+def notional(row):
+    filled = number(row, "EMSX_FILLED")
+    price = number(row, "EMSX_AVG_PRICE")
+    if filled is None or price is None:
+        return None
+    return filled * price
+
+
+def fill_vs_limit_bps(row):
+    # positive when the average price is worse than the limit for the side
+    price = number(row, "EMSX_AVG_PRICE")
+    limit = number(row, "EMSX_LIMIT_PRICE")
+    if not price or not limit:
+        return None
+    distance = 10000.0 * (price - limit) / limit
+    side = row.field("EMSX_SIDE")
+    if side is not None and side.value() in ("SELL", "SHRT", "SS", "SSEX"):
+        return -distance
+    return distance
+
+
+STANDARD_DERIVED_FIELDS = (
+    ("PERCENT_FILLED", ("EMSX_AMOUNT", "EMSX_FILLED"), percent_filled),
+    ("REMAINING", ("EMSX_AMOUNT", "EMSX_FILLED"), remaining),
+    ("NOTIONAL", ("EMSX_FILLED", "EMSX_AVG_PRICE"), notional),
+    ("FILL_VS_LIMIT_BPS", ("EMSX_AVG_PRICE", "EMSX_LIMIT_PRICE", "EMSX_SIDE"), fill_vs_limit_bps),
+)
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
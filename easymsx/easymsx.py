@@ -1,13 +1,37 @@
 # easymsx.py
 
 import blpapi
+import functools
+import itertools
 import logging
+import threading
+import time
 from enum import Enum
+from easymsx.metrics import Metrics
+from easymsx.latency import LatencyTracker
+from easymsx.flightrecorder import FlightRecorder, TRIGGER_ERROR, TRIGGER_SLOW_CONSUMER
+from easymsx.recovery import SessionRecovery
+from easymsx.bulk import BulkOperation
+from easymsx.batchhandler import BatchHandler
+from easymsx.requesttemplate import RequestTemplate
+from easymsx.sharedcache import SharedCachePublisher
+from easymsx.fanout import FanoutServer
+from easymsx.changelog import ChangeLog
+from easymsx.sharding import ShardedDispatcher
+from easymsx.prioritizer import EventPrioritizer, PRIORITY_PATH_LABELS
+from easymsx.valuedictionary import ValueDictionary
+from easymsx.history import HistoryStore
+from easymsx.housekeeping import Housekeeper
+from easymsx.startup import StartupTracker, PHASE_SESSION, PHASE_SERVICE, PHASE_SCHEMA, PHASE_TEAMS, PHASE_BROKERS, PHASE_ORDERS, PHASE_ROUTES
 from easymsx.schemafielddefinition import SchemaFieldDefinition
 from easymsx.teams import Teams
+from easymsx.team import Team
 from easymsx.brokers import Brokers
 from easymsx.orders import Orders
 from easymsx.routes import Routes
+from easymsx.notification import Notification
+from easymsx.pendingchange import PendingChange
+from easymsx.fieldchange import FieldChange
 
 # ADMIN
 SLOW_CONSUMER_WARNING = blpapi.Name("SlowConsumerWarning")
@@ -24,24 +48,34 @@ SESSION_CONNECTION_DOWN = blpapi.Name("SessionConnectionDown")
 SERVICE_OPENED = blpapi.Name("ServiceOpened")
 SERVICE_OPEN_FAILURE = blpapi.Name("ServiceOpenFailure")
 
+# RESPONSE
+ERROR_INFO = blpapi.Name("ErrorInfo")
+
 # SUBSCRIPTION_STATUS + SUBSCRIPTION_DATA
 SUBSCRIPTION_FAILURE = blpapi.Name("SubscriptionFailure")
 SUBSCRIPTION_STARTED = blpapi.Name("SubscriptionStarted")
 SUBSCRIPTION_TERMINATED = blpapi.Name("SubscriptionTerminated")
 
+# metric labels for each event type, built once so the hot path does not allocate
+EVENT_TYPE_LABELS = dict((getattr(blpapi.Event, t), (("type", t),)) for t in (
+    "ADMIN", "SESSION_STATUS", "SUBSCRIPTION_STATUS", "REQUEST_STATUS", "RESPONSE", "PARTIAL_RESPONSE",
+    "SUBSCRIPTION_DATA", "SERVICE_STATUS", "TIMEOUT", "AUTHORIZATION_STATUS", "RESOLUTION_STATUS",
+    "TOPIC_STATUS", "TOKEN_STATUS", "REQUEST"))
+UNKNOWN_EVENT_LABELS = (("type", "UNKNOWN"),)
+
 logger = logging.getLogger(__name__)
 
 
 class EasyMSX:
 
-    # next correlation ID to be used
-    next_cor_id = 1
+    # source of correlation IDs for requests and subscriptions
+    cor_ids = itertools.count(1)
 
     class Environment(Enum):
         PRODUCTION = 0
         BETA = 1
 
-    def __init__(self, env=Environment.BETA, host="localhost", port=8194, lvl=logging.CRITICAL):
+    def __init__(self, env=Environment.BETA, host="localhost", port=8194, lvl=logging.CRITICAL, session_factory=None, enable_metrics=False, auto_recover=True, team=None, auto_start=False, pull_mode=False):
 
         self.set_log_level(lvl)
 
@@ -49,11 +83,16 @@ class EasyMSX:
         self.host = host
         self.port = port
 
-        self.external_wait = None
-        self.external_message = None
-
         self.notification_handlers = []
+        self.batch_handlers = []
+        self.notification_batch = []
+        self.batch_lock = threading.Lock()
+        # batches are flushed by events, by slice timers and by stop(), one at a time
+        self.batch_flush_lock = threading.RLock()
         self.request_message_handlers = {}
+        self.response_waiters = {}
+        self.request_templates = {}
+        self.pending_requests = {}
         self.subscription_message_handlers = {}
         self.order_fields = []
         self.route_fields = []
@@ -61,33 +100,127 @@ class EasyMSX:
         self.teams = None
 
         self.team = None
-
+        # team names subscribed side by side, None standing for the personal view
+        self.views = None
+
+        self.metrics = Metrics(enable_metrics)
+        self.flight_recorder = FlightRecorder()
+        # low cardinality string fields are shared between rows rather than copied into each
+        self.value_dictionary = ValueDictionary()
+        self.latency = LatencyTracker(self.metrics)
+
+        self.degradation = None
+        self.retention = None
+        self.rule_engine = None
+        self.history = None
+        self.scheduler = None
+        self.shared_cache = None
+        self.fanout_server = None
+        self.change_log = None
+        self.field_notifications_enabled = True
+        self.low_priority_handlers = []
+        self.low_priority_handlers_enabled = True
+        self.conflating = False
+        self.conflation_interval = 0.0
+        self.conflated = {}
+        self.conflation_started = 0.0
+        self.conflation_lock = threading.Lock()
+        self.dispatcher = None
+        self.prioritizer = None
+        self.request_start_times = {}
+
+        self.startup = StartupTracker(self.metrics)
+        self.recovery = SessionRecovery(self, enabled=auto_recover)
+        self.stopping = False
+        self.connected = False
+
+        # in pull mode the application's own loop drains the session through poll()
+        self.pull_mode = pull_mode
+        self.poll_thread = threading.current_thread()
+        self.housekeeper = Housekeeper(threaded=not pull_mode)
+
+        if session_factory is None:
+            session_factory = blpapi.Session
+
+        self.session_factory = session_factory
         self.session_options = blpapi.SessionOptions()
-        self.session = blpapi.Session(options=self.session_options, eventHandler=self.process_event)
+        self.session = self.create_session()
+        self.retired_session = None
         self.emsx_service = None
         self.order_route_fields = None
         self.brokers = None
-
-        self.initialize()
-
-        self.orders = Orders(self)
-        self.routes = Routes(self)
+        self.orders = None
+        self.routes = None
+
+        # a team known up front lets the subscriptions go out before GetTeams returns
+        if isinstance(team, (list, tuple)):
+            self.views = self.view_names(team)
+            named = [v for v in self.views if v is not None]
+            if named:
+                self.team = Team(None, named[0])
+        elif team is not None:
+            self.team = Team(None, team)
+
+        self.initialize(auto_start)
+
+        self.metrics.set_gauge("pending_requests", lambda: len(self.request_message_handlers))
+        self.metrics.set_gauge("subscriptions", lambda: len(self.subscription_message_handlers))
+        self.metrics.set_gauge("cached_orders", lambda: len(self.orders.orders))
+        self.metrics.set_gauge("cached_routes", lambda: len(self.routes.routes))
+        self.metrics.set_gauge("dictionary_values", self.value_dictionary.size)
 
     @staticmethod
     def set_log_level(lvl):
         logging.basicConfig(level=lvl)
 
-    def initialize(self):
+    def initialize(self, start_subscriptions=False):
 
+        startup = self.startup
+
+        startup.begin(PHASE_SESSION)
         self.initialize_session()
+        startup.finish(PHASE_SESSION)
+
+        startup.begin(PHASE_SERVICE)
         self.initialize_service()
+        startup.finish(PHASE_SERVICE)
+
+        startup.begin(PHASE_SCHEMA)
         self.initialize_field_data()
+        self.orders = Orders(self)
+        self.routes = Routes(self)
+        startup.finish(PHASE_SCHEMA)
+
+        # everything below is an independent round trip, so it is all issued before waiting on any of it
+        phases = [PHASE_TEAMS, PHASE_BROKERS]
+
+        startup.begin(PHASE_TEAMS, tracks_requests=True)
         self.initialize_teams()
+        startup.issued(PHASE_TEAMS)
+
+        startup.begin(PHASE_BROKERS, tracks_requests=True)
         self.initialize_broker_data()
+        startup.issued(PHASE_BROKERS)
+
+        if start_subscriptions:
+            phases += self.start_subscriptions()
+
+        self.wait_for(lambda: startup.complete(phases), lambda timeout: startup.wait(phases, timeout))
+
+        if self.team is not None and self.team.parent is None:
+            selected = self.teams.get(self.team.name)
+            if selected is None:
+                logger.warning("Team %s was not returned by GetTeams", self.team.name)
+            else:
+                self.team = selected
 
-        # wait until all request responses have been received
-        while len(self.request_message_handlers) > 0:
-            pass
+        logger.info("Startup complete:\n%s", startup.format_report())
+
+    def create_session(self):
+        # without an event handler blpapi queues events until nextEvent is called
+        if self.pull_mode:
+            return self.session_factory(options=self.session_options, eventHandler=None)
+        return self.session_factory(options=self.session_options, eventHandler=self.process_event)
 
     def initialize_session(self):
         if self.env == self.Environment.BETA:
@@ -152,11 +285,102 @@ class EasyMSX:
         self.brokers = Brokers(self)
 
     def start(self):
-        self.initialize_orders()
-        self.initialize_routes()
+        if self.orders.subscription_cid is not None:
+            return
+        phases = self.start_subscriptions()
+        self.wait_for(lambda: self.startup.complete(phases), lambda timeout: self.startup.wait(phases, timeout))
+        logger.info("Subscriptions painted:\n%s", self.startup.format_report())
+
+    def start_subscriptions(self):
+
+        # the order and route init paints do not depend on each other
+        self.startup.begin(PHASE_ORDERS)
+        self.orders.subscribe(wait=False)
+        self.startup.begin(PHASE_ROUTES)
+        self.routes.subscribe(wait=False)
+        return [PHASE_ORDERS, PHASE_ROUTES]
+
+    def startup_report(self):
+        return self.startup.report()
 
     def stop(self):
+        self.stopping = True
+        self.housekeeper.stop()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        if self.rule_engine is not None:
+            self.rule_engine.stop()
+        if self.prioritizer is not None:
+            self.prioritizer.stop()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        if self.shared_cache is not None:
+            self.shared_cache.close()
+        if self.fanout_server is not None:
+            self.fanout_server.close()
+        if self.change_log is not None:
+            self.change_log.close()
+        if self.retention is not None and self.retention.archive is not None:
+            self.retention.archive.close()
         self.session.stop()
+        # the last time slices are handed over rather than dropped
+        if self.batch_handlers:
+            self.flush_batches(force=True)
+
+    def recover_session(self, timeout=None):
+
+        # schema, teams and brokers are kept; only the session and subscriptions are rebuilt
+        self.fail_pending_requests()
+        if self.prioritizer is not None:
+            dropped = self.prioritizer.clear()
+            if dropped:
+                logger.warning("Dropping %d subscription event(s) queued from the terminated session", dropped)
+        self.subscription_message_handlers.clear()
+
+        self.retire_session(self.session)
+        self.session = self.create_session()
+        try:
+            self.initialize_session()
+            self.initialize_service()
+
+            if self.orders.subscription_cid is not None:
+                self.orders.resubscribe(wait=False)
+            if self.routes.subscription_cid is not None:
+                self.routes.resubscribe(wait=False)
+            if not (self.orders.wait_initialized(timeout) and self.routes.wait_initialized(timeout)):
+                raise ValueError("The init paint did not complete within %s seconds" % timeout)
+        except Exception:
+            # a failed attempt must not leave its session running next to the next attempt's
+            self.retire_session(self.session)
+            raise
+
+    def retire_session(self, session):
+        # its SESSION_TERMINATED is not a new loss, process_event ignores status events from it
+        self.retired_session = session
+        try:
+            session.stop()
+        except Exception as err:
+            logger.warning("Stopping the replaced session failed: %s", err)
+
+    def fail_pending_requests(self):
+
+        pending = list(self.request_message_handlers)
+        self.request_message_handlers.clear()
+        self.request_start_times.clear()
+        self.startup.requests_failed()
+        if self.scheduler is not None:
+            self.scheduler.reset()
+        for cid in list(self.pending_requests):
+            self.roll_back_pending(cid, "session terminated")
+
+        if pending:
+            logger.warning("Dropping %d request(s) pending on the terminated session", len(pending))
+
+        # release callers blocked in send_request
+        waiters = list(self.response_waiters.values())
+        self.response_waiters.clear()
+        for waiter in waiters:
+            waiter.release()
 
     def initialize_orders(self):
         self.orders.subscribe()
@@ -166,32 +390,272 @@ class EasyMSX:
 
     def set_team(self, selected_team):
         self.team = selected_team
+        self.views = None
+
+    @staticmethod
+    def view_names(teams):
+        if not teams:
+            raise ValueError("At least one team or the personal view is needed")
+        return [None if t is None else getattr(t, "name", t) for t in teams]
+
+    def set_teams(self, teams):
+        # several teams, or personal and team views, are subscribed over the one session into one cache
+        self.views = self.view_names(teams)
+        named = [v for v in self.views if v is not None]
+        if not named:
+            self.team = None
+        else:
+            selected = None if self.teams is None else self.teams.get(named[0])
+            self.team = selected if selected is not None else Team(None, named[0])
+
+    def subscription_views(self):
+        if self.views is not None:
+            return list(self.views)
+        return [None if self.team is None else self.team.name]
+
+    def set_request_scheduler(self, scheduler):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        self.scheduler = scheduler
+        if scheduler is not None:
+            scheduler.attach(self)
+
+    def set_degradation_policy(self, policy):
+        self.degradation = policy
+        if policy is not None:
+            policy.attach(self)
+
+    def set_dispatch_shards(self, shards):
+
+        # orders are partitioned by EMSX_SEQUENCE, 0 goes back to applying everything on the event thread
+        if self.dispatcher is not None:
+            self.dispatcher.drain()
+            self.dispatcher.stop()
+            self.dispatcher = None
+        if shards:
+            dispatcher = ShardedDispatcher(self, shards)
+            dispatcher.start()
+            self.dispatcher = dispatcher
+
+    def set_event_prioritization(self, enabled=True):
+
+        # subscription data is queued and applied behind responses, admin and session status events
+        if self.prioritizer is not None:
+            self.prioritizer.wait_idle()
+            self.prioritizer.stop()
+            self.prioritizer = None
+        if enabled:
+            prioritizer = EventPrioritizer(self, threaded=not self.pull_mode)
+            prioritizer.start()
+            self.prioritizer = prioritizer
+
+    def wait_dispatched(self, timeout=None):
+        if self.prioritizer is not None and not self.wait_for(lambda: self.prioritizer.depth() == 0 and not self.prioritizer.busy,
+                                                              self.prioritizer.wait_idle, timeout):
+            return False
+        if self.dispatcher is None:
+            return True
+        return self.dispatcher.drain(timeout)
+
+    def set_encoded_fields(self, fields, max_values=None):
+        # only affects values that arrive from now on; an empty list turns the encoding off
+        self.value_dictionary = ValueDictionary(fields) if max_values is None else ValueDictionary(fields, max_values)
+
+    def memory_report(self):
+        return self.value_dictionary.memory_report(list(self.orders) + list(self.routes))
+
+    def enable_history(self, max_per_row=256, max_total=1000000):
+        # per row ring buffers of field changes, rows seen before this call start with their next change
+        if self.history is not None:
+            self.history.detach()
+        self.history = HistoryStore(max_per_row, max_total)
+        self.history.attach(self)
+        return self.history
+
+    def field_history(self):
+        if self.history is None:
+            raise ValueError("Field history is not enabled, call enable_history() first")
+        return self.history
+
+    def set_rule_engine(self, engine):
+        if self.rule_engine is not None:
+            self.rule_engine.detach()
+        self.rule_engine = engine
+        if engine is not None:
+            engine.attach(self)
+
+    def set_retention_policy(self, policy):
+        if self.retention is not None:
+            self.retention.detach()
+        self.retention = policy
+        if policy is not None:
+            policy.attach(self)
+
+    def next_correlation_id(self):
+        return blpapi.CorrelationId(next(self.cor_ids))
+
+    def submit_request(self, req, message_handler, priority=None):
+
+        # register the handler before sending, the response can arrive before sendRequest returns
+        cid = self.next_correlation_id()
+        self.request_message_handlers[cid.value()] = message_handler
+        self.startup.request_submitted(cid.value())
+        self.issue_request(req, cid, priority)
+
+    def issue_request(self, req, cid, priority=None):
+        if self.scheduler is not None:
+            try:
+                self.scheduler.submit(req, cid, priority)
+            except ValueError:
+                self.request_failed(cid.value())
+                raise
+        else:
+            self.send_to_session(req, cid)
+
+    def dispatch_request(self, entry):
+
+        # called by the request scheduler once the request has a slot and a token
+        if self.metrics.enabled:
+            labels = (("operation", entry.operation),)
+            self.metrics.observe("request_queue_wait_ns", time.perf_counter_ns() - entry.enqueued_ns, labels)
+            self.metrics.incr("requests_sent_total", labels)
+        if not self.send_to_session(entry.request, entry.correlation_id):
+            self.scheduler.completed(entry.correlation_id.value())
+
+    def send_to_session(self, req, cid):
+
+        if self.metrics.enabled:
+            self.request_start_times[cid.value()] = (str(req.asElement().name()), time.perf_counter_ns())
 
-    def submit_request(self, req, message_handler):
         try:
-            cid = self.session.sendRequest(request=req)
-            self.request_message_handlers[cid.value()] = message_handler
-            logger.info("Request submitted (" + str(cid) + "): \n" + str(req))
+            self.session.sendRequest(request=req, correlationId=cid)
+            if self.flight_recorder.enabled:
+                self.flight_recorder.record("request.send", cid.value(), req)
+            return True
 
         except Exception as err:
-            logger.error("EasyMSX >>  Error submitting request: " + str(err))
+            self.request_failed(cid.value())
+            logger.error("EasyMSX >>  Error sending request: %s", err)
+            self.flight_recorder.trigger(TRIGGER_ERROR)
+            return False
+
+    def request_failed(self, cid):
+        # the request never reached the session
+        self.request_message_handlers.pop(cid, None)
+        self.request_start_times.pop(cid, None)
+        self.startup.response_finished(cid)
+        if self.pending_requests:
+            self.roll_back_pending(cid, "request failed")
+        waiter = self.response_waiters.pop(cid, None)
+        if waiter is not None:
+            waiter.release(sent=False)
 
     def subscribe(self, topic, message_handler):
+        cid = self.next_correlation_id()
         try:
-            self.next_cor_id += 1
-            cid = blpapi.CorrelationId(self.next_cor_id)
             subscriptions = blpapi.SubscriptionList()
             subscriptions.add(topic=topic, correlationId=cid)
-            self.session.subscribe(subscriptions)
             self.subscription_message_handlers[cid.value()] = message_handler
-            logger.info("Request submitted (" + str(cid) + "): \n" + str(topic))
+            self.session.subscribe(subscriptions)
+            logger.info("Subscription submitted (%s): \n%s", cid, topic)
+            return cid.value()
 
         except Exception as err:
-            logger.error("EasyMSX >>  Error subscribing to topic: " + str(err))
+            logger.error("EasyMSX >>  Error subscribing to topic: %s", err)
+            self.subscription_message_handlers.pop(cid.value(), None)
+            self.flight_recorder.trigger(TRIGGER_ERROR)
+
+    def poll(self, timeout=0.0, max_events=None):
+
+        # waits up to timeout seconds for an event, then drains what is already queued
+        if not self.pull_mode:
+            raise ValueError("poll() is only available when EasyMSX is created with pull_mode=True")
+
+        self.poll_thread = threading.current_thread()
+        session = self.session
+        prioritizer = self.prioritizer
+        # nextEvent(0) blocks forever, so short timeouts are rounded up to a millisecond; queued work means no waiting
+        if timeout > 0 and (prioritizer is None or prioritizer.depth() == 0):
+            event = session.nextEvent(max(1, int(timeout * 1000)))
+        else:
+            event = session.tryNextEvent()
+
+        processed = 0
+        t0 = time.perf_counter_ns()
+        while True:
+            # the session is read dry before each queued subscription event, so responses are never stuck behind a burst
+            if event is not None and event.eventType() != blpapi.Event.TIMEOUT:
+                if prioritizer is None or not prioritizer.queues(event):
+                    processed += 1
+                self.process_event(event, session)
+            elif prioritizer is not None and prioritizer.process_next():
+                processed += 1
+            else:
+                break
+            if max_events is not None and processed >= max_events:
+                break
+            event = session.tryNextEvent()
+
+        if self.rule_engine is not None:
+            self.rule_engine.advance()
+        self.housekeeper.advance()
+
+        if processed and self.metrics.enabled:
+            self.metrics.incr("polls_total")
+            self.metrics.observe("poll_busy_ns", time.perf_counter_ns() - t0)
+        return processed
+
+    def run_until(self, ready, timeout=None, poll_timeout=0.05, max_events=None):
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not ready():
+            wait = poll_timeout
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return ready()
+            self.poll(wait, max_events)
+        return True
+
+    def wait_for(self, ready, wait, timeout=None):
+
+        # in pull mode the loop thread has to drive the session while it waits, any other thread just blocks
+        if self.pull_mode and threading.current_thread() is self.poll_thread:
+            # with queued subscription data a waiter checks after every event rather than once the queue is empty
+            return self.run_until(ready, timeout, max_events=1 if self.prioritizer is not None else None)
+        return wait(timeout)
 
     def process_event(self, event, session):
 
-        logger.info("Processing Event (" + str(event.eventType()) + ") on session " + str(session))
+        if self.flight_recorder.enabled:
+            self.flight_recorder.record("event", event.eventType())
+
+        if self.metrics.enabled:
+            self.metrics.incr("events_total", EVENT_TYPE_LABELS.get(event.eventType(), UNKNOWN_EVENT_LABELS))
+
+        if session is self.retired_session and event.eventType() == blpapi.Event.SESSION_STATUS:
+            return False
+
+        prioritizer = self.prioritizer
+        if prioritizer is None:
+            self.dispatch_event(event, self.latency.event_received() if self.latency.enabled else None)
+            return False
+
+        received_ns = time.monotonic_ns()
+        if prioritizer.queues(event):
+            prioritizer.submit(event, received_ns, time.time_ns())
+            return False
+
+        self.dispatch_event(event, self.latency.event_received(received_ns) if self.latency.enabled else None)
+        if self.metrics.enabled:
+            self.metrics.observe("event_dispatch_ns", time.monotonic_ns() - received_ns, PRIORITY_PATH_LABELS)
+        return False
+
+    def dispatch_event(self, event, received=None):
+
+        # received is the event's (monotonic, wall clock) receive time when latency is tracked
+        if received is not None:
+            self.latency.apply(received)
 
         if event.eventType() == blpapi.Event.ADMIN:
             self.process_admin_event(event)
@@ -203,7 +667,7 @@ class EasyMSX:
             self.process_service_status_event(event)
 
         elif event.eventType() == blpapi.Event.SUBSCRIPTION_DATA:
-            self.process_subscription_data_event(event)
+            self.process_subscription_data_event(event, received)
 
         elif event.eventType() == blpapi.Event.SUBSCRIPTION_STATUS:
             self.process_subscription_status_event(event)
@@ -214,21 +678,27 @@ class EasyMSX:
         else:
             self.process_misc_events(event)
 
-        return False
+        if self.batch_handlers:
+            self.flush_batches()
 
-    @staticmethod
-    def process_admin_event(event):
+    def process_admin_event(self, event):
 
         logger.info("Processing ADMIN event...")
 
         for msg in event:
             if msg.messageType() == SLOW_CONSUMER_WARNING:
                 logger.warning("Slow Consumer Warning")
+                self.metrics.incr("slow_consumer_warnings_total")
+                self.flight_recorder.trigger(TRIGGER_SLOW_CONSUMER)
+                if self.degradation is not None:
+                    self.degradation.slow_consumer_warning()
             elif msg.messageType() == SLOW_CONSUMER_WARNING_CLEARED:
                 logger.warning("Slow Consumer Warning cleared")
+                self.metrics.incr("slow_consumer_warnings_cleared_total")
+                if self.degradation is not None:
+                    self.degradation.slow_consumer_warning_cleared()
 
-    @staticmethod
-    def process_session_status_event(event):
+    def process_session_status_event(self, event):
 
         logger.info("Processing SESSION_STATUS event...")
 
@@ -239,10 +709,18 @@ class EasyMSX:
                 logger.warning("Session Startup Failure")
             elif msg.messageType() == SESSION_TERMINATED:
                 logger.info("Session Terminated")
+                self.connected = False
+                # a terminated session is never reused, recovery starts a new one
+                if not self.stopping and self.orders is not None:
+                    self.metrics.incr("session_terminations_total")
+                    self.recovery.session_terminated()
             elif msg.messageType() == SESSION_CONNECTION_UP:
                 logger.info("Session Connection Up")
+                self.connected = True
             elif msg.messageType() == SESSION_CONNECTION_DOWN:
                 logger.info("Session Connection Down")
+                self.connected = False
+                self.metrics.incr("session_connection_down_total")
 
     @staticmethod
     def process_service_status_event(event):
@@ -255,27 +733,57 @@ class EasyMSX:
             elif msg.messageType() == SERVICE_OPEN_FAILURE:
                 logger.warning("Service Open Failure")
 
-    def process_subscription_data_event(self, event):
+    def process_subscription_data_event(self, event, received=None):
 
-        logger.info("Processing SUBSCRIPTION_DATA event...")
+        timed = self.metrics.enabled
+        if timed:
+            t0 = time.perf_counter_ns()
+            count = 0
 
+        dispatcher = self.dispatcher
+        if dispatcher is not None:
+            items = []
         for msg in event:
             cid = msg.correlationIds()[0].value()
             if cid in self.subscription_message_handlers:
-                self.subscription_message_handlers[cid](msg)
+                if dispatcher is not None:
+                    items.append((self.subscription_message_handlers[cid], msg))
+                elif timed:
+                    count += 1
+                    self.metrics.time_handler("subscription_handler_ns", self.subscription_message_handlers[cid], msg)
+                else:
+                    self.subscription_message_handlers[cid](msg)
             else:
-                logger.error("Unrecognised correlation ID in subscription data event. No event handler can be found for cid: " + str(cid))
+                logger.error("Unrecognised correlation ID in subscription data event. No event handler can be found for cid: %s", cid)
+                self.flight_recorder.trigger(TRIGGER_ERROR)
+
+        if dispatcher is not None:
+            dispatcher.dispatch(items, received)
+            if timed:
+                count = len(items)
+
+        if self.conflated and time.monotonic() - self.conflation_started >= self.conflation_interval:
+            self.flush_conflated()
+
+        if timed:
+            self.metrics.observe("subscription_data_event_ns", time.perf_counter_ns() - t0)
+            self.metrics.incr("subscription_messages_total", (), count)
 
     def process_subscription_status_event(self, event):
 
         logger.info("Processing SUBSCRIPTION_STATUS event...")
 
+        # a lost subscription is reconciled against a cache the shards have finished applying
+        if self.dispatcher is not None:
+            self.dispatcher.drain()
+
         for msg in event:
             cid = msg.correlationIds()[0].value()
             if cid in self.subscription_message_handlers:
                 self.subscription_message_handlers[cid](msg)
             else:
-                logger.error("Unrecognised correlation ID in subscription status event. No event handler can be found for cid: " + str(cid))
+                logger.error("Unrecognised correlation ID in subscription status event. No event handler can be found for cid: %s", cid)
+                self.flight_recorder.trigger(TRIGGER_ERROR)
 
     def process_response_event(self, event):
 
@@ -283,13 +791,24 @@ class EasyMSX:
 
         for msg in event:
             cid = msg.correlationIds()[0].value()
-            logger.debug("Received cid: " + str(cid))
+            if self.flight_recorder.enabled:
+                self.flight_recorder.record("response", cid, msg.messageType())
             if cid in self.request_message_handlers:
                 handler = self.request_message_handlers[cid]
+                if cid in self.request_start_times:
+                    operation, t0 = self.request_start_times.pop(cid)
+                    self.metrics.observe("request_round_trip_ns", time.perf_counter_ns() - t0, (("operation", operation),))
+                if self.scheduler is not None:
+                    self.scheduler.completed(cid)
+                if self.pending_requests and cid in self.pending_requests:
+                    self.settle_pending_request(cid, msg)
+                self.startup.response_started(cid)
                 handler(msg)
-                del self.request_message_handlers[cid]
+                self.request_message_handlers.pop(cid, None)
+                self.startup.response_finished(cid)
             else:
-                logger.error("Unrecognised correlation ID in response event. No event handler can be found for cID: " + str(cid))
+                logger.error("Unrecognised correlation ID in response event. No event handler can be found for cID: %s", cid)
+                self.flight_recorder.trigger(TRIGGER_ERROR)
 
     @staticmethod
     def process_misc_events(event):
@@ -297,42 +816,223 @@ class EasyMSX:
         logger.info("Processing unknown event...")
 
         for msg in event:
-            logger.info("Misc Event: " + msg)
+            logger.info("Misc Event: %s", msg)
 
-    def add_notification_handler(self, handler):
+    def add_notification_handler(self, handler, low_priority=False):
         self.notification_handlers.append(handler)
+        if low_priority:
+            self.low_priority_handlers.append(handler)
 
     def notify(self, notification):
+        timed = self.metrics.enabled
+        skip_low_priority = not self.low_priority_handlers_enabled
         for h in self.notification_handlers:
             if not notification.consumed:
-                h(notification)
+                if skip_low_priority and h in self.low_priority_handlers:
+                    continue
+                if notification.timestamps is not None:
+                    notification.timestamps.handler_invoked(h)
+                if timed:
+                    self.metrics.time_handler("notification_handler_ns", h, notification)
+                else:
+                    h(notification)
+        # whatever is left at the end of the chain is collected for the batch handlers
+        if self.batch_handlers and not notification.consumed:
+            # pending notifications are raised on the caller's thread
+            with self.batch_lock:
+                self.notification_batch.append(notification)
+
+    def add_batch_handler(self, handler, interval=None):
+        batch_handler = BatchHandler(handler, interval)
+        self.batch_handlers.append(batch_handler)
+        return batch_handler
+
+    def remove_batch_handler(self, handler):
+        self.batch_handlers = [b for b in self.batch_handlers if b.handler != handler and b is not handler]
+
+    def flush_batches(self, force=False):
+
+        # called after every event; a time slice is handed over by the first event after it expires, or by its timer
+        with self.batch_lock:
+            batch = self.notification_batch
+            if batch:
+                self.notification_batch = []
+        with self.batch_flush_lock:
+            now = time.monotonic()
+            for b in self.batch_handlers:
+                if b.add(batch, now) and b.interval:
+                    self.housekeeper.schedule(b.interval, functools.partial(self.flush_batch_slice, b, now))
+                if force or b.due(now):
+                    b.flush(self.metrics)
+
+    def flush_batch_slice(self, batch_handler, started):
+        # the slice may already have been handed over by an event, and a newer one has a timer of its own
+        with self.batch_flush_lock:
+            if batch_handler.pending and batch_handler.started == started:
+                batch_handler.flush(self.metrics)
+
+    def conflate(self, row, notification):
+        with self.conflation_lock:
+            self.conflate_locked(row, notification)
+
+    def conflate_locked(self, row, notification):
+
+        if not self.conflated:
+            self.conflation_started = started = time.monotonic()
+            if self.conflation_interval > 0:
+                # a stream that goes quiet would otherwise hold this window until the next event
+                self.housekeeper.schedule(self.conflation_interval, lambda: self.flush_conflation_window(started))
+
+        key = id(row)
+        pending = self.conflated.get(key)
+        if pending is None:
+            self.conflated[key] = (row, notification)
+            return
+
+        # keep the first old value and the latest new value of every field
+        merged = {}
+        for fc in pending[1].field_changes:
+            merged[fc.field.name()] = fc
+        for fc in notification.field_changes:
+            first = merged.get(fc.field.name())
+            merged[fc.field.name()] = fc if first is None else FieldChange(fc.field, first.old_value, fc.new_value)
+
+        notification_type = notification.type
+        if notification.type != Notification.NotificationType.DELETE and pending[1].type in (Notification.NotificationType.NEW, Notification.NotificationType.INITIALPAINT):
+            notification_type = pending[1].type
+
+        conflated = Notification(notification.category, notification_type, notification.source, list(merged.values()))
+        conflated.timestamps = pending[1].timestamps
+        self.conflated[key] = (row, conflated)
+
+    def flush_conflation_window(self, started):
+        # the window may already have been flushed by an event, and a newer one has a timer of its own
+        with self.conflation_lock:
+            if not self.conflated or self.conflation_started != started:
+                return
+        self.flush_conflated()
+
+    def take_conflated(self):
+        with self.conflation_lock:
+            pending = self.conflated
+            self.conflated = {}
+        return pending
+
+    def flush_conflated(self):
+        self.dispatch_conflated(self.take_conflated())
+
+    def dispatch_conflated(self, pending):
+        if pending and self.metrics.enabled:
+            self.metrics.incr("conflated_notifications_total", (), len(pending))
+        for row, notification in pending.values():
+            row.parent.dispatch(row, notification)
+
+    def send_request(self, req, message_handler=None, priority=None, pending=None):
+
+        # pending is a list of (order or route, {field: requested value}[, {field: interim values}]) shown on the cache until settled
+        cid = self.next_correlation_id()
+        if pending:
+            self.register_pending(cid.value(), pending)
+
+        if message_handler is None:
+            waiter = ResponseWaiter()
+            self.response_waiters[cid.value()] = waiter
+            self.request_message_handlers[cid.value()] = waiter.process_message
+            self.issue_request(req, cid, priority)
+            self.wait_for(waiter.event.is_set, waiter.wait)
+            self.response_waiters.pop(cid.value(), None)
+            return waiter.message
+
+        self.request_message_handlers[cid.value()] = message_handler
+        self.issue_request(req, cid, priority)
+
+    def register_pending(self, cid, pending):
+        changes = []
+        for entry in pending:
+            row, values = entry[0], entry[1]
+            interim = entry[2] if len(entry) > 2 else {}
+            for name, value in values.items():
+                change = row.fields.set_pending(name, value, cid, interim.get(name, ()))
+                if change is not None:
+                    changes.append((row.fields, change))
+        if changes:
+            self.pending_requests[cid] = changes
+
+    def settle_pending_request(self, cid, msg):
+        changes = self.pending_requests.pop(cid, ())
+        if msg.messageType() == ERROR_INFO:
+            reason = msg.getElementAsString("ERROR_MESSAGE")
+            for fields, change in changes:
+                fields.resolve(change, PendingChange.ROLLED_BACK, reason)
+        else:
+            for fields, change in changes:
+                fields.acknowledge(change)
 
-    def send_request(self, req, message_handler=None):
-        try:
-            if message_handler is None:
-                self.external_wait = True
-                cid = self.session.sendRequest(request=req)
-                self.request_message_handlers[cid.value()] = self.process_external_response
-                while self.external_wait:
-                    pass
-                return self.external_message
+    def roll_back_pending(self, cid, reason):
+        for fields, change in self.pending_requests.pop(cid, ()):
+            fields.resolve(change, PendingChange.ROLLED_BACK, reason)
 
-            else:
-                cid = self.session.sendRequest(request=req)
-                self.request_message_handlers[cid.value()] = message_handler
-                logger.debug("Request submitted (" + str(cid) + "): \n" + str(req))
+    def create_request(self, operation):
 
-        except Exception as err:
-            logger.error("EasyMSX >>  Error sending request: " + str(err))
+        return self.emsx_service.createRequest(operation)
 
-    def process_external_response(self, message):
+    def request_template(self, operation):
 
-        self.external_message = message
-        self.external_wait = False
+        # operation schemas are walked once per instance
+        template = self.request_templates.get(operation)
+        if template is None:
+            template = self.request_templates[operation] = RequestTemplate(self, operation)
+        return template
 
-    def create_request(self, operation):
+    def bulk_request(self, operation, items, window=50, priority=None, timeout=None):
 
-        return self.emsx_service.createRequest(operation)
+        # items are dicts of request fields, or a dict of field name -> column of values
+        return BulkOperation(self, operation, items, window, priority, timeout).run()
+
+    def publish_shared_cache(self, path, capacity=100000, row_size=None, ring_size=65536, derived_fields=()):
+
+        # mirrors the order and route cache into a file other processes can map read only; row_size defaults to the widest row the schema allows
+        if self.shared_cache is not None:
+            raise ValueError("The cache is already published at " + self.shared_cache.path)
+        publisher = SharedCachePublisher(self, path, capacity, row_size, ring_size, derived_fields)
+        publisher.start()
+        self.shared_cache = publisher
+        return publisher
+
+    def serve_fanout(self, address, max_buffered_bytes=16 * 1024 * 1024, derived_fields=()):
+
+        # one EMSX subscription, any number of local clients; address is a Unix socket path or (host, port)
+        if self.fanout_server is not None:
+            raise ValueError("The cache is already served on %s" % (self.fanout_server.address,))
+        self.fanout_server = FanoutServer(self, address, max_buffered_bytes, derived_fields=derived_fields)
+        self.fanout_server.start()
+        return self.fanout_server
+
+    def open_change_log(self, directory, segment_bytes=64 * 1024 * 1024, index_interval=64, max_queue=1000000, fsync=False):
+
+        # every applied order and route change, written away from the event thread
+        if self.change_log is not None:
+            raise ValueError("The change log is already open in " + self.change_log.directory)
+        self.change_log = ChangeLog(self, directory, segment_bytes, index_interval, max_queue, fsync)
+        self.change_log.start()
+        return self.change_log
+
+
+class ResponseWaiter:
+
+    def __init__(self):
+        self.message = None
+        self.event = threading.Event()
+
+    def process_message(self, message):
+        self.message = message
+        self.event.set()
+
+    def release(self, sent=True):
+        self.event.set()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
 
 
 __copyright__ = """
@@ -0,0 +1,554 @@
+# fanout.py
+
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+from .derivedfield import exported_fields, exported_value
+from .fieldchange import FieldChange
+from .notification import Notification
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 1
+
+KIND_ORDER = 0
+KIND_ROUTE = 1
+
+# frames are a length and a type followed by the body
+FRAME_HELLO = 1
+FRAME_ROW = 2
+FRAME_DELTA = 3
+FRAME_SNAPSHOT_END = 4
+FRAME_RESET = 5
+FRAME_EVICT = 6
+
+# notification type carried by snapshot rows
+SNAPSHOT = 255
+
+FRAME_HEADER = struct.Struct("<IB")
+# kind, notification type, EMSX sequence, route id, value count
+ROW_HEADER = struct.Struct("<BBqiH")
+# kind, EMSX sequence, route id
+ROW_KEY = struct.Struct("<Bqi")
+VALUE_LENGTH = struct.Struct("<I")
+# field index, value length
+DELTA_VALUE = struct.Struct("<HI")
+ROW_COUNT = struct.Struct("<Q")
+
+NOTIFICATION_TYPES = dict((t.value, t) for t in Notification.NotificationType)
+
+
+def frame(frame_type, body=b""):
+    return FRAME_HEADER.pack(len(body), frame_type) + body
+
+
+def encode_row(kind, notification_type, sequence, route_id, values):
+    parts = [ROW_HEADER.pack(kind, notification_type, sequence, route_id, len(values))]
+    for v in values:
+        data = v.encode("utf-8")
+        parts.append(VALUE_LENGTH.pack(len(data)))
+        parts.append(data)
+    return frame(FRAME_ROW, b"".join(parts))
+
+
+def encode_delta(kind, notification_type, sequence, route_id, changes):
+    # changes are (field index, value) pairs
+    parts = [ROW_HEADER.pack(kind, notification_type, sequence, route_id, len(changes))]
+    for index, v in changes:
+        data = v.encode("utf-8")
+        parts.append(DELTA_VALUE.pack(index, len(data)))
+        parts.append(data)
+    return frame(FRAME_DELTA, b"".join(parts))
+
+
+def create_socket(address):
+    # a string is a Unix socket path, anything else a (host, port) pair
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+
+class FanoutConnection:
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.condition = threading.Condition()
+        self.frames = []
+        self.buffered = 0
+        # a new connection starts with a snapshot, exactly like a client that fell behind
+        self.stale = True
+        self.synced_once = False
+        self.closed = False
+        self.resyncs = 0
+        self.thread = threading.Thread(target=self.run, name="EasyMSXFanoutClient", daemon=True)
+
+    def offer(self, data):
+
+        # called with the server lock held, never blocks on the socket
+        with self.condition:
+            if self.stale or self.closed:
+                return
+            if self.buffered + len(data) > self.server.max_buffered_bytes:
+                # a slow client is resynchronised from a fresh snapshot instead of queueing without bound
+                self.frames = []
+                self.buffered = 0
+                self.stale = True
+                self.resyncs += 1
+                if self.server.easymsx.metrics.enabled:
+                    self.server.easymsx.metrics.incr("fanout_resyncs_total")
+                logger.warning("Fan-out client fell more than %d bytes behind, resynchronising", self.server.max_buffered_bytes)
+            else:
+                self.frames.append(data)
+                self.buffered += len(data)
+            self.condition.notify()
+
+    def run(self):
+
+        try:
+            while True:
+                with self.condition:
+                    while not self.frames and not self.stale and not self.closed:
+                        self.condition.wait()
+                    if self.closed:
+                        return
+                    stale = self.stale
+
+                if stale:
+                    self.server.resynchronise(self)
+                    continue
+
+                with self.condition:
+                    batch = self.frames
+                    self.frames = []
+                    self.buffered = 0
+
+                data = b"".join(batch)
+                self.sock.sendall(data)
+                if self.server.easymsx.metrics.enabled:
+                    self.server.easymsx.metrics.incr("fanout_bytes_sent_total", (), len(data))
+
+        except OSError as e:
+            if not self.closed:
+                logger.info("Fan-out client disconnected: %s", e)
+        finally:
+            self.server.remove(self)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class FanoutServer:
+
+    def __init__(self, easymsx, address, max_buffered_bytes=16 * 1024 * 1024, backlog=16, derived_fields=()):
+
+        self.easymsx = easymsx
+        self.address = address
+        self.max_buffered_bytes = max_buffered_bytes
+        self.backlog = backlog
+        self.lock = threading.Lock()
+        self.clients = []
+        self.sock = None
+        self.closed = False
+
+        # derived fields are opted in by name, sent after the raw fields and again whenever one of their sources changes
+        order_derived, route_derived = exported_fields(easymsx, derived_fields)
+        self.derived = {
+            KIND_ORDER: [(name, easymsx.orders.source_fields([name])) for name in order_derived],
+            KIND_ROUTE: [(name, easymsx.routes.source_fields([name])) for name in route_derived],
+        }
+        self.names = {
+            KIND_ORDER: [f.name for f in easymsx.order_fields] + order_derived,
+            KIND_ROUTE: [f.name for f in easymsx.route_fields] + route_derived,
+        }
+        self.positions = dict((k, dict((n, i) for i, n in enumerate(v))) for k, v in self.names.items())
+        self.hello = frame(FRAME_HELLO, json.dumps({
+            "version": PROTOCOL_VERSION,
+            "orders": self.names[KIND_ORDER],
+            "routes": self.names[KIND_ROUTE],
+        }).encode("utf-8"))
+
+    def start(self):
+
+        self.sock = create_socket(self.address)
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+        else:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(self.address)
+        self.sock.listen(self.backlog)
+        # port 0 is resolved by the bind
+        self.address = self.sock.getsockname()
+
+        self.easymsx.orders.add_cache_listener(self.order_changed)
+        self.easymsx.routes.add_cache_listener(self.route_changed)
+        self.easymsx.orders.add_eviction_listener(self.order_evicted)
+        self.easymsx.routes.add_eviction_listener(self.route_evicted)
+        self.easymsx.metrics.set_gauge("fanout_clients", lambda: len(self.clients))
+
+        threading.Thread(target=self.accept, name="EasyMSXFanout", daemon=True).start()
+        logger.info("Serving the order and route cache on %s", self.address)
+        return self.address
+
+    def accept(self):
+
+        while not self.closed:
+            try:
+                sock, peer = self.sock.accept()
+            except OSError:
+                break
+            if sock.family != socket.AF_UNIX:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = FanoutConnection(self, sock)
+            with self.lock:
+                self.clients.append(client)
+            client.thread.start()
+            logger.info("Fan-out client connected from %s", peer)
+
+    def order_changed(self, o, notification):
+        self.publish(KIND_ORDER, o, 0, notification)
+
+    def route_changed(self, r, notification):
+        self.publish(KIND_ROUTE, r, r.route_id, notification)
+
+    def order_evicted(self, o):
+        self.offer(frame(FRAME_EVICT, ROW_KEY.pack(KIND_ORDER, o.sequence, 0)))
+
+    def route_evicted(self, r):
+        self.offer(frame(FRAME_EVICT, ROW_KEY.pack(KIND_ROUTE, r.sequence, r.route_id)))
+
+    def publish(self, kind, row, route_id, notification):
+
+        if not self.clients:
+            return
+
+        # new rows go out whole, updates carry only the cached fields that changed
+        notification_type = SNAPSHOT if notification is None else notification.type.value
+        if notification is None or notification.type in (Notification.NotificationType.NEW, Notification.NotificationType.INITIALPAINT):
+            data = encode_row(kind, notification_type, row.sequence, route_id, self.row_values(kind, row))
+        else:
+            cached = row.fields.field_index
+            positions = self.positions[kind]
+            changes = []
+            changed = set()
+            for fc in notification.field_changes:
+                name = fc.field.name()
+                if cached.get(name) is fc.field:
+                    changes.append((positions[name], fc.field.value()))
+                    changed.add(name)
+            for name, sources in self.derived[kind]:
+                if not changed.isdisjoint(sources):
+                    changes.append((positions[name], exported_value(row, name)))
+            if not changes:
+                return
+            data = encode_delta(kind, notification_type, row.sequence, route_id, changes)
+
+        self.offer(data)
+
+    def offer(self, data):
+        if not self.clients:
+            return
+        with self.lock:
+            for client in self.clients:
+                client.offer(data)
+
+    def row_values(self, kind, row):
+        return [f.value() for f in row.fields.fields] + [exported_value(row, name) for name, sources in self.derived[kind]]
+
+    def snapshot_frames(self, reset):
+
+        frames = [frame(FRAME_RESET) if reset else self.hello]
+        orders = list(self.easymsx.orders)
+        routes = list(self.easymsx.routes)
+        for o in orders:
+            frames.append(encode_row(KIND_ORDER, SNAPSHOT, o.sequence, 0, self.row_values(KIND_ORDER, o)))
+        for r in routes:
+            frames.append(encode_row(KIND_ROUTE, SNAPSHOT, r.sequence, r.route_id, self.row_values(KIND_ROUTE, r)))
+        frames.append(frame(FRAME_SNAPSHOT_END, ROW_COUNT.pack(len(orders) + len(routes))))
+        return frames
+
+    def resynchronise(self, client):
+
+        # runs on the client's writer thread; deltas queue from here on and are sent after the snapshot,
+        # which is read without the lock so publish never waits for it. A change the snapshot already
+        # shows is replayed by its delta, which carries new values only and leaves the row as it is.
+        with client.condition:
+            client.frames = []
+            client.buffered = 0
+            client.stale = False
+        frames = self.snapshot_frames(client.synced_once)
+        with client.condition:
+            if client.stale:
+                # fell behind again while the snapshot was read
+                return
+            client.frames = frames + client.frames
+            client.synced_once = True
+        if self.easymsx.metrics.enabled:
+            self.easymsx.metrics.incr("fanout_snapshots_total")
+
+    def remove(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+        if not client.closed:
+            client.close()
+
+    def close(self):
+
+        self.closed = True
+        self.easymsx.orders.remove_cache_listener(self.order_changed)
+        self.easymsx.routes.remove_cache_listener(self.route_changed)
+        self.easymsx.orders.remove_eviction_listener(self.order_evicted)
+        self.easymsx.routes.remove_eviction_listener(self.route_evicted)
+
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.unlink(self.address)
+
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.close()
+
+
+class CachedField:
+
+    __slots__ = ("row", "index")
+
+    def __init__(self, row, index):
+        self.row = row
+        self.index = index
+
+    def name(self):
+        return self.row.names[self.index]
+
+    def value(self):
+        return self.row.values[self.index]
+
+
+class CachedRow:
+
+    def __init__(self, kind, sequence, route_id, names, positions, values):
+        self.kind = kind
+        self.sequence = sequence
+        self.route_id = route_id
+        self.names = names
+        self.positions = positions
+        self.values = values
+
+    def field(self, name):
+        i = self.positions.get(name)
+        return None if i is None else CachedField(self, i)
+
+    def __repr__(self):
+        return "CachedRow(%s, %d, %d)" % ("order" if self.kind == KIND_ORDER else "route", self.sequence, self.route_id)
+
+
+class CachedRows:
+
+    # the read only counterpart of Orders and Routes
+    def __init__(self):
+        self.rows = []
+        self.index = {}
+
+    def __iter__(self):
+        return list(self.rows).__iter__()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_by_sequence_no(self, seq_no):
+        return self.index.get((seq_no, 0))
+
+    def get_by_sequence_no_and_id(self, seq_no, route_id):
+        return self.index.get((seq_no, route_id))
+
+    def put(self, row):
+        key = (row.sequence, row.route_id)
+        if key not in self.index:
+            self.rows.append(row)
+        else:
+            self.rows[self.rows.index(self.index[key])] = row
+        self.index[key] = row
+
+    def remove(self, sequence, route_id):
+        row = self.index.pop((sequence, route_id), None)
+        if row is not None:
+            self.rows.remove(row)
+        return row
+
+    def clear(self):
+        self.rows = []
+        self.index = {}
+
+
+class FanoutClient:
+
+    def __init__(self, address):
+        self.address = address
+        self.orders = CachedRows()
+        self.routes = CachedRows()
+        self.names = None
+        self.positions = None
+        self.notification_handlers = []
+        self.synced = threading.Event()
+        self.snapshots = 0
+        self.sock = None
+        self.closed = False
+        self.thread = None
+
+    def connect(self, timeout=None):
+
+        self.sock = create_socket(self.address)
+        self.sock.connect(self.address)
+        self.thread = threading.Thread(target=self.run, name="EasyMSXFanoutReader", daemon=True)
+        self.thread.start()
+        if timeout is not None:
+            self.wait_synced(timeout)
+        return self
+
+    def wait_synced(self, timeout=None):
+        return self.synced.wait(timeout)
+
+    def add_notification_handler(self, handler):
+        self.notification_handlers.append(handler)
+
+    def notify(self, notification):
+        for h in self.notification_handlers:
+            if not notification.consumed:
+                h(notification)
+
+    def read_exactly(self, length):
+        data = bytearray()
+        while len(data) < length:
+            chunk = self.sock.recv(length - len(data))
+            if not chunk:
+                raise EOFError("Fan-out server closed the connection")
+            data.extend(chunk)
+        return bytes(data)
+
+    def run(self):
+
+        try:
+            while not self.closed:
+                length, frame_type = FRAME_HEADER.unpack(self.read_exactly(FRAME_HEADER.size))
+                self.apply(frame_type, self.read_exactly(length))
+        except (OSError, EOFError) as e:
+            if not self.closed:
+                logger.error("Fan-out connection lost: %s", e)
+        finally:
+            self.synced.clear()
+
+    def apply(self, frame_type, body):
+
+        if frame_type == FRAME_HELLO:
+            schema = json.loads(body.decode("utf-8"))
+            if schema["version"] != PROTOCOL_VERSION:
+                raise ValueError("Unsupported fan-out protocol version %d" % schema["version"])
+            self.names = {KIND_ORDER: schema["orders"], KIND_ROUTE: schema["routes"]}
+            self.positions = dict((k, dict((n, i) for i, n in enumerate(v))) for k, v in self.names.items())
+
+        elif frame_type == FRAME_RESET:
+            self.synced.clear()
+            self.orders.clear()
+            self.routes.clear()
+
+        elif frame_type == FRAME_SNAPSHOT_END:
+            self.snapshots += 1
+            self.synced.set()
+
+        elif frame_type == FRAME_ROW:
+            kind, notification_type, sequence, route_id, count = ROW_HEADER.unpack_from(body, 0)
+            pos = ROW_HEADER.size
+            values = []
+            for i in range(0, count):
+                length = VALUE_LENGTH.unpack_from(body, pos)[0]
+                pos += VALUE_LENGTH.size
+                values.append(body[pos:pos + length].decode("utf-8"))
+                pos += length
+            row = CachedRow(kind, sequence, route_id, self.names[kind], self.positions[kind], values)
+            self.collection(kind).put(row)
+            changes = [FieldChange(CachedField(row, i), "", v) for i, v in enumerate(values) if v != ""]
+            self.deliver(row, notification_type, changes)
+
+        elif frame_type == FRAME_DELTA:
+            kind, notification_type, sequence, route_id, count = ROW_HEADER.unpack_from(body, 0)
+            row = self.collection(kind).get_by_sequence_no_and_id(sequence, route_id)
+            if row is None:
+                logger.error("Fan-out update for unknown row %d/%d", sequence, route_id)
+                return
+            pos = ROW_HEADER.size
+            changes = []
+            for i in range(0, count):
+                index, length = DELTA_VALUE.unpack_from(body, pos)
+                pos += DELTA_VALUE.size
+                value = body[pos:pos + length].decode("utf-8")
+                pos += length
+                changes.append(FieldChange(CachedField(row, index), row.values[index], value))
+                row.values[index] = value
+            self.deliver(row, notification_type, changes)
+
+        elif frame_type == FRAME_EVICT:
+            # the server dropped the row from its cache, EMSX did not delete it
+            kind, sequence, route_id = ROW_KEY.unpack(body)
+            self.collection(kind).remove(sequence, route_id)
+
+        else:
+            logger.error("Unknown fan-out frame type %d", frame_type)
+
+    def collection(self, kind):
+        return self.orders if kind == KIND_ORDER else self.routes
+
+    def deliver(self, row, notification_type, changes):
+        if not self.notification_handlers:
+            return
+        category = Notification.NotificationCategory.ORDER if row.kind == KIND_ORDER else Notification.NotificationCategory.ROUTE
+        t = Notification.NotificationType.INITIALPAINT if notification_type == SNAPSHOT else NOTIFICATION_TYPES[notification_type]
+        self.notify(Notification(category, t, row, changes))
+
+    def close(self):
+        self.closed = True
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -15,9 +15,24 @@ class Field:
         self.__current_value = value
         self.__old_value = ""
         self.notification_handlers = []
+        self.pending = None
+        # derived fields computed from this one, created when one is first read
+        self.dependents = None
         
     def value(self):
         return self.__current_value
+
+    def old_value(self):
+        return self.__old_value
+
+    def pending_value(self):
+        pending = self.pending
+        return None if pending is None else pending.value
+
+    def effective_value(self):
+        # the locally requested value while a modification is in flight, otherwise the cached one
+        pending = self.pending
+        return self.__current_value if pending is None else pending.value
     
     def name(self):
         return self.__name
@@ -26,7 +41,12 @@ class Field:
         if self.__current_value != value:
             self.current_to_old()
             self.__current_value = value
-            self.notify(Notification(self.parent.owner.get_notification_category(), Notification.NotificationType.FIELD, self.parent.owner, [self.get_field_changed()]))                     
+            if self.dependents is not None:
+                for d in self.dependents:
+                    d.invalidate()
+            # field level notifications are only built when someone listens for them
+            if self.notification_handlers and self.parent.owner.parent.easymsx.field_notifications_enabled:
+                self.notify(Notification(self.parent.owner.get_notification_category(), Notification.NotificationType.FIELD, self.parent.owner, [self.get_field_changed()]))                     
 
     def current_to_old(self):
         self.__old_value = self.__current_value
@@ -37,9 +57,13 @@ class Field:
             fc = FieldChange(self, self.__old_value, self.__current_value)
             return fc
         else:
-            logging.debug("Field NOT changed   Old: " + self.__old_value + "\t New: " + self.__current_value)
             return None
         
+    def add_dependent(self, derived):
+        if self.dependents is None:
+            self.dependents = []
+        self.dependents.append(derived)
+
     def add_notification_handler(self, handler):
         self.notification_handlers.append(handler)
         
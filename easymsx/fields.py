@@ -1,6 +1,10 @@
 # fields.py
 
 from .field import Field
+from .derivedfield import DerivedField
+from .fieldchange import FieldChange
+from .notification import Notification
+from .pendingchange import PendingChange
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,7 +15,13 @@ class Fields:
     def __init__(self, owner):
         self.owner = owner
         self.fields = []
+        self.field_index = {}
         self.field_changes = []
+        # created on first use, most rows never have a pending change
+        self.pending = None
+        self.derived = None
+        # derived fields to report once the message being applied is complete
+        self.derived_changes = None
         
         self.load_fields()
         
@@ -20,6 +30,7 @@ class Fields:
         for sdf in self.owner.parent.field_source:
             f = Field(self, sdf.name, "")
             self.fields.append(f)
+            self.field_index[sdf.name] = f
 
     def populate_fields(self, msg, dynamic_fields_only):
         
@@ -27,7 +38,15 @@ class Fields:
 
         field_count = msg.numElements()
 
+        emsx = self.owner.parent.easymsx
+        recorder = emsx.flight_recorder
+        tracing = recorder.enabled
+        dictionaries = emsx.value_dictionary.tables
+        definitions = self.owner.parent.field_definitions
+
         self.field_changes = []
+        if self.derived is not None:
+            self.derived_changes = {}
         
         for i in range(0, field_count):
             load = True
@@ -38,11 +57,7 @@ class Fields:
                 field_name = "EMSX_ORDER_REF_ID"
             
             if dynamic_fields_only:
-                fld = None
-                for sdf in self.owner.parent.field_source:
-                    if sdf.name == field_name:
-                        fld = sdf
-                
+                fld = definitions.get(field_name)
                 if (fld is not None) and fld.is_static():
                     load = False
                     
@@ -51,28 +66,150 @@ class Fields:
                 if fd is None:
                     fd = Field(self, field_name)
                 
-                fd.set_value(f.getValueAsString())
+                value = f.getValueAsString()
+                table = dictionaries.get(field_name)
+                if table is not None:
+                    value = table.canonical(value)
+                fd.set_value(value)
 
-                logger.debug("loaded field: " + fd.name() + "\tValue: " + fd.value())
-                
                 fc = fd.get_field_changed()
                 if fc is not None:
-                    logger.info("Added field to fieldChanges list")
                     self.field_changes.append(fc)
 
+                if tracing:
+                    recorder.record("field", field_name, fd.value(), fc is not None)
+
+        if self.pending:
+            self.settle_pending()
+
+        if self.derived_changes is not None:
+            changed, self.derived_changes = self.derived_changes, None
+            for d, old in changed.items():
+                d.notify_changed(old)
+
+    def derived_changed(self, derived, old):
+        # computed from the whole message rather than from whichever of its sources was applied first
+        if self.derived_changes is None:
+            derived.notify_changed(old)
+        else:
+            self.derived_changes.setdefault(derived, old)
+
     def current_to_old_values(self):
         for f in self.fields:
             f.current_to_old()
     
     def field(self, name):
-        for f in self.fields:
-            if f.name() == name:
-                return f
-        
-        return None
+        f = self.field_index.get(name)
+        if f is None and self.owner.parent.derived_fields:
+            return self.derived_field(name)
+        return f
+
+    def derived_field(self, name):
+        definition = self.owner.parent.derived_fields.get(name)
+        if definition is None:
+            return None
+        if self.derived is None:
+            self.derived = {}
+        d = self.derived.get(name)
+        if d is None:
+            d = DerivedField(self, definition)
+            self.derived[name] = d
+            for source in definition.sources:
+                f = self.field(source)
+                if f is not None:
+                    f.add_dependent(d)
+        return d
     
     def get_field_changes(self):
         return self.field_changes
+
+    def get_cached_field_changes(self):
+        # excludes message elements that are not cached fields, such as EVENT_STATUS
+        return [fc for fc in self.field_changes if self.field_index.get(fc.field.name()) is fc.field]
+
+    def has_pending(self):
+        return bool(self.pending)
+
+    def set_pending(self, name, value, correlation_id, interim=()):
+
+        f = self.field(name)
+        if f is None:
+            return None
+
+        # shown as EMSX would deliver it, cached values are strings
+        change = PendingChange(f, str(value), correlation_id, interim)
+        with self.owner.parent.lock:
+            if self.pending is None:
+                self.pending = {}
+            previous = self.pending.get(name)
+            self.pending[name] = change
+            f.pending = change
+            superseded = previous is not None and self.close(previous, PendingChange.ROLLED_BACK, "superseded by a newer request")
+
+        if superseded:
+            self.notify_pending(previous)
+        self.notify_pending(change)
+        return change
+
+    def acknowledge(self, change):
+        with self.owner.parent.lock:
+            if change.state != PendingChange.PENDING:
+                return
+            change.state = PendingChange.ACKNOWLEDGED
+            # the update may have arrived before the response
+            confirmed = change.matches(change.field.value()) and self.close(change, PendingChange.CONFIRMED)
+        if confirmed:
+            self.notify_pending(change)
+
+    def settle_pending(self):
+        settled = []
+        with self.owner.parent.lock:
+            for change in list(self.pending.values()):
+                value = change.field.value()
+                if change.matches(value):
+                    self.close(change, PendingChange.CONFIRMED)
+                    settled.append(change)
+                elif change.state == PendingChange.ACKNOWLEDGED and change.field.get_field_changed() is not None and not change.is_interim(value):
+                    self.close(change, PendingChange.ROLLED_BACK, "superseded by a different value")
+                    settled.append(change)
+        for change in settled:
+            self.notify_pending(change)
+
+    def resolve(self, change, state, reason=""):
+        with self.owner.parent.lock:
+            closed = self.close(change, state, reason)
+        if closed:
+            self.notify_pending(change)
+
+    def close(self, change, state, reason=""):
+        # called under the collection lock so the caller and the event thread close a change once
+        if not change.is_open():
+            return False
+
+        change.state = state
+        change.reason = reason
+        if self.pending is not None and self.pending.get(change.field.name()) is change:
+            del self.pending[change.field.name()]
+        if change.field.pending is change:
+            change.field.pending = None
+        return True
+
+    def notify_pending(self, change):
+
+        f = change.field
+        if change.state == PendingChange.PENDING:
+            notification_type = Notification.NotificationType.PENDING
+            fc = FieldChange(f, f.value(), change.value)
+        elif change.state == PendingChange.CONFIRMED:
+            notification_type = Notification.NotificationType.CONFIRMED
+            fc = FieldChange(f, change.value, f.value())
+        else:
+            notification_type = Notification.NotificationType.ROLLEDBACK
+            fc = FieldChange(f, change.value, f.value())
+
+        notification = Notification(self.owner.get_notification_category(), notification_type, self.owner, [fc], error_message=change.reason)
+        notification.correlation_id = change.correlation_id
+        self.owner.parent.dispatch(self.owner, notification)
     
 
 __copyright__ = """
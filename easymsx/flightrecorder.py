@@ -0,0 +1,115 @@
+# flightrecorder.py
+
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TRIGGER_DEMAND = "demand"
+TRIGGER_ERROR = "error"
+TRIGGER_SLOW_CONSUMER = "slow_consumer"
+
+
+class FlightRecorder:
+
+    def __init__(self, capacity=8192, enabled=False, dump_path=None, dump_on=(TRIGGER_ERROR, TRIGGER_SLOW_CONSUMER), min_dump_interval=5.0):
+        self.capacity = capacity
+        self.enabled = enabled
+        self.dump_path = dump_path
+        self.dump_on = set(dump_on)
+        self.min_dump_interval = min_dump_interval
+        self.buffer = [None] * capacity
+        self.positions = itertools.count()
+        self.last_dump = None
+        self.dump_lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.buffer = [None] * self.capacity
+        self.positions = itertools.count()
+
+    def record(self, event, *args):
+        # callers check self.enabled first; nothing here is formatted until a dump
+        self.buffer[next(self.positions) % self.capacity] = (time.monotonic_ns(), threading.get_ident(), event, args)
+
+    def entries(self):
+        entries = [e for e in self.buffer if e is not None]
+        entries.sort(key=lambda e: e[0])
+        return entries
+
+    def format(self):
+        lines = []
+        previous = None
+        for ts, thread_id, event, args in self.entries():
+            delta = 0 if previous is None else (ts - previous) // 1000
+            previous = ts
+            lines.append("%d.%09d +%dus [%x] %s %s" % (ts // 1000000000, ts % 1000000000, delta, thread_id, event,
+                                                       " ".join(format_arg(a) for a in args)))
+        return lines
+
+    def dump(self, reason=TRIGGER_DEMAND, stream=None):
+
+        lines = ["EasyMSX flight recorder dump (%s), %d entries" % (reason, len([e for e in self.buffer if e is not None]))]
+        lines.extend(self.format())
+        text = "\n".join(lines) + "\n"
+
+        if stream is not None:
+            stream.write(text)
+        elif self.dump_path is not None:
+            with open(self.dump_path, "a") as f:
+                f.write(text)
+        else:
+            logger.warning(text)
+
+        return lines
+
+    def trigger(self, reason):
+
+        if not self.enabled or reason not in self.dump_on:
+            return False
+
+        # repeated errors or warnings should not turn into a stream of dumps
+        with self.dump_lock:
+            now = time.monotonic()
+            if self.last_dump is not None and now - self.last_dump < self.min_dump_interval:
+                return False
+            self.last_dump = now
+
+        self.dump(reason)
+        return True
+
+
+def format_arg(arg):
+    text = str(arg)
+    if "\n" in text:
+        text = " ".join(text.split())
+    return text
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,249 @@
+# history.py
+
+import array
+import collections
+import logging
+import math
+import threading
+import time
+
+from .notification import Notification
+from .valuedictionary import ValueDictionary
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_TYPES = {"Int32": int, "Int64": int, "Float32": float, "Float64": float}
+
+# a string value the history could not give a code to, its field has too many distinct values
+UNKNOWN_CODE = -1.0
+EMPTY = float("nan")
+
+# three array slots: a double timestamp, an unsigned short field slot and a double value
+ENTRY_BYTES = 8 + 2 + 8
+
+
+class RowHistory:
+
+    __slots__ = ("times", "slots", "values", "head", "wrapped", "since")
+
+    def __init__(self, since=None):
+        self.times = array.array("d")
+        self.slots = array.array("H")
+        self.values = array.array("d")
+        # index of the oldest entry once the ring is full
+        self.head = 0
+        self.wrapped = False
+        # changes before this time were never recorded; None when the row was tracked from its paint or creation
+        self.since = since
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, ts, slot, value, capacity):
+        if len(self.times) < capacity:
+            self.times.append(ts)
+            self.slots.append(slot)
+            self.values.append(value)
+            return 1
+        head = self.head
+        self.times[head] = ts
+        self.slots[head] = slot
+        self.values[head] = value
+        self.head = (head + 1) % capacity
+        self.wrapped = True
+        return 0
+
+    def entries(self):
+        # oldest first
+        n = len(self.times)
+        for i in range(0, n):
+            j = (self.head + i) % n
+            yield self.times[j], self.slots[j], self.values[j]
+
+
+class FieldSlots:
+
+    def __init__(self, field_source):
+        self.names = [sdf.name for sdf in field_source]
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.types = [NUMERIC_TYPES.get(sdf.type) for sdf in field_source]
+
+
+class HistoryStore:
+
+    def __init__(self, max_per_row=256, max_total=1000000, max_values=65536):
+
+        if max_per_row < 1 or max_total < max_per_row:
+            raise ValueError("History needs room for at least one row")
+
+        self.max_per_row = max_per_row
+        self.max_total = max_total
+        self.strings = None
+        self.max_values = max_values
+        self.slots = {}
+        # least recently changed first, whole rows are dropped from the front when over max_total
+        self.rows = collections.OrderedDict()
+        self.total = 0
+        self.dropped_rows = 0
+        # when each dropped row lost its history, until it is tracked again
+        self.dropped = {}
+        self.attached = None
+        self.easymsx = None
+        self.lock = threading.Lock()
+
+    def attach(self, easymsx):
+
+        self.easymsx = easymsx
+        # rows already cached are known as they are from here on, not before
+        self.attached = time.time()
+        self.slots = {
+            Notification.NotificationCategory.ORDER: FieldSlots(easymsx.order_fields),
+            Notification.NotificationCategory.ROUTE: FieldSlots(easymsx.route_fields),
+        }
+        strings = set()
+        for field_slots in self.slots.values():
+            strings.update(name for name, kind in zip(field_slots.names, field_slots.types) if kind is None)
+        self.strings = ValueDictionary(sorted(strings), self.max_values)
+
+        easymsx.metrics.set_gauge("history_entries", lambda: self.total)
+        easymsx.orders.add_cache_listener(self.changed)
+        easymsx.routes.add_cache_listener(self.changed)
+        easymsx.orders.add_eviction_listener(self.forget)
+        easymsx.routes.add_eviction_listener(self.forget)
+
+    def detach(self):
+        for collection in (self.easymsx.orders, self.easymsx.routes):
+            collection.remove_cache_listener(self.changed)
+            collection.remove_eviction_listener(self.forget)
+
+    def encode(self, name, kind, value):
+        if value == "" or value is None:
+            return EMPTY
+        if kind is not None:
+            try:
+                return float(value)
+            except ValueError:
+                return EMPTY
+        code = self.strings.encode(name, value)
+        return UNKNOWN_CODE if code is None else float(code)
+
+    def decode(self, name, kind, value):
+        if math.isnan(value):
+            return ""
+        if kind is not None:
+            return kind(value)
+        if value == UNKNOWN_CODE:
+            return None
+        return self.strings.decode(name, int(value))
+
+    def changed(self, row, notification):
+
+        field_slots = self.slots[notification.category]
+        ts = time.time()
+        with self.lock:
+            entry = self.rows.get(id(row))
+            if entry is None:
+                since = self.dropped.pop(id(row), None)
+                if since is None and notification.type not in (Notification.NotificationType.NEW, Notification.NotificationType.INITIALPAINT):
+                    since = self.attached
+                entry = (row, RowHistory(since))
+                self.rows[id(row)] = entry
+            else:
+                self.rows.move_to_end(id(row))
+            history = entry[1]
+
+            for fc in notification.field_changes:
+                name = fc.field.name()
+                slot = field_slots.index.get(name)
+                if slot is None:
+                    continue
+                self.total += history.append(ts, slot, self.encode(name, field_slots.types[slot], fc.new_value), self.max_per_row)
+
+            while self.total > self.max_total and len(self.rows) > 1:
+                key, (dropped, dropped_history) = self.rows.popitem(last=False)
+                self.total -= len(dropped_history)
+                self.dropped_rows += 1
+                self.dropped[key] = ts
+
+    def forget(self, row):
+        with self.lock:
+            self.dropped.pop(id(row), None)
+            entry = self.rows.pop(id(row), None)
+            if entry is not None:
+                self.total -= len(entry[1])
+
+    def entries(self, row):
+        # the entries held, oldest first, whether the ring has wrapped and the time they are complete from
+        with self.lock:
+            entry = self.rows.get(id(row))
+            if entry is None:
+                return [], False, self.dropped.get(id(row), self.attached)
+            return list(entry[1].entries()), entry[1].wrapped, entry[1].since
+
+    def history(self, row, name):
+
+        # (timestamp, value) for each change of the field still held, oldest first
+        field_slots = self.slots[row.get_notification_category()]
+        slot = field_slots.index.get(name)
+        if slot is None:
+            raise ValueError("No history is kept for field: " + str(name))
+        kind = field_slots.types[slot]
+        entries = self.entries(row)[0]
+        return [(ts, self.decode(name, kind, value)) for ts, s, value in entries if s == slot]
+
+    def as_of(self, row, ts):
+
+        # field values as they were at ts; a field whose older changes were overwritten, dropped or never recorded is left out
+        field_slots = self.slots[row.get_notification_category()]
+        entries, wrapped, since = self.entries(row)
+        # before the oldest entry of a ring that has wrapped, any field may have changed in what was overwritten
+        unknown = (wrapped and (not entries or ts < entries[0][0])) or (since is not None and ts < since)
+        values = {}
+        later = set()
+        for when, slot, value in entries:
+            if when <= ts:
+                values[slot] = value
+            elif slot not in values:
+                later.add(slot)
+
+        result = {}
+        for slot, name in enumerate(field_slots.names):
+            if slot in values:
+                result[name] = self.decode(name, field_slots.types[slot], values[slot])
+            elif slot not in later and not unknown:
+                f = row.field(name)
+                if f is not None:
+                    result[name] = f.value()
+        return result
+
+    def memory(self):
+        with self.lock:
+            return {
+                "rows": len(self.rows),
+                "entries": self.total,
+                "bytes": self.total * ENTRY_BYTES,
+                "dropped_rows": self.dropped_rows,
+                "distinct_strings": self.strings.size() if self.strings is not None else 0,
+            }
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,76 @@
+# housekeeping.py
+
+import logging
+import threading
+from .timerwheel import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+
+class Housekeeper:
+
+    # runs deferred work such as conflation flushes and retention sweeps when no event arrives to trigger it.
+    # In pull mode the wheel is advanced by poll() on the application's thread, otherwise by a thread of its own
+    def __init__(self, threaded=True, tick=0.05, slots=512):
+        self.wheel = TimerWheel(tick, slots)
+        self.lock = threading.Lock()
+        self.threaded = threaded
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def schedule(self, delay, action):
+        with self.lock:
+            timer = self.wheel.schedule(delay, action)
+            if self.threaded and self.thread is None and not self.stopping.is_set():
+                self.thread = threading.Thread(target=self.run, name="EasyMSXHousekeeping", daemon=True)
+                self.thread.start()
+        return timer
+
+    def cancel(self, timer):
+        with self.lock:
+            self.wheel.cancel(timer)
+
+    def advance(self, now=None):
+        with self.lock:
+            expired = self.wheel.advance(now)
+        # actions run outside the lock, so they can schedule their next run
+        for timer in expired:
+            try:
+                timer.item()
+            except Exception as err:
+                logger.error("Error in housekeeping task: %s", err)
+        return len(expired)
+
+    def run(self):
+        while not self.stopping.wait(self.wheel.tick):
+            self.advance()
+
+    def __len__(self):
+        return len(self.wheel)
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,160 @@
+# latency.py
+
+import collections
+import datetime
+import threading
+import time
+from .metrics import handler_name
+
+STAGE_RECEIVE_TO_CACHE = "receive_to_cache"
+STAGE_CACHE_TO_FIRST_HANDLER = "cache_to_first_handler"
+STAGE_RECEIVE_TO_LAST_HANDLER = "receive_to_last_handler"
+STAGE_SERVER_TO_RECEIVE = "server_to_receive"
+
+# EMSX time fields holding the server side time of the change, most precise first
+SERVER_TIME_FIELDS = ("EMSX_ROUTE_LAST_UPDATE_TIME_MICROSEC", "EMSX_ROUTE_LAST_UPDATE_TIME", "EMSX_LAST_FILL_TIME_MICROSEC")
+
+
+class NotificationTimestamps:
+
+    __slots__ = ("received_ns", "received_wall_ns", "cache_updated_ns", "handlers")
+
+    def __init__(self, received_ns, received_wall_ns, cache_updated_ns):
+        self.received_ns = received_ns
+        self.received_wall_ns = received_wall_ns
+        self.cache_updated_ns = cache_updated_ns
+        self.handlers = []
+
+    def handler_invoked(self, handler):
+        self.handlers.append((handler, time.monotonic_ns()))
+
+
+class LatencyTracker:
+
+    def __init__(self, metrics, sample_size=10000):
+        self.metrics = metrics
+        self.sample_size = sample_size
+        self.enabled = False
+        self.compare_server_time = False
+        self.server_time_fields = SERVER_TIME_FIELDS
+        self.server_timezone = None
+        self.lock = threading.Lock()
+        self.samples = {}
+        # the receive times of the event each thread is applying, set from the event or shard work item
+        self.applying = threading.local()
+
+    def enable(self, compare_server_time=False, server_time_fields=None, server_timezone=None):
+        self.compare_server_time = compare_server_time
+        if server_time_fields is not None:
+            self.server_time_fields = tuple(server_time_fields)
+        self.server_timezone = server_timezone
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+
+    @staticmethod
+    def event_received(received_ns=None, received_wall_ns=None):
+        # queued events are stamped with the time they came off the session, not when they were applied
+        return (time.monotonic_ns() if received_ns is None else received_ns,
+                time.time_ns() if received_wall_ns is None else received_wall_ns)
+
+    def apply(self, received):
+        self.applying.received = received
+
+    def stamp(self, notification):
+        cache_updated_ns = time.monotonic_ns()
+        received = getattr(self.applying, "received", None)
+        if received is None:
+            # a change made outside any event, a settled pending value for instance
+            received = (cache_updated_ns, time.time_ns())
+        notification.timestamps = NotificationTimestamps(received[0], received[1], cache_updated_ns)
+
+    def complete(self, notification):
+
+        ts = notification.timestamps
+        if ts is None:
+            return
+
+        self.add(STAGE_RECEIVE_TO_CACHE, ts.cache_updated_ns - ts.received_ns)
+
+        if ts.handlers:
+            self.add(STAGE_CACHE_TO_FIRST_HANDLER, ts.handlers[0][1] - ts.cache_updated_ns)
+            self.add(STAGE_RECEIVE_TO_LAST_HANDLER, ts.handlers[-1][1] - ts.received_ns)
+            for handler, invoked_ns in ts.handlers:
+                self.add("handler:" + handler_name(handler), invoked_ns - ts.received_ns)
+
+        if self.compare_server_time:
+            server_ns = self.server_time_ns(notification)
+            if server_ns is not None:
+                self.add(STAGE_SERVER_TO_RECEIVE, ts.received_wall_ns - server_ns)
+
+    def server_time_ns(self, notification):
+        # only a time field that changed in this message describes this message
+        changed = dict((fc.field.name(), fc.new_value) for fc in notification.field_changes)
+        for name in self.server_time_fields:
+            value = changed.get(name)
+            if value:
+                try:
+                    return self.seconds_since_midnight_to_ns(float(value))
+                except ValueError:
+                    continue
+        return None
+
+    def seconds_since_midnight_to_ns(self, seconds):
+        now = datetime.datetime.now(self.server_timezone)
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        # a time just before midnight received just after it belongs to the previous day
+        if seconds - (now - midnight).total_seconds() > 12 * 3600:
+            midnight -= datetime.timedelta(days=1)
+        return int((midnight.timestamp() + seconds) * 1e9)
+
+    def add(self, stage, value_ns):
+        with self.lock:
+            samples = self.samples.get(stage)
+            if samples is None:
+                samples = self.samples[stage] = collections.deque(maxlen=self.sample_size)
+            samples.append(value_ns)
+        if self.metrics.enabled:
+            self.metrics.observe("latency_ns", value_ns, (("stage", stage),))
+
+    def percentiles(self, pcts=(50, 90, 99, 99.9)):
+        with self.lock:
+            samples = dict((stage, sorted(s)) for stage, s in self.samples.items())
+
+        result = {}
+        for stage, ordered in samples.items():
+            if not ordered:
+                continue
+            stats = {"count": len(ordered), "max_ns": ordered[-1]}
+            for p in pcts:
+                k = min(len(ordered) - 1, int(p / 100.0 * len(ordered)))
+                stats["p%g_ns" % p] = ordered[k]
+            result[stage] = stats
+        return result
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,246 @@
+# metrics.py
+
+import bisect
+import http.server
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# histogram bucket upper bounds in nanoseconds: 1us doubling up to ~17s
+BUCKET_BOUNDS_NS = [1000 * (2 ** i) for i in range(0, 25)]
+
+
+class Histogram:
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_NS) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value_ns):
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS_NS, value_ns)] += 1
+        self.count += 1
+        self.sum += value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+
+    def percentile(self, pct):
+        if self.count == 0:
+            return 0
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                return BUCKET_BOUNDS_NS[i] if i < len(BUCKET_BOUNDS_NS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum_ns": self.sum,
+            "mean_ns": self.sum // self.count if self.count else 0,
+            "p50_ns": self.percentile(50),
+            "p90_ns": self.percentile(90),
+            "p99_ns": self.percentile(99),
+            "max_ns": self.max,
+        }
+
+
+class Metrics:
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.started = time.monotonic()
+        self.last_pull = (self.started, {})
+        self.server = None
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.monotonic()
+            self.last_pull = (self.started, {})
+
+    # labels are passed as a tuple of (name, value) pairs so that callers can
+    # keep them in constants and the hot path does not build dicts
+
+    def incr(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value_ns, labels=()):
+        key = (name, labels)
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram()
+            h.observe(value_ns)
+
+    def set_gauge(self, name, source, labels=()):
+        # source is called at pull time, so gauges cost nothing on the hot path
+        self.gauges[(name, labels)] = source
+
+    def time_handler(self, name, handler, arg):
+        t0 = time.perf_counter_ns()
+        try:
+            return handler(arg)
+        finally:
+            self.observe(name, time.perf_counter_ns() - t0, (("handler", handler_name(handler)),))
+
+    def snapshot(self):
+
+        now = time.monotonic()
+
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict((k, h.summary()) for k, h in self.histograms.items())
+
+        gauges = {}
+        for key, source in list(self.gauges.items()):
+            try:
+                gauges[key] = source()
+            except Exception as err:
+                logger.error("Metrics >> Error reading gauge %s: %s", key[0], err)
+
+        # rates are per second since the previous pull
+        last_time, last_counters = self.last_pull
+        elapsed = max(now - last_time, 1e-9)
+        rates = dict((k, (v - last_counters.get(k, 0)) / elapsed) for k, v in counters.items())
+        self.last_pull = (now, counters)
+
+        return {
+            "uptime_s": now - self.started,
+            "counters": counters,
+            "rates": rates,
+            "histograms": histograms,
+            "gauges": gauges,
+        }
+
+    def exposition(self):
+
+        # histograms keep the _ns unit of their name, so bucket bounds and sums are in nanoseconds
+        snap = self.snapshot()
+        lines = []
+        family(lines, "uptime_seconds", "gauge")
+        lines.append("easymsx_uptime_seconds %f" % snap["uptime_s"])
+
+        for name, samples in grouped(snap["counters"]):
+            family(lines, name, "counter")
+            for labels, value in samples:
+                lines.append("easymsx_%s%s %d" % (name, format_labels(labels), value))
+
+        for name, samples in grouped(snap["rates"]):
+            family(lines, name + "_rate", "gauge")
+            for labels, value in samples:
+                lines.append("easymsx_%s_rate%s %f" % (name, format_labels(labels), value))
+
+        for name, samples in grouped(snap["gauges"]):
+            family(lines, name, "gauge")
+            for labels, value in samples:
+                lines.append("easymsx_%s%s %s" % (name, format_labels(labels), value))
+
+        with self.lock:
+            histograms = dict((k, (list(h.buckets), h.count, h.sum)) for k, h in self.histograms.items())
+
+        for name, samples in grouped(histograms):
+            family(lines, name, "histogram")
+            for labels, (buckets, count, total) in samples:
+                cumulative = 0
+                for bound, n in zip(BUCKET_BOUNDS_NS, buckets):
+                    cumulative += n
+                    lines.append("easymsx_%s_bucket%s %d" % (name, format_labels(labels + (("le", "%d" % bound),)), cumulative))
+                lines.append("easymsx_%s_bucket%s %d" % (name, format_labels(labels + (("le", "+Inf"),)), count))
+                lines.append("easymsx_%s_sum%s %d" % (name, format_labels(labels), total))
+                lines.append("easymsx_%s_count%s %d" % (name, format_labels(labels), count))
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host="127.0.0.1", port=0):
+
+        metrics = self
+
+        class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = metrics.exposition().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                logger.debug("Metrics >> " + fmt % args)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        threading.Thread(target=self.server.serve_forever, name="EasyMSXMetrics", daemon=True).start()
+        return self.server.server_address
+
+    def stop_serving(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def handler_name(handler):
+    name = getattr(handler, "__qualname__", None)
+    if name is None:
+        name = type(handler).__qualname__
+    return name
+
+
+def grouped(samples):
+    # (name, labels) keys to one (name, [(labels, value)]) family per name, as the text format wants
+    families = {}
+    for (name, labels), value in samples.items():
+        families.setdefault(name, []).append((labels, value))
+    return sorted((name, sorted(values, key=lambda v: v[0])) for name, values in families.items())
+
+
+def family(lines, name, kind):
+    lines.append("# HELP easymsx_%s EasyMSX %s %s" % (name, kind, name))
+    lines.append("# TYPE easymsx_%s %s" % (name, kind))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels) + "}"
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
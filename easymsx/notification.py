@@ -17,6 +17,9 @@ class Notification:
         CANCEL = 4
         ERROR = 5
         FIELD = 6
+        PENDING = 7
+        CONFIRMED = 8
+        ROLLEDBACK = 9
 
     def __init__(self, notification_category, notification_type, notification_source, field_changes=None, error_code=0, error_message=""):
 
@@ -32,6 +35,8 @@ class Notification:
         self.error_code = error_code
         self.error_message = error_message
         self.consumed = False
+        self.timestamps = None
+        self.correlation_id = None
 
 
 __copyright__ = """
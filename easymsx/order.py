@@ -9,19 +9,42 @@ class Order:
     def __init__(self, parent):
         self.parent = parent
         self.sequence = 0
+        # the team views the order came through
+        self.views = None
+        # copies still due from the other views, by event status then view
+        self.echoes = None
         self.notification_handlers = []
         self.fields = Fields(self)
         
     def field(self, field_name):
         return self.fields.field(field_name)
 
+    def modify(self, values, message_handler=None):
+        # the requested values show as pending on the cached fields until EMSX confirms them
+        request_values = dict(values, EMSX_SEQUENCE=self.sequence)
+        req = self.parent.easymsx.request_template("ModifyOrderEx").create(request_values)
+        return self.parent.easymsx.send_request(req, message_handler, pending=[(self, values)])
+
+    def history(self, field_name):
+        return self.parent.easymsx.field_history().history(self, field_name)
+
+    def as_of(self, ts):
+        return self.parent.easymsx.field_history().as_of(self, ts)
+
     def add_notification_handler(self, handler):
         self.notification_handlers.append(handler)
 
     def notify(self, notification):
-        for h in self.notification_handlers:
-            if not notification.consumed:
-                h(notification)
+        if self.notification_handlers:
+            timed = self.parent.easymsx.metrics.enabled
+            for h in self.notification_handlers:
+                if not notification.consumed:
+                    if notification.timestamps is not None:
+                        notification.timestamps.handler_invoked(h)
+                    if timed:
+                        self.parent.easymsx.metrics.time_handler("notification_handler_ns", h, notification)
+                    else:
+                        h(notification)
         if not notification.consumed: 
             self.parent.notify(notification)
             
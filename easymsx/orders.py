@@ -1,12 +1,18 @@
 # orders.py
 
 import blpapi
+import threading
 from .order import Order
 from .notification import Notification
+from .sortedview import SortedView
+from .derivedfield import DerivedFieldDefinition, expand_sources
+from .startup import PHASE_ORDERS
 import logging
 
 SUBSCRIPTION_STARTED = blpapi.Name("SubscriptionStarted")
 SUBSCRIPTION_ACTIVATED = blpapi.Name("SubscriptionStreamsActivated")
+SUBSCRIPTION_FAILURE = blpapi.Name("SubscriptionFailure")
+SUBSCRIPTION_TERMINATED = blpapi.Name("SubscriptionTerminated")
 ORDER_ROUTE_FIELDS = blpapi.Name("OrderRouteFields")
 
 logger = logging.getLogger(__name__)
@@ -17,43 +23,157 @@ class Orders:
     def __init__(self, easymsx):
         self.easymsx = easymsx
         self.orders = []
+        self.index = {}
+        # shards create and evict orders concurrently
+        self.lock = threading.Lock()
         self.field_source = self.easymsx.order_fields
+        # built once per schema, so populating a row never scans the field list
+        self.field_definitions = dict((sdf.name, sdf) for sdf in self.field_source)
         self.initialized = False
+        self.initialized_event = threading.Event()
         self.notification_handlers = []
+        self.cache_listeners = []
+        self.sorted_views = []
+        self.eviction_listeners = []
+        self.derived_fields = {}
+        self.subscription_cid = None
+        # one subscription per team view, all painting into this cache
+        self.subscriptions = {}
+        self.painting = set()
+        self.team_index = {}
+        self.team_handlers = {}
+        self.reconciling = False
+        self.unseen = set()
         
     def __iter__(self):
         return self.orders.__iter__()
 
-    def subscribe(self):
-        
-        order_topic = self.easymsx.emsx_service_name + "/order"
-        if self.easymsx.team is not None:
-            order_topic += ";team=" + self.easymsx.team.name
-        order_topic += "?fields="   
-        for f in self.field_source:
-            if f.name == "EMSX_ORDER_REF_ID":
-                order_topic += "EMSX_ORD_REF_ID,"
-            else:
-                order_topic += f.name + ","
-            
-        order_topic = order_topic[:-1]  # truncate the trailing comma character
-        
-        self.easymsx.subscribe(order_topic, self.process_message)
-        
-        while not self.initialized:
-            pass
+    def subscribe(self, wait=True):
+
+        for view in self.easymsx.subscription_views():
+            order_topic = self.easymsx.emsx_service_name + "/order"
+            if view is not None:
+                order_topic += ";team=" + view
+            order_topic += "?fields="
+            for f in self.field_source:
+                if f.name == "EMSX_ORDER_REF_ID":
+                    order_topic += "EMSX_ORD_REF_ID,"
+                else:
+                    order_topic += f.name + ","
+
+            order_topic = order_topic[:-1]  # truncate the trailing comma character
+
+            cid = self.easymsx.subscribe(order_topic, self.process_message)
+            if cid is None:
+                logger.error("Order subscription for %s failed, its orders are left out", "the personal view" if view is None else "team " + view)
+                continue
+            self.subscriptions[cid] = view
+            self.painting.add(cid)
+            if self.subscription_cid is None:
+                self.subscription_cid = cid
+
+        if not self.subscriptions:
+            raise ValueError("No order subscription could be made")
+
+        if wait:
+            self.wait_initialized()
+
+    def wait_initialized(self, timeout=None):
+        return self.easymsx.wait_for(self.initialized_event.is_set, self.initialized_event.wait, timeout)
+
+    def resubscribe(self, wait=True):
+
+        # the cache is kept and the fresh init paint is diffed against it
+        for cid in self.subscriptions:
+            self.easymsx.subscription_message_handlers.pop(cid, None)
+        self.subscriptions = {}
+        self.painting = set()
+        self.subscription_cid = None
+        self.unseen = set(self.index)
+        for o in self.orders:
+            o.echoes = None
+        self.reconciling = True
+        self.initialized = False
+        self.initialized_event.clear()
+        self.subscribe(wait)
         
+    def create_orders(self, items, **kwargs):
+        return self.easymsx.bulk_request("CreateOrder", items, **kwargs)
+
+    def create_and_route_orders(self, items, **kwargs):
+        return self.easymsx.bulk_request("CreateOrderAndRouteEx", items, **kwargs)
+
+    def modify_orders(self, items, **kwargs):
+        return self.easymsx.bulk_request("ModifyOrderEx", items, **kwargs)
+
+    def delete_orders(self, sequences, **kwargs):
+        return self.easymsx.bulk_request("DeleteOrder", [{"EMSX_SEQUENCE": [seq]} for seq in sequences], **kwargs)
+
     def create_order(self, seq_no):
         o = Order(self)
         o.sequence = seq_no
-        self.orders.append(o)
+        with self.lock:
+            self.orders.append(o)
+            self.index[seq_no] = o
         return o
     
     def get_by_sequence_no(self, seq_no):
-        for o in self.orders:
-            if o.sequence == seq_no:
-                return o
-        return None
+        return self.index.get(seq_no)
+
+    def join_view(self, o, view):
+        # True when the order also came through another team view, so this copy may be a repeat
+        views = o.views
+        if views is None:
+            o.views = (view,)
+        elif view in views:
+            return len(views) > 1
+        else:
+            o.views = views + (view,)
+        with self.lock:
+            self.team_index.setdefault(view, {})[o.sequence] = o
+        return views is not None
+
+    @staticmethod
+    def is_echo(row, view, event_status):
+        # overlapping team views publish the same message on each subscription. Copies are matched per row by
+        # event status and counted per view, each stream keeps its own order
+        views = row.views
+        if views is None or len(views) < 2:
+            return False
+        if row.echoes is None:
+            row.echoes = {}
+        due = row.echoes.setdefault(event_status, {})
+        if due.get(view):
+            due[view] -= 1
+            return True
+        for other in views:
+            if other != view:
+                due[other] = due.get(other, 0) + 1
+        return False
+
+    def for_team(self, team):
+        # team is a Team, a team name or None for the personal view
+        members = self.team_index.get(getattr(team, "name", team))
+        return [] if members is None else list(members.values())
+
+    def add_team_notification_handler(self, team, handler):
+        self.team_handlers.setdefault(getattr(team, "name", team), []).append(handler)
+
+    def evict(self, seq_nos):
+        # drops orders from the cache and the index, the caller keeps whatever it needs of them
+        with self.lock:
+            evicted = [self.index.pop(seq_no) for seq_no in seq_nos if seq_no in self.index]
+            if evicted:
+                gone = set(id(o) for o in evicted)
+                self.orders = [o for o in self.orders if id(o) not in gone]
+                self.unseen.difference_update(seq_nos)
+                for o in evicted:
+                    for view in o.views or ():
+                        self.team_index[view].pop(o.sequence, None)
+        for listener in self.eviction_listeners:
+            for row in evicted:
+                listener(row)
+        return evicted
     
     def process_message(self, msg):
         
@@ -65,75 +185,230 @@ class Orders:
             logger.info("Order Subscription Activated...")
             return
 
+        if msg.messageType() == SUBSCRIPTION_TERMINATED or msg.messageType() == SUBSCRIPTION_FAILURE:
+            logger.warning("Order Subscription lost: %s", msg.messageType())
+            self.easymsx.recovery.subscription_lost(self)
+            return
+
         if msg.messageType() != ORDER_ROUTE_FIELDS:
             logger.warning("Unexpected event: %s", msg)
             return
 
         event_status = msg.getElementAsInteger("EVENT_STATUS")
+        cid = msg.correlationIds()[0].value()
+        view = self.subscriptions.get(cid)
         
         if event_status == 1:      # Heartbeat
             logger.debug("Order >> Heartbeat")
 
         elif event_status == 4:    # Initial paint
             seq_no = msg.getElementAsInteger("EMSX_SEQUENCE")
-            logger.debug("Order >> Event(4) >> SeqNo: " + str(seq_no))
+            if self.easymsx.flight_recorder.enabled:
+                self.easymsx.flight_recorder.record("order", 4, seq_no)
             o = self.get_by_sequence_no(seq_no)
+
+            if self.reconciling:
+                self.reconcile(o, seq_no, msg, view)
+                return
         
             if o is None:
+                if not self.admits(seq_no, msg, paint=True):
+                    return
                 o = self.create_order(seq_no)
+            repeat = self.join_view(o, view)
         
             o.fields.populate_fields(msg, False)
+            if repeat and not o.fields.get_cached_field_changes():
+                return
         
-            o.notify(Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.INITIALPAINT, o, o.fields.get_field_changes()))                     
+            self.deliver(o, Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.INITIALPAINT, o, o.fields.get_field_changes()))
         
         elif event_status == 6:    # New order
             seq_no = msg.getElementAsInteger("EMSX_SEQUENCE")
-            logger.debug("Order >> Event(6) >> SeqNo: " + str(seq_no))
+            if self.easymsx.flight_recorder.enabled:
+                self.easymsx.flight_recorder.record("order", 6, seq_no)
             o = self.get_by_sequence_no(seq_no)
         
             if o is None:
                 o = self.create_order(seq_no)
+            repeat = self.join_view(o, view)
         
             o.fields.populate_fields(msg, False)
+            if repeat and not o.fields.get_cached_field_changes():
+                return
 
-            o.notify(Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.NEW, o, o.fields.get_field_changes()))                     
+            self.deliver(o, Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.NEW, o, o.fields.get_field_changes()))
         
         elif event_status == 7:    # Update order
             seq_no = msg.getElementAsInteger("EMSX_SEQUENCE")
-            logger.debug("Order >> Event(7) >> SeqNo: " + str(seq_no))
+            if self.easymsx.flight_recorder.enabled:
+                self.easymsx.flight_recorder.record("order", 7, seq_no)
             o = self.get_by_sequence_no(seq_no)
         
             if o is None:
+                if not self.admits(seq_no, msg):
+                    return
                 logger.warning("WARNING >> update received for unknown order")
                 o = self.create_order(seq_no)
+            self.join_view(o, view)
+            if self.is_echo(o, view, event_status):
+                return
         
             o.fields.populate_fields(msg, True)
-            o.notify(Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.UPDATE, o, o.fields.get_field_changes()))                     
+            self.deliver(o, Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.UPDATE, o, o.fields.get_field_changes()))
 
         elif event_status == 8:    # Delete/Expired order
             
             seq_no = msg.getElementAsInteger("EMSX_SEQUENCE")
-            logger.debug("Order >> Event(8) >> SeqNo: " + str(seq_no))
+            if self.easymsx.flight_recorder.enabled:
+                self.easymsx.flight_recorder.record("order", 8, seq_no)
             o = self.get_by_sequence_no(seq_no)
             if o is None:
+                if not self.admits(seq_no, msg):
+                    return
                 o = self.create_order(seq_no)
                 o.fields.populate_fields(msg, False)
+            # never taken for a copy, an order can leave one team's view and stay in another
+            self.join_view(o, view)
 
             o.fields.field("EMSX_STATUS").set_value("DELETED")
  
-            o.notify(Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.DELETE, o, o.fields.get_field_changes()))                     
+            self.deliver(o, Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.DELETE, o, o.fields.get_field_changes()))
             
         elif event_status == 11:    # End of init paint
             logger.info("End of ORDER INIT_PAINT")
+            self.painting.discard(cid)
+            if self.painting:
+                return
+            if self.reconciling:
+                self.remove_unseen()
             self.initialized = True
+            self.initialized_event.set()
+            self.easymsx.startup.finish(PHASE_ORDERS)
+
+    def reconcile(self, o, seq_no, msg, view=None):
+
+        self.unseen.discard(seq_no)
+
+        if o is None:
+            if not self.admits(seq_no, msg, paint=True):
+                return
+            o = self.create_order(seq_no)
+            self.join_view(o, view)
+            o.fields.populate_fields(msg, False)
+            self.deliver(o, Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.NEW, o, o.fields.get_field_changes()))
+            return
+
+        self.join_view(o, view)
+        o.fields.populate_fields(msg, False)
+        changes = o.fields.get_cached_field_changes()
+        if changes:
+            self.deliver(o, Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.UPDATE, o, changes))
+
+    def admits(self, seq_no, msg, paint=False):
+        # orders the retention policy evicted are not rebuilt from late messages
+        retention = self.easymsx.retention
+        return retention is None or retention.admits_order(seq_no, msg, paint)
+
+    def remove_unseen(self):
+
+        # orders missing from the fresh init paint were deleted while we were away
+        for seq_no in self.unseen:
+            o = self.index[seq_no]
+            status = o.fields.field("EMSX_STATUS")
+            if status is None or status.value() == "DELETED":
+                continue
+            status.set_value("DELETED")
+            self.deliver(o, Notification(Notification.NotificationCategory.ORDER, Notification.NotificationType.DELETE, o, [status.get_field_changed()]))
+
+        self.unseen = set()
+        self.reconciling = False
             
-    def add_notification_handler(self, handler):
+    def deliver(self, o, notification):
+        # cache listeners see every change, whatever the handlers and conflation do with it
+        for listener in self.cache_listeners:
+            listener(o, notification)
+        if self.easymsx.conflating:
+            self.easymsx.conflate(o, notification)
+        else:
+            self.dispatch(o, notification)
+
+    def dispatch(self, o, notification):
+        latency = self.easymsx.latency
+        if latency.enabled:
+            latency.stamp(notification)
+            o.notify(notification)
+            latency.complete(notification)
+        else:
+            o.notify(notification)
+
+    def add_cache_listener(self, listener):
+        self.cache_listeners.append(listener)
+
+    def remove_cache_listener(self, listener):
+        if listener in self.cache_listeners:
+            self.cache_listeners.remove(listener)
+
+    def add_eviction_listener(self, listener):
+        self.eviction_listeners.append(listener)
+
+    def remove_eviction_listener(self, listener):
+        if listener in self.eviction_listeners:
+            self.eviction_listeners.remove(listener)
+
+    def add_sorted_view(self, key, reverse=False, where=None, fields=None, convert=None):
+        # key is a field name, a tuple of field names or a function of the order; fields lists what a key function or where reads
+        view = SortedView(self, key, reverse, where, fields, convert)
+        self.sorted_views.append(view)
+        self.add_cache_listener(view.changed)
+        self.add_eviction_listener(view.discard)
+        view.load()
+        return view
+
+    def add_derived_field(self, name, sources, compute):
+        # compute(order) runs on first read and again only after one of the sources has changed
+        if name in self.derived_fields or any(sdf.name == name for sdf in self.field_source):
+            raise ValueError("Field already defined: " + name)
+        for source in sources:
+            if source not in self.derived_fields and not any(sdf.name == source for sdf in self.field_source):
+                raise ValueError("Unknown source field for %s: %s" % (name, source))
+        definition = DerivedFieldDefinition(name, sources, compute)
+        self.derived_fields[name] = definition
+        return definition
+
+    def source_fields(self, names):
+        return expand_sources(self.derived_fields, names)
+
+    def remove_sorted_view(self, view):
+        if view in self.sorted_views:
+            self.sorted_views.remove(view)
+        self.remove_cache_listener(view.changed)
+        self.remove_eviction_listener(view.discard)
+
+    def add_notification_handler(self, handler, low_priority=False):
         self.notification_handlers.append(handler)
+        if low_priority:
+            self.easymsx.low_priority_handlers.append(handler)
         
     def notify(self, notification):
+        timed = self.easymsx.metrics.enabled
+        skip_low_priority = not self.easymsx.low_priority_handlers_enabled
         for h in self.notification_handlers:
-            if not notification.consumed: 
-                h(notification)
+            if not notification.consumed:
+                if skip_low_priority and h in self.easymsx.low_priority_handlers:
+                    continue
+                if notification.timestamps is not None:
+                    notification.timestamps.handler_invoked(h)
+                if timed:
+                    self.easymsx.metrics.time_handler("notification_handler_ns", h, notification)
+                else:
+                    h(notification)
+
+        if self.team_handlers and not notification.consumed:
+            for view in notification.source.views or ():
+                for h in self.team_handlers.get(view, ()):
+                    if not notification.consumed:
+                        h(notification)
 
         if not notification.consumed:
             self.easymsx.notify(notification)
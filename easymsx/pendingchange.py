@@ -0,0 +1,58 @@
+# pendingchange.py
+
+import time
+
+
+class PendingChange:
+
+    PENDING = "PENDING"
+    ACKNOWLEDGED = "ACKNOWLEDGED"
+    CONFIRMED = "CONFIRMED"
+    ROLLED_BACK = "ROLLED_BACK"
+
+    def __init__(self, field, value, correlation_id, interim=()):
+        self.field = field
+        self.value = value
+        # values the field passes through on the way to the requested one, such as CXLREQ before CANCEL
+        self.interim = interim
+        self.correlation_id = correlation_id
+        self.state = PendingChange.PENDING
+        self.reason = ""
+        self.created_ns = time.monotonic_ns()
+
+    def is_open(self):
+        return self.state in (PendingChange.PENDING, PendingChange.ACKNOWLEDGED)
+
+    def is_interim(self, actual):
+        return actual in self.interim
+
+    def matches(self, actual):
+        # cached values are strings as delivered by EMSX, 100 and "100.0" are the same amount
+        if str(self.value) == actual:
+            return True
+        try:
+            return float(self.value) == float(actual)
+        except (TypeError, ValueError):
+            return False
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,125 @@
+# prioritizer.py
+
+import blpapi
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# subscription events are applied in arrival order, everything else overtakes them
+QUEUED_EVENT_TYPES = frozenset((blpapi.Event.SUBSCRIPTION_DATA, blpapi.Event.SUBSCRIPTION_STATUS))
+
+PRIORITY_PATH_LABELS = (("path", "priority"),)
+BULK_PATH_LABELS = (("path", "bulk"),)
+
+
+class EventPrioritizer:
+
+    def __init__(self, easymsx, threaded=True):
+        self.easymsx = easymsx
+        self.condition = threading.Condition()
+        self.queue = collections.deque()
+        self.busy = False
+        self.stopping = False
+        # in pull mode the polling thread applies queued events in between reading the session
+        self.thread = threading.Thread(target=self.run, name="EasyMSXSubscriptionData", daemon=True) if threaded else None
+
+    def start(self):
+        self.easymsx.metrics.set_gauge("subscription_queue_depth", self.depth)
+        if self.thread is not None:
+            self.thread.start()
+
+    @staticmethod
+    def queues(event):
+        return event.eventType() in QUEUED_EVENT_TYPES
+
+    def submit(self, event, received_ns, received_wall_ns):
+        with self.condition:
+            self.queue.append((event, received_ns, received_wall_ns))
+            depth = len(self.queue)
+            self.condition.notify_all()
+        self.observe_depth(depth)
+
+    def observe_depth(self, depth):
+        degradation = self.easymsx.degradation
+        if degradation is not None:
+            degradation.observe_queue_depth(depth)
+
+    def process_next(self):
+
+        with self.condition:
+            if not self.queue:
+                return False
+            event, received_ns, received_wall_ns = self.queue.popleft()
+            depth = len(self.queue)
+            self.busy = True
+
+        emsx = self.easymsx
+        try:
+            emsx.dispatch_event(event, emsx.latency.event_received(received_ns, received_wall_ns) if emsx.latency.enabled else None)
+            if emsx.metrics.enabled:
+                emsx.metrics.observe("event_dispatch_ns", time.monotonic_ns() - received_ns, BULK_PATH_LABELS)
+        except Exception as err:
+            logger.error("Error applying a queued subscription event: %s", err)
+        finally:
+            # the depth is reported before going idle, so a drained queue has cleared any degradation
+            self.observe_depth(depth)
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+        return True
+
+    def run(self):
+
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+            self.process_next()
+
+    def wait_idle(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and not self.busy, timeout)
+
+    def depth(self):
+        return len(self.queue)
+
+    def clear(self):
+        with self.condition:
+            dropped = len(self.queue)
+            self.queue.clear()
+            self.condition.notify_all()
+        return dropped
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,144 @@
+# recovery.py
+
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SessionRecovery:
+
+    def __init__(self, easymsx, enabled=True, initial_delay=0.5, max_delay=30.0, max_attempts=None, paint_timeout=60.0):
+        self.easymsx = easymsx
+        self.enabled = enabled
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        # an attempt whose fresh init paint has not completed by then is failed and retried
+        self.paint_timeout = paint_timeout
+        self.lock = threading.Lock()
+        self.worker = None
+        self.session_lost = False
+        self.lost_subscriptions = []
+
+    def session_terminated(self):
+        if self.enabled:
+            with self.lock:
+                self.session_lost = True
+                self.start()
+
+    def subscription_lost(self, collection):
+        if self.enabled:
+            with self.lock:
+                if collection not in self.lost_subscriptions:
+                    self.lost_subscriptions.append(collection)
+                self.start()
+
+    def start(self):
+        # recovery waits for the new init paint, so it can never run on the event thread
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run, name="EasyMSXRecovery", daemon=True)
+            self.worker.start()
+
+    def run(self):
+        try:
+            while True:
+                with self.lock:
+                    if self.session_lost:
+                        # a new session resubscribes everything
+                        self.session_lost = False
+                        self.lost_subscriptions = []
+                        action = self.recover_session
+                    elif self.lost_subscriptions:
+                        collection = self.lost_subscriptions.pop(0)
+                        action = functools.partial(self.resubscribe, collection)
+                    else:
+                        self.worker = None
+                        return
+                try:
+                    action()
+                except Exception as err:
+                    logger.error("Recovery failed: %s", err)
+        finally:
+            # a worker that dies must not leave later terminations ignored
+            with self.lock:
+                if self.worker is threading.current_thread():
+                    self.worker = None
+                if self.worker is None and (self.session_lost or self.lost_subscriptions) and not self.easymsx.stopping:
+                    self.start()
+
+    def wait(self, timeout=None):
+        worker = self.worker
+        if worker is not None:
+            worker.join(timeout)
+        return self.worker is None
+
+    def recover_session(self):
+
+        delay = self.initial_delay
+        attempt = 0
+
+        while not self.easymsx.stopping:
+            attempt += 1
+            time.sleep(delay)
+            try:
+                logger.warning("Session recovery attempt %d", attempt)
+                self.easymsx.recover_session(self.paint_timeout)
+                self.easymsx.metrics.incr("session_recoveries_total")
+                logger.warning("Session recovered after %d attempt(s)", attempt)
+                return
+            except Exception as err:
+                logger.error("Session recovery attempt %d failed: %s", attempt, err)
+                self.easymsx.metrics.incr("session_recovery_failures_total")
+                if self.max_attempts is not None and attempt >= self.max_attempts:
+                    logger.error("Giving up session recovery after %d attempts", attempt)
+                    return
+                delay = min(delay * 2, self.max_delay)
+
+    def resubscribe(self, collection):
+
+        delay = self.initial_delay
+        attempt = 0
+
+        while not self.easymsx.stopping:
+            attempt += 1
+            logger.warning("Resubscribing %s after the subscription was lost, attempt %d", type(collection).__name__, attempt)
+            try:
+                collection.resubscribe(wait=False)
+            except ValueError as err:
+                logger.error("Resubscribing %s failed: %s", type(collection).__name__, err)
+            else:
+                if collection.wait_initialized(self.paint_timeout):
+                    self.easymsx.metrics.incr("resubscriptions_total")
+                    return
+                logger.error("Init paint for %s did not complete within %s seconds", type(collection).__name__, self.paint_timeout)
+            self.easymsx.metrics.incr("resubscription_failures_total")
+            if self.max_attempts is not None and attempt >= self.max_attempts:
+                logger.error("Giving up resubscribing %s after %d attempts", type(collection).__name__, attempt)
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,218 @@
+# requesttemplate.py
+
+import blpapi
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+
+def is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# value check and description for each simple schema type
+TYPE_CHECKS = {
+    blpapi.DataType.BOOL: (lambda v: isinstance(v, bool), "a bool"),
+    blpapi.DataType.CHAR: (lambda v: isinstance(v, str) and len(v) == 1, "a single character"),
+    blpapi.DataType.BYTE: (is_integer, "an integer"),
+    blpapi.DataType.INT32: (lambda v: is_integer(v) and INT32_MIN <= v <= INT32_MAX, "a 32 bit integer"),
+    blpapi.DataType.INT64: (is_integer, "an integer"),
+    blpapi.DataType.FLOAT32: (is_number, "a number"),
+    blpapi.DataType.FLOAT64: (is_number, "a number"),
+    blpapi.DataType.DECIMAL: (is_number, "a number"),
+    blpapi.DataType.STRING: (lambda v: isinstance(v, str), "a string"),
+    blpapi.DataType.ENUMERATION: (lambda v: isinstance(v, str), "a string"),
+    blpapi.DataType.BYTEARRAY: (lambda v: isinstance(v, bytes), "bytes"),
+    blpapi.DataType.DATE: (lambda v: isinstance(v, datetime.date), "a date"),
+    blpapi.DataType.TIME: (lambda v: isinstance(v, datetime.time), "a time"),
+    blpapi.DataType.DATETIME: (lambda v: isinstance(v, datetime.datetime), "a datetime"),
+}
+
+
+class RequestFieldDefinition:
+
+    def __init__(self, definition):
+
+        type_def = definition.typeDefinition()
+
+        self.name = str(definition.name())
+        self.key = definition.name()
+        self.datatype = type_def.datatype()
+        self.is_array = definition.maxValues() != 1
+        self.required = definition.minValues() > 0
+        self.is_complex = type_def.isComplexType()
+        self.type_check = TYPE_CHECKS.get(self.datatype)
+
+        self.children = {}
+        if self.is_complex:
+            for i in range(0, type_def.numElementDefinitions()):
+                child = RequestFieldDefinition(type_def.getElementDefinition(i))
+                self.children[child.name] = child
+
+        self.enumeration = None
+        if type_def.isEnumerationType():
+            constants = type_def.enumeration()
+            self.enumeration = set(str(constants.getConstantAt(i).getValueAsString()) for i in range(0, constants.numConstants()))
+
+    def check(self, value, path, problems):
+        if self.is_array:
+            if not isinstance(value, (list, tuple)):
+                problems.append("%s: expected a list, got %r" % (path, value))
+                return
+            for i, v in enumerate(value):
+                self.check_value(v, "%s[%d]" % (path, i), problems)
+        else:
+            self.check_value(value, path, problems)
+
+    def check_value(self, value, path, problems):
+
+        if self.is_complex:
+            if not isinstance(value, dict):
+                problems.append("%s: expected a dict, got %r" % (path, value))
+                return
+            for name, v in value.items():
+                child = self.children.get(name)
+                if child is None:
+                    problems.append("%s.%s: unknown field" % (path, name))
+                else:
+                    child.check(v, path + "." + name, problems)
+            return
+
+        if self.type_check is not None and not self.type_check[0](value):
+            problems.append("%s: expected %s, got %r" % (path, self.type_check[1], value))
+        elif self.enumeration is not None and value not in self.enumeration:
+            problems.append("%s: %r is not one of %s" % (path, value, ", ".join(sorted(self.enumeration))))
+
+    def populate(self, element, value):
+        if self.is_array:
+            array = element.getElement(self.key)
+            for v in value:
+                if self.is_complex:
+                    self.populate_children(array.appendElement(), v)
+                else:
+                    array.appendValue(v)
+        elif self.is_complex:
+            self.populate_children(element.getElement(self.key), value)
+        else:
+            element.setElement(self.key, value)
+
+    def populate_children(self, element, value):
+        for name, v in value.items():
+            self.children[name].populate(element, v)
+
+
+class RequestTemplate:
+
+    def __init__(self, easymsx, operation, fields=None, defaults=None):
+
+        self.easymsx = easymsx
+        self.operation = str(operation)
+
+        # the schema is walked once, templates derived with with_defaults share the result
+        if fields is None:
+            fields = self.load_fields(easymsx.emsx_service, self.operation)
+        self.fields = fields
+
+        self.defaults = {}
+        if defaults:
+            self.check(defaults)
+            self.defaults = dict((k, v) for k, v in defaults.items() if v is not None)
+
+    @staticmethod
+    def load_fields(service, operation):
+
+        if not service.hasOperation(operation):
+            raise ValueError("Unknown EMSX operation: " + operation)
+
+        type_def = service.getOperation(operation).requestDefinition().typeDefinition()
+        fields = {}
+        for i in range(0, type_def.numElementDefinitions()):
+            f = RequestFieldDefinition(type_def.getElementDefinition(i))
+            fields[f.name] = f
+        return fields
+
+    def with_defaults(self, defaults=None, **kwargs):
+        merged = dict(self.defaults)
+        merged.update(defaults or {})
+        merged.update(kwargs)
+        return RequestTemplate(self.easymsx, self.operation, self.fields, merged)
+
+    def validate(self, values):
+        problems = []
+        for name, value in values.items():
+            if value is None:
+                continue
+            f = self.fields.get(name)
+            if f is None:
+                problems.append("%s: unknown field for %s" % (name, self.operation))
+            else:
+                f.check(value, name, problems)
+        return problems
+
+    def missing(self, values):
+        # required fields neither given nor defaulted, only meaningful for a complete request
+        return ["%s: required by %s" % (name, self.operation) for name, f in self.fields.items()
+                if f.required and values.get(name) is None and name not in self.defaults]
+
+    def check(self, values, complete=False):
+        problems = self.validate(values)
+        if complete:
+            problems += self.missing(values)
+        if problems:
+            if self.easymsx.metrics.enabled:
+                self.easymsx.metrics.incr("requests_rejected_total", (("operation", self.operation),))
+            raise ValueError("Invalid %s request: %s" % (self.operation, "; ".join(problems)))
+
+    def create(self, values=None, **kwargs):
+
+        if kwargs:
+            values = dict(values or {}, **kwargs)
+        self.check(values or {}, complete=True)
+        return self.build(values)
+
+    def build(self, values):
+
+        # values must already have passed validate()
+        if not values:
+            values = self.defaults
+        elif self.defaults:
+            merged = dict(self.defaults)
+            merged.update(values)
+            values = merged
+
+        req = self.easymsx.create_request(self.operation)
+        element = req.asElement()
+        for name, value in values.items():
+            if value is not None:
+                self.fields[name].populate(element, value)
+        return req
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
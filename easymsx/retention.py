@@ -0,0 +1,318 @@
+# retention.py
+
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+KIND_ORDER = "order"
+KIND_ROUTE = "route"
+
+DEFAULT_TERMINAL_STATUSES = ("DELETED", "FILLED", "CANCEL", "EXPIRED")
+
+
+class ArchivedRow:
+
+    def __init__(self, kind, sequence, route_id, evicted_at, values):
+        self.kind = kind
+        self.sequence = sequence
+        self.route_id = route_id
+        self.evicted_at = evicted_at
+        self.values = values
+
+    def value(self, name):
+        return self.values.get(name)
+
+    def __repr__(self):
+        return "ArchivedRow(%s, %d, %d)" % (self.kind, self.sequence, self.route_id)
+
+
+class RowArchive:
+
+    def __init__(self, path):
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.db.execute("CREATE TABLE IF NOT EXISTS archive (kind TEXT, sequence INTEGER, route_id INTEGER, evicted_at REAL, fields TEXT, "
+                            "PRIMARY KEY (kind, sequence, route_id))")
+            self.db.commit()
+
+        # rows wait here until the writer has committed them, so lookups see them straight away
+        self.condition = threading.Condition()
+        self.queue = []
+        self.pending = {}
+        self.closing = False
+        self.thread = threading.Thread(target=self.run, name="EasyMSXArchive", daemon=True)
+        self.thread.start()
+
+    def put(self, kind, sequence, route_id, values):
+        record = (kind, sequence, route_id, time.time(), json.dumps(values))
+        with self.condition:
+            self.queue.append(record)
+            self.pending[(kind, sequence, route_id)] = record
+            self.condition.notify()
+
+    def run(self):
+
+        while True:
+            with self.condition:
+                while not self.queue and not self.closing:
+                    self.condition.wait()
+                if not self.queue:
+                    break
+                batch = self.queue
+                self.queue = []
+
+            try:
+                with self.lock:
+                    self.db.executemany("INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?, ?)", batch)
+                    self.db.commit()
+            except sqlite3.Error as e:
+                logger.error("Archive write failed: %s", e)
+
+            with self.condition:
+                for record in batch:
+                    key = record[:3]
+                    if self.pending.get(key) is record:
+                        del self.pending[key]
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending, timeout)
+
+    @staticmethod
+    def row(record):
+        kind, sequence, route_id, evicted_at, values = record
+        return ArchivedRow(kind, sequence, route_id, evicted_at, json.loads(values))
+
+    def lookup(self, kind, sequence, route_id=None):
+
+        with self.condition:
+            pending = [r for k, r in self.pending.items() if k[0] == kind and k[1] == sequence and (route_id is None or k[2] == route_id)]
+
+        query = "SELECT kind, sequence, route_id, evicted_at, fields FROM archive WHERE kind = ? AND sequence = ?"
+        args = [kind, sequence]
+        if route_id is not None:
+            query += " AND route_id = ?"
+            args.append(route_id)
+        with self.lock:
+            stored = self.db.execute(query, args).fetchall()
+
+        rows = dict((r[2], r) for r in stored)
+        rows.update((r[2], r) for r in pending)
+        return [self.row(rows[k]) for k in sorted(rows)]
+
+    def get_order(self, seq_no):
+        rows = self.lookup(KIND_ORDER, seq_no, 0)
+        return rows[0] if rows else None
+
+    def get_route(self, seq_no, route_id):
+        rows = self.lookup(KIND_ROUTE, seq_no, route_id)
+        return rows[0] if rows else None
+
+    def get_routes(self, seq_no):
+        return self.lookup(KIND_ROUTE, seq_no)
+
+    def count(self):
+        self.flush()
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM archive").fetchone()[0]
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join()
+        with self.lock:
+            self.db.close()
+
+
+class RetentionPolicy:
+
+    def __init__(self, statuses=DEFAULT_TERMINAL_STATUSES, max_age=None, max_terminal_rows=None, archive=None, sweep_interval=1.0,
+                 max_tombstones=100000):
+
+        if max_age is None and max_terminal_rows is None:
+            raise ValueError("A retention policy needs a maximum age or a maximum number of terminal rows")
+
+        self.statuses = frozenset(statuses)
+        self.max_age = max_age
+        self.max_terminal_rows = max_terminal_rows
+        self.archive = archive
+        self.sweep_interval = sweep_interval
+        self.easymsx = None
+        # rows in the order they became terminal, with the time they did
+        self.terminal = {KIND_ORDER: collections.OrderedDict(), KIND_ROUTE: collections.OrderedDict()}
+        # keys of the latest evicted rows, so a late update does not bring them back
+        self.tombstones = {KIND_ORDER: collections.OrderedDict(), KIND_ROUTE: collections.OrderedDict()}
+        self.max_tombstones = max_tombstones
+        self.evicted = {KIND_ORDER: 0, KIND_ROUTE: 0}
+        self.suppressed = {KIND_ORDER: 0, KIND_ROUTE: 0}
+        self.timer = None
+        # changes arrive from every dispatch shard
+        self.lock = threading.RLock()
+
+    def attach(self, easymsx):
+
+        self.easymsx = easymsx
+        for kind in (KIND_ORDER, KIND_ROUTE):
+            easymsx.metrics.set_gauge("retention_terminal_rows", lambda kind=kind: len(self.terminal[kind]), (("kind", kind),))
+
+        for o in list(easymsx.orders):
+            self.track(KIND_ORDER, o.sequence, o)
+        for r in list(easymsx.routes):
+            self.track(KIND_ROUTE, (r.sequence, r.route_id), r)
+
+        easymsx.orders.add_cache_listener(self.order_changed)
+        easymsx.routes.add_cache_listener(self.route_changed)
+
+        # rows age out whether or not anything else changes
+        if self.max_age is not None:
+            with self.lock:
+                self.timer = easymsx.housekeeper.schedule(self.sweep_interval, self.scheduled_sweep)
+
+    def detach(self):
+        self.easymsx.orders.remove_cache_listener(self.order_changed)
+        self.easymsx.routes.remove_cache_listener(self.route_changed)
+        with self.lock:
+            if self.timer is not None:
+                self.easymsx.housekeeper.cancel(self.timer)
+                self.timer = None
+
+    def scheduled_sweep(self):
+        with self.lock:
+            if self.timer is None:
+                return
+            self.sweep_locked()
+            self.timer = self.easymsx.housekeeper.schedule(self.sweep_interval, self.scheduled_sweep)
+
+    def order_changed(self, o, notification):
+        with self.lock:
+            self.track(KIND_ORDER, o.sequence, o)
+            self.maybe_sweep()
+
+    def route_changed(self, r, notification):
+        with self.lock:
+            self.track(KIND_ROUTE, (r.sequence, r.route_id), r)
+            self.maybe_sweep()
+
+    def track(self, kind, key, row):
+        status = row.fields.field("EMSX_STATUS")
+        terminal = self.terminal[kind]
+        if status is not None and status.value() in self.statuses:
+            if key not in terminal:
+                terminal[key] = time.monotonic()
+        elif key in terminal:
+            # an order can come back to life, a cancel that was rejected for instance
+            del terminal[key]
+
+    def maybe_sweep(self):
+
+        # the row cap is kept as changes are applied, ages are swept by the housekeeping timer
+        if self.max_terminal_rows is not None:
+            if any(len(t) > self.max_terminal_rows for t in self.terminal.values()):
+                self.sweep()
+
+    def admits_order(self, seq_no, msg, paint=False):
+        return self.admits(KIND_ORDER, seq_no, msg, paint)
+
+    def admits_route(self, seq_no, route_id, msg, paint=False):
+        return self.admits(KIND_ROUTE, (seq_no, route_id), msg, paint)
+
+    def admits(self, kind, key, msg, paint=False):
+
+        # a row evicted as terminal is not rebuilt from a late update; a paint brings it back only once it is live again
+        with self.lock:
+            retired = key in self.tombstones[kind]
+        if not retired and not paint and self.archive is not None:
+            # evicted before the tombstones were kept, by an earlier run for instance
+            sequence, route_id = (key, 0) if kind == KIND_ORDER else key
+            retired = bool(self.archive.lookup(kind, sequence, route_id))
+        if not retired:
+            return True
+
+        if paint and msg.hasElement("EMSX_STATUS") and msg.getElementAsString("EMSX_STATUS") not in self.statuses:
+            with self.lock:
+                self.tombstones[kind].pop(key, None)
+            return True
+
+        with self.lock:
+            self.suppressed[kind] += 1
+        if self.easymsx.metrics.enabled:
+            self.easymsx.metrics.incr("retention_suppressed_total", (("kind", kind),))
+        logger.debug("Ignoring a message for evicted %s %s", kind, key)
+        return False
+
+    def sweep(self, now=None):
+        with self.lock:
+            return self.sweep_locked(now)
+
+    def sweep_locked(self, now=None):
+
+        now = time.monotonic() if now is None else now
+        evicted = 0
+
+        for kind, terminal in self.terminal.items():
+            victims = []
+            excess = 0 if self.max_terminal_rows is None else len(terminal) - self.max_terminal_rows
+            for key, since in terminal.items():
+                if len(victims) < excess or (self.max_age is not None and now - since >= self.max_age):
+                    victims.append(key)
+                else:
+                    break
+            if victims:
+                evicted += self.evict(kind, victims)
+
+        return evicted
+
+    def evict(self, kind, keys):
+
+        collection = self.easymsx.orders if kind == KIND_ORDER else self.easymsx.routes
+        rows = collection.evict(keys)
+        terminal = self.terminal[kind]
+        tombstones = self.tombstones[kind]
+        for key in keys:
+            terminal.pop(key, None)
+            tombstones[key] = True
+        while len(tombstones) > self.max_tombstones:
+            tombstones.popitem(last=False)
+
+        if self.archive is not None:
+            for row in rows:
+                route_id = 0 if kind == KIND_ORDER else row.route_id
+                self.archive.put(kind, row.sequence, route_id, dict((f.name(), f.value()) for f in row.fields.fields))
+
+        self.evicted[kind] += len(rows)
+        if self.easymsx.metrics.enabled:
+            self.easymsx.metrics.incr("retention_evicted_total", (("kind", kind),), len(rows))
+        logger.debug("Evicted %d terminal %ss", len(rows), kind)
+        return len(rows)
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
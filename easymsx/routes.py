@@ -1,11 +1,17 @@
 # routes.py
 
 import blpapi
+import threading
 from .route import Route
 from .notification import Notification
+from .sortedview import SortedView
+from .derivedfield import DerivedFieldDefinition, expand_sources
+from .startup import PHASE_ROUTES
 import logging
 
 SUBSCRIPTION_STARTED = blpapi.Name("SubscriptionStarted")
+SUBSCRIPTION_FAILURE = blpapi.Name("SubscriptionFailure")
+SUBSCRIPTION_TERMINATED = blpapi.Name("SubscriptionTerminated")
 ORDER_ROUTE_FIELDS = blpapi.Name("OrderRouteFields")
 
 logger = logging.getLogger(__name__)
@@ -16,41 +22,154 @@ class Routes:
     def __init__(self, easymsx):
         self.easymsx = easymsx
         self.routes = []
+        self.index = {}
+        # shards create and evict routes concurrently
+        self.lock = threading.Lock()
         self.field_source = self.easymsx.route_fields
+        # built once per schema, so populating a row never scans the field list
+        self.field_definitions = dict((sdf.name, sdf) for sdf in self.field_source)
         self.notification_handlers = []
+        self.cache_listeners = []
+        self.sorted_views = []
+        self.eviction_listeners = []
+        self.derived_fields = {}
         self.initialized = False
+        self.initialized_event = threading.Event()
+        self.subscription_cid = None
+        # one subscription per team view, all painting into this cache
+        self.subscriptions = {}
+        self.painting = set()
+        self.team_index = {}
+        self.team_handlers = {}
+        self.reconciling = False
+        self.unseen = set()
         
     def __iter__(self):
         return self.routes.__iter__()
 
-    def subscribe(self):
-        
-        route_topic = self.easymsx.emsx_service_name + "/route"
-        if self.easymsx.team is not None:
-            route_topic += ";team=" + self.easymsx.team.name
-        route_topic += "?fields="   
-        for f in self.field_source:
-            route_topic += f.name + ","
-            
-        route_topic = route_topic[:-1]  # truncate the trailing comma character
-        
-        self.easymsx.subscribe(route_topic, self.process_message)
-        
-        while not self.initialized:
-            pass
+    def subscribe(self, wait=True):
+
+        for view in self.easymsx.subscription_views():
+            route_topic = self.easymsx.emsx_service_name + "/route"
+            if view is not None:
+                route_topic += ";team=" + view
+            route_topic += "?fields="
+            for f in self.field_source:
+                route_topic += f.name + ","
+
+            route_topic = route_topic[:-1]  # truncate the trailing comma character
+
+            cid = self.easymsx.subscribe(route_topic, self.process_message)
+            if cid is None:
+                logger.error("Route subscription for %s failed, its routes are left out", "the personal view" if view is None else "team " + view)
+                continue
+            self.subscriptions[cid] = view
+            self.painting.add(cid)
+            if self.subscription_cid is None:
+                self.subscription_cid = cid
+
+        if not self.subscriptions:
+            raise ValueError("No route subscription could be made")
+
+        if wait:
+            self.wait_initialized()
+
+    def wait_initialized(self, timeout=None):
+        return self.easymsx.wait_for(self.initialized_event.is_set, self.initialized_event.wait, timeout)
+
+    def resubscribe(self, wait=True):
+
+        # the cache is kept and the fresh init paint is diffed against it
+        for cid in self.subscriptions:
+            self.easymsx.subscription_message_handlers.pop(cid, None)
+        self.subscriptions = {}
+        self.painting = set()
+        self.subscription_cid = None
+        self.unseen = set(self.index)
+        for r in self.routes:
+            r.echoes = None
+        self.reconciling = True
+        self.initialized = False
+        self.initialized_event.clear()
+        self.subscribe(wait)
         
+    def route_orders(self, items, **kwargs):
+        return self.easymsx.bulk_request("RouteEx", items, **kwargs)
+
+    def modify_routes(self, items, **kwargs):
+        return self.easymsx.bulk_request("ModifyRouteEx", items, **kwargs)
+
+    def cancel_routes(self, routes, **kwargs):
+        # one request per route keeps a status per route; routes are (sequence, route id) pairs
+        items = [{"ROUTES": [{"EMSX_SEQUENCE": seq, "EMSX_ROUTE_ID": route_id}]} for seq, route_id in routes]
+        return self.easymsx.bulk_request("CancelRouteEx", items, **kwargs)
+
     def create_route(self, seq_no, route_id):
         r = Route(self)
         r.sequence = seq_no
         r.route_id = route_id
-        self.routes.append(r)
+        with self.lock:
+            self.routes.append(r)
+            self.index[(seq_no, route_id)] = r
         return r
     
     def get_by_sequence_no_and_id(self, seq_no, route_id):
-        for r in self.routes:
-            if r.sequence == seq_no and r.route_id == route_id:
-                return r
-        return None
+        return self.index.get((seq_no, route_id))
+
+    def join_view(self, r, view):
+        # True when the route also came through another team view, so this copy may be a repeat
+        views = r.views
+        if views is None:
+            r.views = (view,)
+        elif view in views:
+            return len(views) > 1
+        else:
+            r.views = views + (view,)
+        with self.lock:
+            self.team_index.setdefault(view, {})[(r.sequence, r.route_id)] = r
+        return views is not None
+
+    @staticmethod
+    def is_echo(row, view, event_status):
+        # overlapping team views publish the same message on each subscription. Copies are matched per row by
+        # event status and counted per view, each stream keeps its own order
+        views = row.views
+        if views is None or len(views) < 2:
+            return False
+        if row.echoes is None:
+            row.echoes = {}
+        due = row.echoes.setdefault(event_status, {})
+        if due.get(view):
+            due[view] -= 1
+            return True
+        for other in views:
+            if other != view:
+                due[other] = due.get(other, 0) + 1
+        return False
+
+    def for_team(self, team):
+        # team is a Team, a team name or None for the personal view
+        members = self.team_index.get(getattr(team, "name", team))
+        return [] if members is None else list(members.values())
+
+    def add_team_notification_handler(self, team, handler):
+        self.team_handlers.setdefault(getattr(team, "name", team), []).append(handler)
+
+    def evict(self, keys):
+        # keys are (sequence, route id) pairs
+        with self.lock:
+            evicted = [self.index.pop(key) for key in keys if key in self.index]
+            if evicted:
+                gone = set(id(r) for r in evicted)
+                self.routes = [r for r in self.routes if id(r) not in gone]
+                self.unseen.difference_update(keys)
+                for r in evicted:
+                    for view in r.views or ():
+                        self.team_index[view].pop((r.sequence, r.route_id), None)
+        for listener in self.eviction_listeners:
+            for row in evicted:
+                listener(row)
+        return evicted
     
     def process_message(self, msg):
 
@@ -58,11 +177,18 @@ class Routes:
             logger.info("Route Subscription Started...")
             return
 
+        if msg.messageType() == SUBSCRIPTION_TERMINATED or msg.messageType() == SUBSCRIPTION_FAILURE:
+            logger.warning("Route Subscription lost: %s", msg.messageType())
+            self.easymsx.recovery.subscription_lost(self)
+            return
+
         if msg.messageType() != ORDER_ROUTE_FIELDS:
             logger.warning("Unexpected event...")
             return
         
         event_status = msg.getElementAsInteger("EVENT_STATUS")
+        cid = msg.correlationIds()[0].value()
+        view = self.subscriptions.get(cid)
         
         if event_status == 1:      # Heartbeat
             logger.debug("Route >> Heartbeat")
@@ -71,68 +197,216 @@ class Routes:
         elif event_status == 4:    # Initial paint
             seq_no = msg.getElementAsInteger("EMSX_SEQUENCE")
             route_id = msg.getElementAsInteger("EMSX_ROUTE_ID")
-            logger.debug("Route >> Event(4) >> SeqNo: " + str(seq_no) + "\tRouteId: " + str(route_id))
+            if self.easymsx.flight_recorder.enabled:
+                self.easymsx.flight_recorder.record("route", 4, seq_no, route_id)
             r = self.get_by_sequence_no_and_id(seq_no, route_id)
 
+            if self.reconciling:
+                self.reconcile(r, seq_no, route_id, msg, view)
+                return
+
             if r is None:
+                if not self.admits(seq_no, route_id, msg, paint=True):
+                    return
                 r = self.create_route(seq_no, route_id)
+            repeat = self.join_view(r, view)
         
             r.fields.populate_fields(msg, False)
+            if repeat and not r.fields.get_cached_field_changes():
+                return
 
-            r.notify(Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.INITIALPAINT, r, r.fields.get_field_changes()))                     
+            self.deliver(r, Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.INITIALPAINT, r, r.fields.get_field_changes()))
         
         elif event_status == 6:    # New order
             seq_no = msg.getElementAsInteger("EMSX_SEQUENCE")
             route_id = msg.getElementAsInteger("EMSX_ROUTE_ID")
-            logger.debug("Route >> Event(4) >> SeqNo: " + str(seq_no) + "\tRouteId: " + str(route_id))
+            if self.easymsx.flight_recorder.enabled:
+                self.easymsx.flight_recorder.record("route", 6, seq_no, route_id)
             r = self.get_by_sequence_no_and_id(seq_no, route_id)
         
             if r is None:
                 r = self.create_route(seq_no, route_id)
+            repeat = self.join_view(r, view)
         
             r.fields.populate_fields(msg, False)
+            if repeat and not r.fields.get_cached_field_changes():
+                return
 
-            r.notify(Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.NEW, r, r.fields.get_field_changes()))                     
+            self.deliver(r, Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.NEW, r, r.fields.get_field_changes()))
         
         elif event_status == 7:    # Update order
             seq_no = msg.getElementAsInteger("EMSX_SEQUENCE")
             route_id = msg.getElementAsInteger("EMSX_ROUTE_ID")
-            logger.debug("Route >> Event(4) >> SeqNo: " + str(seq_no) + "\tRouteId: " + str(route_id))
+            if self.easymsx.flight_recorder.enabled:
+                self.easymsx.flight_recorder.record("route", 7, seq_no, route_id)
             r = self.get_by_sequence_no_and_id(seq_no, route_id)
         
             if r is None:
+                if not self.admits(seq_no, route_id, msg):
+                    return
                 logger.warning("WARNING >> update received for unknown order")
                 r = self.create_route(seq_no, route_id)
+            self.join_view(r, view)
+            if self.is_echo(r, view, event_status):
+                return
         
             r.fields.populate_fields(msg, True)
 
-            r.notify(Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.UPDATE, r, r.fields.get_field_changes()))                     
+            self.deliver(r, Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.UPDATE, r, r.fields.get_field_changes()))
 
         elif event_status == 8:    # Delete/Expired order
             seq_no = msg.getElementAsInteger("EMSX_SEQUENCE")
             route_id = msg.getElementAsInteger("EMSX_ROUTE_ID")
-            logger.debug("Route >> Event(4) >> SeqNo: " + str(seq_no) + "\tRouteId: " + str(route_id))
+            if self.easymsx.flight_recorder.enabled:
+                self.easymsx.flight_recorder.record("route", 8, seq_no, route_id)
             r = self.get_by_sequence_no_and_id(seq_no, route_id)
 
             if r is None:
+                if not self.admits(seq_no, route_id, msg):
+                    return
                 r = self.create_route(seq_no, route_id)
                 r.fields.populate_fields(msg, False)
+            # never taken for a copy, a route can leave one team's view and stay in another
+            self.join_view(r, view)
 
             r.fields.field("EMSX_STATUS").set_value("DELETED")
  
-            r.notify(Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.DELETE, r, r.fields.get_field_changes()))                     
+            self.deliver(r, Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.DELETE, r, r.fields.get_field_changes()))
             
         elif event_status == 11:    # End of init paint
             logger.debug("End of ROUTE INIT_PAINT")
+            self.painting.discard(cid)
+            if self.painting:
+                return
+            if self.reconciling:
+                self.remove_unseen()
             self.initialized = True
+            self.initialized_event.set()
+            self.easymsx.startup.finish(PHASE_ROUTES)
+
+    def reconcile(self, r, seq_no, route_id, msg, view=None):
+
+        self.unseen.discard((seq_no, route_id))
+
+        if r is None:
+            if not self.admits(seq_no, route_id, msg, paint=True):
+                return
+            r = self.create_route(seq_no, route_id)
+            self.join_view(r, view)
+            r.fields.populate_fields(msg, False)
+            self.deliver(r, Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.NEW, r, r.fields.get_field_changes()))
+            return
+
+        self.join_view(r, view)
+        r.fields.populate_fields(msg, False)
+        changes = r.fields.get_cached_field_changes()
+        if changes:
+            self.deliver(r, Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.UPDATE, r, changes))
+
+    def admits(self, seq_no, route_id, msg, paint=False):
+        # routes the retention policy evicted are not rebuilt from late messages
+        retention = self.easymsx.retention
+        return retention is None or retention.admits_route(seq_no, route_id, msg, paint)
+
+    def remove_unseen(self):
+
+        # routes missing from the fresh init paint were deleted while we were away
+        for key in self.unseen:
+            r = self.index[key]
+            status = r.fields.field("EMSX_STATUS")
+            if status is None or status.value() == "DELETED":
+                continue
+            status.set_value("DELETED")
+            self.deliver(r, Notification(Notification.NotificationCategory.ROUTE, Notification.NotificationType.DELETE, r, [status.get_field_changed()]))
+
+        self.unseen = set()
+        self.reconciling = False
             
-    def add_notification_handler(self, handler):
+    def deliver(self, r, notification):
+        # cache listeners see every change, whatever the handlers and conflation do with it
+        for listener in self.cache_listeners:
+            listener(r, notification)
+        if self.easymsx.conflating:
+            self.easymsx.conflate(r, notification)
+        else:
+            self.dispatch(r, notification)
+
+    def dispatch(self, r, notification):
+        latency = self.easymsx.latency
+        if latency.enabled:
+            latency.stamp(notification)
+            r.notify(notification)
+            latency.complete(notification)
+        else:
+            r.notify(notification)
+
+    def add_cache_listener(self, listener):
+        self.cache_listeners.append(listener)
+
+    def remove_cache_listener(self, listener):
+        if listener in self.cache_listeners:
+            self.cache_listeners.remove(listener)
+
+    def add_eviction_listener(self, listener):
+        self.eviction_listeners.append(listener)
+
+    def remove_eviction_listener(self, listener):
+        if listener in self.eviction_listeners:
+            self.eviction_listeners.remove(listener)
+
+    def add_sorted_view(self, key, reverse=False, where=None, fields=None, convert=None):
+        # key is a field name, a tuple of field names or a function of the route; fields lists what a key function or where reads
+        view = SortedView(self, key, reverse, where, fields, convert)
+        self.sorted_views.append(view)
+        self.add_cache_listener(view.changed)
+        self.add_eviction_listener(view.discard)
+        view.load()
+        return view
+
+    def add_derived_field(self, name, sources, compute):
+        # compute(route) runs on first read and again only after one of the sources has changed
+        if name in self.derived_fields or any(sdf.name == name for sdf in self.field_source):
+            raise ValueError("Field already defined: " + name)
+        for source in sources:
+            if source not in self.derived_fields and not any(sdf.name == source for sdf in self.field_source):
+                raise ValueError("Unknown source field for %s: %s" % (name, source))
+        definition = DerivedFieldDefinition(name, sources, compute)
+        self.derived_fields[name] = definition
+        return definition
+
+    def source_fields(self, names):
+        return expand_sources(self.derived_fields, names)
+
+    def remove_sorted_view(self, view):
+        if view in self.sorted_views:
+            self.sorted_views.remove(view)
+        self.remove_cache_listener(view.changed)
+        self.remove_eviction_listener(view.discard)
+
+    def add_notification_handler(self, handler, low_priority=False):
         self.notification_handlers.append(handler)
+        if low_priority:
+            self.easymsx.low_priority_handlers.append(handler)
         
     def notify(self, notification):
+        timed = self.easymsx.metrics.enabled
+        skip_low_priority = not self.easymsx.low_priority_handlers_enabled
         for h in self.notification_handlers:
-            if not notification.consumed: 
-                h(notification)
+            if not notification.consumed:
+                if skip_low_priority and h in self.easymsx.low_priority_handlers:
+                    continue
+                if notification.timestamps is not None:
+                    notification.timestamps.handler_invoked(h)
+                if timed:
+                    self.easymsx.metrics.time_handler("notification_handler_ns", h, notification)
+                else:
+                    h(notification)
+
+        if self.team_handlers and not notification.consumed:
+            for view in notification.source.views or ():
+                for h in self.team_handlers.get(view, ()):
+                    if not notification.consumed:
+                        h(notification)
 
         if not notification.consumed:
             self.easymsx.notify(notification)
@@ -0,0 +1,466 @@
+# rules.py
+
+import ast
+import logging
+import operator
+import threading
+import time
+
+from .notification import Notification
+from .timerwheel import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+KIND_ORDER = "order"
+KIND_ROUTE = "route"
+
+# schema types whose values rule expressions see as numbers rather than strings
+NUMERIC_TYPES = {"Int32": int, "Int64": int, "Float32": float, "Float64": float}
+
+# fields holding the seconds since midnight a row last changed, the first one set is used
+ROW_TIME_FIELDS = ("EMSX_ROUTE_LAST_UPDATE_TIME", "EMSX_LAST_FILL_TIME", "EMSX_TIME_STAMP")
+
+EXPRESSION_FUNCTIONS = {"abs": abs, "min": min, "max": max, "len": len, "round": round,
+                        "int": int, "float": float, "str": str, "bool": bool}
+
+BINARY_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+                    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod}
+UNARY_OPERATORS = {ast.Not: operator.not_, ast.USub: operator.neg, ast.UAdd: operator.pos}
+COMPARISONS = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+               ast.Gt: operator.gt, ast.GtE: operator.ge,
+               ast.In: lambda a, b: a in b, ast.NotIn: lambda a, b: a not in b}
+
+
+class Expression:
+
+    # a rule expression over field names: literals, comparisons, boolean and arithmetic operators and the
+    # functions in EXPRESSION_FUNCTIONS. Anything else, attribute access or subscripts for instance, is refused
+    def __init__(self, source, name=""):
+        self.source = source
+        self.name = name
+        self.fields = set()
+        try:
+            tree = ast.parse(source, mode="eval")
+        except SyntaxError as err:
+            raise ValueError("Rule %s has an invalid expression: %s" % (name, err))
+        self.evaluate = self.build(tree.body)
+
+    def refuse(self, node):
+        raise ValueError("Rule %s: %s is not allowed in an expression" % (self.name, type(node).__name__))
+
+    def build(self, node):
+
+        if isinstance(node, ast.Constant):
+            value = node.value
+            if not isinstance(value, (str, int, float, bool, type(None))):
+                self.refuse(node)
+            return lambda values: value
+
+        if isinstance(node, ast.Name):
+            name = node.id
+            if name in EXPRESSION_FUNCTIONS:
+                self.refuse(node)
+            self.fields.add(name)
+            return lambda values: values[name]
+
+        if isinstance(node, ast.BoolOp):
+            parts = [self.build(v) for v in node.values]
+            if isinstance(node.op, ast.And):
+                def all_of(values):
+                    result = True
+                    for part in parts:
+                        result = part(values)
+                        if not result:
+                            return result
+                    return result
+                return all_of
+
+            def any_of(values):
+                result = False
+                for part in parts:
+                    result = part(values)
+                    if result:
+                        return result
+                return result
+            return any_of
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            op = UNARY_OPERATORS[type(node.op)]
+            operand = self.build(node.operand)
+            return lambda values: op(operand(values))
+
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            op = BINARY_OPERATORS[type(node.op)]
+            left = self.build(node.left)
+            right = self.build(node.right)
+            return lambda values: op(left(values), right(values))
+
+        if isinstance(node, ast.Compare) and all(type(op) in COMPARISONS for op in node.ops):
+            first = self.build(node.left)
+            steps = [(COMPARISONS[type(op)], self.build(c)) for op, c in zip(node.ops, node.comparators)]
+
+            def compare(values):
+                a = first(values)
+                for op, right in steps:
+                    b = right(values)
+                    if not op(a, b):
+                        return False
+                    a = b
+                return True
+            return compare
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in EXPRESSION_FUNCTIONS and not node.keywords:
+            function = EXPRESSION_FUNCTIONS[node.func.id]
+            args = [self.build(a) for a in node.args]
+            return lambda values: function(*[a(values) for a in args])
+
+        if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+            items = [self.build(e) for e in node.elts]
+            return lambda values: tuple(i(values) for i in items)
+
+        if isinstance(node, ast.IfExp):
+            test = self.build(node.test)
+            body = self.build(node.body)
+            orelse = self.build(node.orelse)
+            return lambda values: body(values) if test(values) else orelse(values)
+
+        self.refuse(node)
+
+
+class RowValues:
+
+    # the namespace a rule expression is evaluated in, fields are read only when the expression uses them
+    __slots__ = ("row", "converters")
+
+    def __init__(self, row, converters):
+        self.row = row
+        self.converters = converters
+
+    def __getitem__(self, name):
+        f = self.row.field(name)
+        if f is None:
+            raise KeyError(name)
+        value = f.value()
+        convert = self.converters.get(name)
+        if convert is not None:
+            if value == "" or value is None:
+                return None
+            try:
+                return convert(value)
+            except ValueError:
+                return value
+        return value
+
+
+class Rule:
+
+    def __init__(self, name, condition, action=None, kind=KIND_ORDER, fields=None, for_seconds=None, since=ROW_TIME_FIELDS):
+
+        # condition is an expression over field names, e.g. "EMSX_STATUS == 'REJECTED'", or a function of the row;
+        # with for_seconds the condition has to hold that long before the rule fires. For rows already in the cache
+        # when they are first evaluated the hold counts from since, field names holding seconds since midnight or a
+        # function of the row giving epoch seconds; None counts from the first evaluation
+        if kind not in (KIND_ORDER, KIND_ROUTE):
+            raise ValueError("Unknown rule kind: " + str(kind))
+
+        self.name = name
+        self.action = action
+        self.kind = kind
+        self.for_seconds = for_seconds
+        self.since = since
+
+        if isinstance(condition, str):
+            self.expression = Expression(condition, name)
+            self.condition = None
+            if fields is None:
+                fields = self.expression.fields
+        elif callable(condition):
+            self.expression = None
+            self.condition = condition
+        else:
+            raise ValueError("A rule condition is an expression or a function")
+
+        # None means the rule is evaluated on every change
+        self.fields = None if fields is None else frozenset(fields)
+        # guards the active rows and the counters, rules are evaluated on every dispatch shard
+        self.lock = threading.Lock()
+        self.active = {}
+        self.evaluations = 0
+        self.fired = 0
+        self.errors = 0
+        self.evaluation_ns = 0
+
+    def test(self, row, converters):
+        if self.expression is not None:
+            return self.expression.evaluate(RowValues(row, converters))
+        return self.condition(row)
+
+    def started(self, row, to_epoch):
+        if callable(self.since):
+            return self.since(row)
+        for name in self.since:
+            f = row.field(name)
+            value = None if f is None else f.value()
+            if value and value != "0":
+                try:
+                    return to_epoch(float(value))
+                except ValueError:
+                    continue
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "rule": self.name,
+                "evaluations": self.evaluations,
+                "fired": self.fired,
+                "errors": self.errors,
+                "active": len(self.active),
+                "mean_evaluation_us": self.evaluation_ns / 1000.0 / self.evaluations if self.evaluations else 0.0,
+            }
+
+
+class RuleEngine:
+
+    def __init__(self, tick=0.1, slots=512):
+        self.wheel = TimerWheel(tick, slots)
+        self.wheel_lock = threading.Lock()
+        self.rules = []
+        # rules by the fields they read, per kind; rules without fields go in every candidate list.
+        # The lists are replaced rather than changed, so changes read them without a lock
+        self.index = {KIND_ORDER: {}, KIND_ROUTE: {}}
+        self.unindexed = {KIND_ORDER: [], KIND_ROUTE: []}
+        self.converters = {KIND_ORDER: {}, KIND_ROUTE: {}}
+        self.easymsx = None
+        # guards adding and removing rules only
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def attach(self, easymsx):
+
+        self.easymsx = easymsx
+        for kind, source in ((KIND_ORDER, easymsx.order_fields), (KIND_ROUTE, easymsx.route_fields)):
+            self.converters[kind] = dict((sdf.name, NUMERIC_TYPES[sdf.type]) for sdf in source if sdf.type in NUMERIC_TYPES)
+
+        with self.lock:
+            rules = list(self.rules)
+            self.rules = []
+            self.index = {KIND_ORDER: {}, KIND_ROUTE: {}}
+            self.unindexed = {KIND_ORDER: [], KIND_ROUTE: []}
+        for rule in rules:
+            self.add_rule(rule)
+
+        easymsx.orders.add_cache_listener(self.order_changed)
+        easymsx.routes.add_cache_listener(self.route_changed)
+        easymsx.orders.add_eviction_listener(self.order_evicted)
+        easymsx.routes.add_eviction_listener(self.route_evicted)
+
+        # in pull mode the timers are advanced by poll() on the application's thread
+        if not easymsx.pull_mode:
+            self.thread = threading.Thread(target=self.run, name="EasyMSXRuleTimers", daemon=True)
+            self.thread.start()
+
+    def detach(self):
+        self.easymsx.orders.remove_cache_listener(self.order_changed)
+        self.easymsx.routes.remove_cache_listener(self.route_changed)
+        self.easymsx.orders.remove_eviction_listener(self.order_evicted)
+        self.easymsx.routes.remove_eviction_listener(self.route_evicted)
+        self.stop()
+
+    def collection(self, kind):
+        return self.easymsx.orders if kind == KIND_ORDER else self.easymsx.routes
+
+    def add_rule(self, rule):
+
+        # rules added before the engine is attached are indexed and evaluated when it is
+        with self.lock:
+            self.rules = self.rules + [rule]
+            if self.easymsx is None:
+                return rule
+            if rule.fields is None:
+                self.unindexed[rule.kind] = self.unindexed[rule.kind] + [rule]
+            else:
+                # a derived field is indexed under the raw fields it is computed from
+                index = self.index[rule.kind]
+                for name in self.collection(rule.kind).source_fields(rule.fields) | rule.fields:
+                    index[name] = index.get(name, []) + [rule]
+
+        # rows already in the cache are evaluated straight away
+        for row in list(self.collection(rule.kind)):
+            self.evaluate(rule, row, True)
+        return rule
+
+    def remove_rule(self, rule):
+        with self.lock:
+            self.rules = [r for r in self.rules if r is not rule]
+            self.unindexed[rule.kind] = [r for r in self.unindexed[rule.kind] if r is not rule]
+            index = self.index[rule.kind]
+            for name, rules in list(index.items()):
+                if rule in rules:
+                    index[name] = [r for r in rules if r is not rule]
+        with rule.lock:
+            for key, (row, timer) in list(rule.active.items()):
+                if timer is not None:
+                    self.cancel(timer)
+            rule.active.clear()
+
+    def order_changed(self, o, notification):
+        self.changed(KIND_ORDER, o, notification)
+
+    def route_changed(self, r, notification):
+        self.changed(KIND_ROUTE, r, notification)
+
+    def order_evicted(self, o):
+        self.forget(KIND_ORDER, o)
+
+    def route_evicted(self, r):
+        self.forget(KIND_ROUTE, r)
+
+    def changed(self, kind, row, notification):
+
+        if notification.type in (Notification.NotificationType.INITIALPAINT, Notification.NotificationType.NEW):
+            candidates = [r for r in self.rules if r.kind == kind]
+        else:
+            # only the rules that read a changed field
+            index = self.index[kind]
+            candidates = list(self.unindexed[kind])
+            seen = set()
+            for fc in notification.field_changes:
+                rules = index.get(fc.field.name())
+                if rules:
+                    for rule in rules:
+                        if id(rule) not in seen:
+                            seen.add(id(rule))
+                            candidates.append(rule)
+
+        painted = notification.type == Notification.NotificationType.INITIALPAINT
+        for rule in candidates:
+            self.evaluate(rule, row, painted)
+        # a deleted row never changes again, so it stops holding rule state
+        if notification.type == Notification.NotificationType.DELETE:
+            self.forget(kind, row)
+
+    def evaluate(self, rule, row, painted=False):
+
+        t0 = time.perf_counter_ns()
+        failed = False
+        try:
+            result = bool(rule.test(row, self.converters[rule.kind]))
+        except Exception as err:
+            logger.debug("Rule %s failed to evaluate: %s", rule.name, err)
+            failed = True
+            result = False
+        elapsed = time.perf_counter_ns() - t0
+
+        key = id(row)
+        fire = False
+        with rule.lock:
+            rule.evaluation_ns += elapsed
+            rule.evaluations += 1
+            if failed:
+                rule.errors += 1
+            if result:
+                if key in rule.active:
+                    return
+                delay = self.hold_for(rule, row, painted) if rule.for_seconds else 0
+                if delay > 0:
+                    rule.active[key] = (row, self.schedule(delay, (rule, row)))
+                else:
+                    rule.active[key] = (row, None)
+                    rule.fired += 1
+                    fire = True
+            elif key in rule.active:
+                row, timer = rule.active.pop(key)
+                if timer is not None:
+                    self.cancel(timer)
+        if fire:
+            self.fire(rule, row)
+
+    def hold_for(self, rule, row, painted):
+        # a row painted after a restart may have met the condition long before, so its own time counts
+        if not painted or rule.since is None:
+            return rule.for_seconds
+        started = rule.started(row, self.epoch_seconds)
+        if started is None:
+            return rule.for_seconds
+        return min(rule.for_seconds, rule.for_seconds - (time.time() - started))
+
+    def epoch_seconds(self, seconds_since_midnight):
+        return self.easymsx.latency.seconds_since_midnight_to_ns(seconds_since_midnight) / 1e9
+
+    def schedule(self, delay, item):
+        with self.wheel_lock:
+            return self.wheel.schedule(delay, item)
+
+    def cancel(self, timer):
+        with self.wheel_lock:
+            self.wheel.cancel(timer)
+
+    def forget(self, kind, row):
+        key = id(row)
+        for rule in self.rules:
+            if rule.kind == kind:
+                with rule.lock:
+                    entry = rule.active.pop(key, None)
+                    if entry is not None and entry[1] is not None:
+                        self.cancel(entry[1])
+
+    def fire(self, rule, row):
+        if self.easymsx is not None and self.easymsx.metrics.enabled:
+            self.easymsx.metrics.incr("rule_fired_total", (("rule", rule.name),))
+        if rule.action is not None:
+            try:
+                rule.action(rule, row)
+            except Exception as err:
+                logger.error("Error in action of rule %s: %s", rule.name, err)
+
+    def advance(self, now=None):
+
+        with self.wheel_lock:
+            expired = self.wheel.advance(now)
+        for timer in expired:
+            rule, row = timer.item
+            with rule.lock:
+                entry = rule.active.get(id(row))
+                due = entry is not None and entry[1] is timer
+                if due:
+                    rule.active[id(row)] = (row, None)
+                    rule.fired += 1
+            if due:
+                self.fire(rule, row)
+        return len(expired)
+
+    def run(self):
+        while not self.stopping.wait(self.wheel.tick):
+            self.advance()
+
+    def stats(self):
+        return [rule.stats() for rule in self.rules]
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,227 @@
+# scheduler.py
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+# cancels must never queue behind a basket of new orders
+DEFAULT_PRIORITIES = {
+    "CancelRouteEx": PRIORITY_HIGH,
+    "CancelRoute": PRIORITY_HIGH,
+    "CancelOrderEx": PRIORITY_HIGH,
+    "DeleteOrder": PRIORITY_HIGH,
+    "CreateOrder": PRIORITY_LOW,
+    "CreateOrderAndRouteEx": PRIORITY_LOW,
+    "CreateOrderAndRoute": PRIORITY_LOW,
+    "CreateBasket": PRIORITY_LOW,
+}
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("Rate limit must be positive: " + str(rate))
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        if self.burst < 1:
+            raise ValueError("Burst must allow at least one request: " + str(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        # seconds until a token is available, 0.0 when one can be taken now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class ScheduledRequest:
+
+    __slots__ = ("request", "correlation_id", "operation", "priority", "enqueued_ns")
+
+    def __init__(self, request, correlation_id, operation, priority):
+        self.request = request
+        self.correlation_id = correlation_id
+        self.operation = operation
+        self.priority = priority
+        self.enqueued_ns = time.perf_counter_ns()
+
+
+class RequestScheduler:
+
+    def __init__(self, max_in_flight=None, rate_limits=None, default_rate_limit=None, priorities=None):
+
+        # rate limits are requests per second, or (rate, burst) pairs, keyed by operation name
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        self.max_in_flight = max_in_flight
+        self.rate_limits = dict(rate_limits or {})
+        self.default_rate_limit = default_rate_limit
+        self.priorities = dict(DEFAULT_PRIORITIES)
+        if priorities is not None:
+            self.priorities.update(priorities)
+        for p in self.priorities.values():
+            self.check_priority(p)
+
+        self.buckets = {}
+        self.lanes = [collections.deque() for p in PRIORITIES]
+        self.in_flight = set()
+        self.condition = threading.Condition()
+        self.easymsx = None
+        self.worker = None
+        self.running = False
+
+    @staticmethod
+    def check_priority(priority):
+        if priority not in PRIORITIES:
+            raise ValueError("Unknown request priority: " + str(priority))
+
+    def attach(self, easymsx):
+        self.easymsx = easymsx
+        easymsx.metrics.set_gauge("request_queue_depth", self.queued)
+        easymsx.metrics.set_gauge("requests_in_flight", lambda: len(self.in_flight))
+        self.running = True
+        self.worker = threading.Thread(target=self.run, name="EasyMSXRequestScheduler", daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.worker is not None and self.worker is not threading.current_thread():
+            self.worker.join()
+        self.worker = None
+
+        # requests never sent are failed so that blocked callers return
+        for entry in self.drain():
+            self.easymsx.request_failed(entry.correlation_id.value())
+
+    def drain(self):
+        with self.condition:
+            entries = [entry for lane in self.lanes for entry in lane]
+            for lane in self.lanes:
+                lane.clear()
+        return entries
+
+    def bucket(self, operation):
+        bucket = self.buckets.get(operation)
+        if bucket is None:
+            limit = self.rate_limits.get(operation, self.default_rate_limit)
+            if limit is None:
+                return None
+            if isinstance(limit, tuple):
+                bucket = TokenBucket(*limit)
+            else:
+                bucket = TokenBucket(limit)
+            self.buckets[operation] = bucket
+        return bucket
+
+    def submit(self, request, correlation_id, priority=None):
+
+        operation = str(request.asElement().name())
+        if priority is None:
+            priority = self.priorities.get(operation, PRIORITY_NORMAL)
+        else:
+            self.check_priority(priority)
+
+        entry = ScheduledRequest(request, correlation_id, operation, priority)
+        with self.condition:
+            self.lanes[priority].append(entry)
+            self.condition.notify_all()
+        return entry
+
+    def completed(self, cid):
+        with self.condition:
+            if cid in self.in_flight:
+                self.in_flight.discard(cid)
+                self.condition.notify_all()
+
+    def reset(self):
+        # responses to requests lost with a session will never arrive, queued ones go with them
+        with self.condition:
+            self.in_flight.clear()
+            for lane in self.lanes:
+                lane.clear()
+            self.condition.notify_all()
+
+    def queued(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    def next_entry(self, now):
+
+        if self.max_in_flight is not None and len(self.in_flight) >= self.max_in_flight:
+            return None, None
+
+        # a lane whose head is rate limited does not hold up the other lanes
+        wait = None
+        for lane in self.lanes:
+            if not lane:
+                continue
+            entry = lane[0]
+            bucket = self.bucket(entry.operation)
+            if bucket is not None:
+                delay = bucket.delay(now)
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                bucket.take()
+            lane.popleft()
+            return entry, None
+
+        return None, wait
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if not self.running:
+                        return
+                    entry, wait = self.next_entry(time.monotonic())
+                    if entry is not None:
+                        break
+                    self.condition.wait(wait)
+                # counted before sending, the response can arrive before sendRequest returns
+                self.in_flight.add(entry.correlation_id.value())
+            try:
+                self.easymsx.dispatch_request(entry)
+            except Exception as err:
+                logger.error("Request scheduler >> Error dispatching request: %s", err)
+                self.completed(entry.correlation_id.value())
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,144 @@
+# sharding.py
+
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# end of paint and heartbeats carry no sequence and have to see every earlier message applied
+CONTROL_EVENT_STATUSES = (1, 11)
+
+
+def sequence_of(msg):
+    if not msg.hasElement("EMSX_SEQUENCE"):
+        return None
+    if msg.hasElement("EVENT_STATUS") and msg.getElementAsInteger("EVENT_STATUS") in CONTROL_EVENT_STATUSES:
+        return None
+    return msg.getElementAsInteger("EMSX_SEQUENCE")
+
+
+class DispatchShard:
+
+    def __init__(self, dispatcher, index):
+        self.dispatcher = dispatcher
+        self.index = index
+        self.condition = threading.Condition()
+        self.queue = collections.deque()
+        self.busy = False
+        self.stopping = False
+        self.processed = 0
+        self.thread = threading.Thread(target=self.run, name="EasyMSXShard-%d" % index, daemon=True)
+
+    def put(self, items):
+        with self.condition:
+            self.queue.extend(items)
+            self.condition.notify_all()
+
+    def run(self):
+
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopping:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                batch = self.queue
+                self.queue = collections.deque()
+                self.busy = True
+
+            latency = self.dispatcher.easymsx.latency
+            for handler, msg, received in batch:
+                try:
+                    # each message is stamped with the receive time of its own event, not the latest one
+                    if received is not None:
+                        latency.apply(received)
+                    handler(msg)
+                except Exception as err:
+                    logger.error("Error in shard %d while applying a message: %s", self.index, err)
+
+            with self.condition:
+                self.processed += len(batch)
+                self.busy = False
+                self.condition.notify_all()
+
+    def wait_idle(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and not self.busy, timeout)
+
+    def depth(self):
+        return len(self.queue)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+class ShardedDispatcher:
+
+    def __init__(self, easymsx, shards):
+
+        if shards < 1:
+            raise ValueError("At least one dispatch shard is needed")
+
+        self.easymsx = easymsx
+        self.shards = [DispatchShard(self, i) for i in range(0, shards)]
+
+    def start(self):
+        for shard in self.shards:
+            self.easymsx.metrics.set_gauge("dispatch_shard_depth", shard.depth, (("shard", str(shard.index)),))
+            shard.thread.start()
+
+    def dispatch(self, items, received=None):
+
+        # items are (handler, message) pairs from one event; an order and its routes share a shard,
+        # so messages for one sequence are applied in the order they arrived. received travels
+        # with every message so that latency is measured from this event's arrival
+        count = len(self.shards)
+        batches = [[] for s in self.shards]
+        for handler, msg in items:
+            seq = sequence_of(msg)
+            if seq is None:
+                self.flush(batches)
+                self.drain()
+                handler(msg)
+            else:
+                batches[seq % count].append((handler, msg, received))
+        self.flush(batches)
+
+    def flush(self, batches):
+        for shard, batch in zip(self.shards, batches):
+            if batch:
+                shard.put(batch)
+                del batch[:]
+
+    def drain(self, timeout=None):
+        return all(shard.wait_idle(timeout) for shard in self.shards)
+
+    def stop(self):
+        for shard in self.shards:
+            shard.stop()
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,460 @@
+# sharedcache.py
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from .derivedfield import exported_fields, exported_value
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"EMSXSHM1"
+VERSION = 1
+
+STATE_STARTING = 0
+STATE_LIVE = 1
+STATE_CLOSED = 2
+
+KIND_ORDER = 0
+KIND_ROUTE = 1
+
+# magic, version, state, capacity, row size, ring size, header size, publisher pid, slots used, change sequence
+HEADER = struct.Struct("<8sIIIIIIIIQ")
+STATE_OFFSET = 12
+SLOTS_USED_OFFSET = 36
+CHANGE_SEQUENCE_OFFSET = 40
+SCHEMA_OFFSET = 64
+HEADER_SIZE = 32768
+
+# change sequence, slot
+RING_ENTRY = struct.Struct("<QI4x")
+
+# seqlock, kind, flags, field count, EMSX sequence, route id, payload length
+SLOT_HEADER = struct.Struct("<QBBHqiI")
+SLOT_HEADER_SIZE = 32
+
+# the slot's row was evicted, the slot keeps its key until it is reused
+FLAG_EMPTY = 1
+
+# widest value of each schema type as EMSX delivers it; strings and enumerations get DEFAULT_VALUE_WIDTH
+VALUE_WIDTHS = {"Bool": 5, "Int32": 11, "Int64": 20, "Float32": 16, "Float64": 24, "Date": 10, "Time": 18, "Datetime": 32}
+DEFAULT_VALUE_WIDTH = 64
+
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+OFFSET_PAIR = struct.Struct("<II")
+
+
+class SharedCachePublisher:
+
+    def __init__(self, easymsx, path, capacity=100000, row_size=None, ring_size=65536, derived_fields=()):
+
+        if capacity < 1 or ring_size < 1:
+            raise ValueError("Shared cache capacity and ring size must be positive")
+
+        # derived fields are opted in by name and follow the raw fields in each row
+        order_derived, route_derived = exported_fields(easymsx, derived_fields)
+        self.derived = {KIND_ORDER: order_derived, KIND_ROUTE: route_derived}
+        self.names = {
+            KIND_ORDER: [f.name for f in easymsx.order_fields] + order_derived,
+            KIND_ROUTE: [f.name for f in easymsx.route_fields] + route_derived,
+        }
+        schema = json.dumps({"orders": self.names[KIND_ORDER], "routes": self.names[KIND_ROUTE]}).encode("utf-8") + b"\0"
+        if SCHEMA_OFFSET + len(schema) > HEADER_SIZE:
+            raise ValueError("Field schema does not fit in the shared cache header")
+
+        # payload: one offset per field plus the end offset, then the UTF-8 values
+        self.offsets = dict((kind, struct.Struct("<%dI" % (len(names) + 1))) for kind, names in self.names.items())
+        needed = max(self.row_size_for(KIND_ORDER, easymsx.order_fields), self.row_size_for(KIND_ROUTE, easymsx.route_fields))
+        if row_size is None:
+            row_size = (needed + 63) // 64 * 64
+        elif row_size < needed:
+            raise ValueError("Row size %d is too small, rows of the %d order and %d route fields take up to %d bytes"
+                             % (row_size, len(self.names[KIND_ORDER]), len(self.names[KIND_ROUTE]), needed))
+
+        self.easymsx = easymsx
+        self.path = path
+        self.capacity = capacity
+        self.row_size = row_size
+        self.ring_size = ring_size
+        self.rows_offset = HEADER_SIZE + ring_size * RING_ENTRY.size
+
+        size = self.rows_offset + capacity * row_size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, STATE_STARTING, capacity, row_size, ring_size, HEADER_SIZE, os.getpid(), 0, 0)
+        self.mm[SCHEMA_OFFSET:SCHEMA_OFFSET + len(schema)] = schema
+
+        self.lock = threading.Lock()
+        self.slots = {}
+        # slots of evicted rows, reused before any slot past the high water mark
+        self.free = []
+        self.used = 0
+        self.change_sequence = 0
+        self.closed = False
+
+    def row_size_for(self, kind, fields):
+        return (SLOT_HEADER_SIZE + self.offsets[kind].size + sum(VALUE_WIDTHS.get(f.type, DEFAULT_VALUE_WIDTH) for f in fields)
+                + DEFAULT_VALUE_WIDTH * len(self.derived[kind]))
+
+    def start(self):
+
+        self.easymsx.orders.add_cache_listener(self.order_changed)
+        self.easymsx.routes.add_cache_listener(self.route_changed)
+        self.easymsx.orders.add_eviction_listener(self.order_evicted)
+        self.easymsx.routes.add_eviction_listener(self.route_evicted)
+        self.easymsx.metrics.set_gauge("shared_cache_rows", lambda: len(self.slots))
+
+        # rows painted before the publisher was attached; a concurrent update just writes a row twice
+        written = all([self.write(KIND_ORDER, o.sequence, 0, o) for o in list(self.easymsx.orders)] +
+                      [self.write(KIND_ROUTE, r.sequence, r.route_id, r) for r in list(self.easymsx.routes)])
+        if not written:
+            self.close(unlink=True)
+            raise ValueError("The cache does not fit in the shared cache at %s, see the errors logged" % self.path)
+
+        U32.pack_into(self.mm, STATE_OFFSET, STATE_LIVE)
+        logger.info("Publishing the shared cache at %s (%d rows)", self.path, len(self.slots))
+
+    def order_changed(self, o, notification):
+        self.write(KIND_ORDER, o.sequence, 0, o)
+
+    def route_changed(self, r, notification):
+        self.write(KIND_ROUTE, r.sequence, r.route_id, r)
+
+    def order_evicted(self, o):
+        self.release(KIND_ORDER, o.sequence, 0)
+
+    def route_evicted(self, r):
+        self.release(KIND_ROUTE, r.sequence, r.route_id)
+
+    def encode(self, kind, row):
+        encoded = [str(f.value()).encode("utf-8") for f in row.fields.fields]
+        encoded.extend(exported_value(row, name).encode("utf-8") for name in self.derived[kind])
+        offsets = [0]
+        for e in encoded:
+            offsets.append(offsets[-1] + len(e))
+        return self.offsets[kind].pack(*offsets) + b"".join(encoded)
+
+    def write(self, kind, sequence, route_id, row):
+
+        payload = self.encode(kind, row)
+        if SLOT_HEADER_SIZE + len(payload) > self.row_size:
+            logger.error("Shared cache row %d/%d is %d bytes, larger than the row size", sequence, route_id, len(payload))
+            if self.easymsx.metrics.enabled:
+                self.easymsx.metrics.incr("shared_cache_dropped_total", (("reason", "row_size"),))
+            return False
+
+        with self.lock:
+
+            if self.closed:
+                return False
+
+            key = (kind, sequence, route_id)
+            slot = self.slots.get(key)
+            if slot is None:
+                if self.free:
+                    slot = self.free.pop()
+                elif self.used < self.capacity:
+                    slot = self.used
+                    self.used += 1
+                else:
+                    logger.error("Shared cache is full (%d rows)", self.capacity)
+                    if self.easymsx.metrics.enabled:
+                        self.easymsx.metrics.incr("shared_cache_dropped_total", (("reason", "capacity"),))
+                    return False
+                self.slots[key] = slot
+
+            mm = self.mm
+            base = self.rows_offset + slot * self.row_size
+
+            # seqlock: odd while the slot is being written, readers retry until it is even and unchanged
+            lock = U64.unpack_from(mm, base)[0]
+            U64.pack_into(mm, base, lock + 1)
+            SLOT_HEADER.pack_into(mm, base, lock + 1, kind, 0, len(self.names[kind]), sequence, route_id, len(payload))
+            mm[base + SLOT_HEADER_SIZE:base + SLOT_HEADER_SIZE + len(payload)] = payload
+            U64.pack_into(mm, base, lock + 2)
+
+            self.announce(slot)
+            return True
+
+    def release(self, kind, sequence, route_id):
+
+        with self.lock:
+
+            if self.closed:
+                return
+
+            slot = self.slots.pop((kind, sequence, route_id), None)
+            if slot is None:
+                return
+
+            # readers holding the row see it empty rather than the next row written to the slot
+            mm = self.mm
+            base = self.rows_offset + slot * self.row_size
+            lock = U64.unpack_from(mm, base)[0]
+            U64.pack_into(mm, base, lock + 1)
+            SLOT_HEADER.pack_into(mm, base, lock + 1, kind, FLAG_EMPTY, 0, sequence, route_id, 0)
+            U64.pack_into(mm, base, lock + 2)
+
+            self.free.append(slot)
+            self.announce(slot)
+
+    def announce(self, slot):
+        # the ring entry is written before the change sequence that makes it visible
+        mm = self.mm
+        self.change_sequence += 1
+        RING_ENTRY.pack_into(mm, HEADER_SIZE + (self.change_sequence % self.ring_size) * RING_ENTRY.size, self.change_sequence, slot)
+        U32.pack_into(mm, SLOTS_USED_OFFSET, self.used)
+        U64.pack_into(mm, CHANGE_SEQUENCE_OFFSET, self.change_sequence)
+
+    def close(self, unlink=False):
+
+        self.easymsx.orders.remove_cache_listener(self.order_changed)
+        self.easymsx.routes.remove_cache_listener(self.route_changed)
+        self.easymsx.orders.remove_eviction_listener(self.order_evicted)
+        self.easymsx.routes.remove_eviction_listener(self.route_evicted)
+
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            U32.pack_into(self.mm, STATE_OFFSET, STATE_CLOSED)
+            self.mm.flush()
+            self.mm.close()
+
+        if unlink:
+            os.unlink(self.path)
+
+
+class SharedRow:
+
+    __slots__ = ("reader", "slot", "kind", "sequence", "route_id", "removed")
+
+    def __init__(self, reader, slot, kind, sequence, route_id):
+        self.reader = reader
+        self.slot = slot
+        self.kind = kind
+        self.sequence = sequence
+        self.route_id = route_id
+        # set once the publisher evicted the row, its values are then None
+        self.removed = False
+
+    def key(self):
+        return self.kind, self.sequence, self.route_id
+
+    def value(self, name):
+        return self.reader.read_value(self, name)
+
+    def values(self):
+        return self.reader.read_values(self)
+
+    def __repr__(self):
+        return "SharedRow(%s, %d, %d)" % ("order" if self.kind == KIND_ORDER else "route", self.sequence, self.route_id)
+
+
+class SharedCacheReader:
+
+    def __init__(self, path):
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self.mm = mmap.mmap(fd, os.fstat(fd).st_size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        magic, version, state, capacity, row_size, ring_size, header_size, pid, slots_used, change = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError("Not an EasyMSX shared cache: " + path)
+
+        self.path = path
+        self.capacity = capacity
+        self.row_size = row_size
+        self.ring_size = ring_size
+        self.publisher_pid = pid
+        self.rows_offset = header_size + ring_size * RING_ENTRY.size
+
+        schema = json.loads(self.mm[SCHEMA_OFFSET:header_size].split(b"\0", 1)[0].decode("utf-8"))
+        self.names = {KIND_ORDER: schema["orders"], KIND_ROUTE: schema["routes"]}
+        self.positions = dict((kind, dict((n, i) for i, n in enumerate(names))) for kind, names in self.names.items())
+
+        self.rows = {}
+        self.index = {}
+        self.last_change = 0
+        self.refresh()
+
+    def state(self):
+        return U32.unpack_from(self.mm, STATE_OFFSET)[0]
+
+    def publisher_alive(self):
+        return self.state() != STATE_CLOSED
+
+    def change_sequence(self):
+        return U64.unpack_from(self.mm, CHANGE_SEQUENCE_OFFSET)[0]
+
+    def wait_for_change(self, since=None, timeout=None):
+
+        # there is no cross process condition variable in the standard library, so this polls with backoff
+        since = self.last_change if since is None else since
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.0001
+        while True:
+            current = self.change_sequence()
+            if current > since:
+                return current
+            if not self.publisher_alive():
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.01)
+
+    def refresh(self):
+
+        # returns the rows changed since the last refresh, evicted ones flagged as removed
+        current = self.change_sequence()
+        if current == self.last_change:
+            return []
+        if current - self.last_change > self.ring_size:
+            return self.rescan(current)
+
+        changed = {}
+        for change in range(self.last_change + 1, current + 1):
+            entry_change, slot = RING_ENTRY.unpack_from(self.mm, HEADER_SIZE + (change % self.ring_size) * RING_ENTRY.size)
+            if entry_change != change:
+                # the publisher lapped the ring while we were away
+                return self.rescan(self.change_sequence())
+            self.load_slot(slot, changed)
+
+        self.last_change = current
+        return list(changed.values())
+
+    def rescan(self, current):
+        count = U32.unpack_from(self.mm, SLOTS_USED_OFFSET)[0]
+        self.last_change = current
+        changed = {}
+        for slot in range(0, count):
+            self.load_slot(slot, changed)
+        return list(changed.values())
+
+    def load_slot(self, slot, changed):
+
+        kind, flags, sequence, route_id = self.read_consistent(slot, self.read_key)
+        key = (kind, sequence, route_id)
+
+        # the slot's row was evicted, and the slot may hold another row since
+        row = self.rows.get(slot)
+        if row is not None and (flags & FLAG_EMPTY or row.key() != key):
+            del self.rows[slot]
+            if self.index.get(row.key()) is row:
+                del self.index[row.key()]
+            row.removed = True
+            changed[row.key()] = row
+            row = None
+
+        if flags & FLAG_EMPTY:
+            return
+        if row is None:
+            row = self.rows[slot] = SharedRow(self, slot, kind, sequence, route_id)
+            self.index[key] = row
+        changed[key] = row
+
+    def read_consistent(self, slot, read):
+        mm = self.mm
+        base = self.rows_offset + slot * self.row_size
+        while True:
+            lock = U64.unpack_from(mm, base)[0]
+            if not lock & 1:
+                result = read(base)
+                if U64.unpack_from(mm, base)[0] == lock:
+                    return result
+            time.sleep(0)
+
+    def read_key(self, base):
+        lock, kind, flags, count, sequence, route_id, length = SLOT_HEADER.unpack_from(self.mm, base)
+        return kind, flags, sequence, route_id
+
+    def holds(self, row, base):
+        kind, flags, sequence, route_id = self.read_key(base)
+        return not flags & FLAG_EMPTY and (kind, sequence, route_id) == row.key()
+
+    def read_value(self, row, name):
+
+        i = self.positions[row.kind].get(name)
+        if i is None:
+            return None
+
+        data = SLOT_HEADER_SIZE + 4 * (len(self.names[row.kind]) + 1)
+
+        # the bytes are copied out under the seqlock, a view into the map would see later writes to the slot
+        def read(base):
+            if not self.holds(row, base):
+                return None
+            start, end = OFFSET_PAIR.unpack_from(self.mm, base + SLOT_HEADER_SIZE + 4 * i)
+            return self.mm[base + data + start:base + data + end]
+
+        value = self.read_consistent(row.slot, read)
+        return None if value is None else value.decode("utf-8")
+
+    def read_values(self, row):
+
+        names = self.names[row.kind]
+        offsets = struct.Struct("<%dI" % (len(names) + 1))
+        data = SLOT_HEADER_SIZE + offsets.size
+
+        def read(base):
+            if not self.holds(row, base):
+                return None
+            bounds = offsets.unpack_from(self.mm, base + SLOT_HEADER_SIZE)
+            return bounds, self.mm[base + data:base + data + bounds[-1]]
+
+        values = self.read_consistent(row.slot, read)
+        if values is None:
+            return None
+        bounds, raw = values
+        return dict((n, raw[bounds[i]:bounds[i + 1]].decode("utf-8")) for i, n in enumerate(names))
+
+    def get_order(self, sequence):
+        return self.index.get((KIND_ORDER, sequence, 0))
+
+    def get_route(self, sequence, route_id):
+        return self.index.get((KIND_ROUTE, sequence, route_id))
+
+    def orders(self):
+        return [r for r in self.rows.values() if r.kind == KIND_ORDER]
+
+    def routes(self):
+        return [r for r in self.rows.values() if r.kind == KIND_ROUTE]
+
+    def close(self):
+        self.mm.close()
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,985 @@
+# simulator.py
+
+import blpapi
+import datetime
+import logging
+import queue
+import random
+import threading
+import time
+
+# ADMIN
+SLOW_CONSUMER_WARNING = blpapi.Name("SlowConsumerWarning")
+SLOW_CONSUMER_WARNING_CLEARED = blpapi.Name("SlowConsumerWarningCleared")
+
+# SESSION_STATUS
+SESSION_STARTED = blpapi.Name("SessionStarted")
+SESSION_TERMINATED = blpapi.Name("SessionTerminated")
+SESSION_CONNECTION_UP = blpapi.Name("SessionConnectionUp")
+SESSION_CONNECTION_DOWN = blpapi.Name("SessionConnectionDown")
+
+# SERVICE_STATUS
+SERVICE_OPENED = blpapi.Name("ServiceOpened")
+
+# SUBSCRIPTION_STATUS + SUBSCRIPTION_DATA
+SUBSCRIPTION_STARTED = blpapi.Name("SubscriptionStarted")
+SUBSCRIPTION_ACTIVATED = blpapi.Name("SubscriptionStreamsActivated")
+SUBSCRIPTION_TERMINATED = blpapi.Name("SubscriptionTerminated")
+ORDER_ROUTE_FIELDS = blpapi.Name("OrderRouteFields")
+
+# RESPONSE
+ERROR_INFO = blpapi.Name("ErrorInfo")
+
+logger = logging.getLogger(__name__)
+
+# name, description, type of every field in the simulated OrderRouteFields event
+ORDER_ROUTE_SCHEMA = [
+    ("EMSX_ACCOUNT", "O,R Static", "String"),
+    ("EMSX_AMOUNT", "O,R", "Int32"),
+    ("EMSX_AVG_PRICE", "O,R", "Float64"),
+    ("EMSX_BROKER", "O,R", "String"),
+    ("EMSX_DATE", "O,R Static", "Int32"),
+    ("EMSX_FILLED", "O,R", "Int32"),
+    ("EMSX_HAND_INSTRUCTION", "Order", "String"),
+    ("EMSX_IDLE_AMOUNT", "Order", "Int32"),
+    ("EMSX_LAST_FILL_DATE", "O,R", "Int32"),
+    ("EMSX_LIMIT_PRICE", "O,R", "Float64"),
+    ("EMSX_ORDER_TYPE", "O,R", "String"),
+    ("EMSX_ORD_REF_ID", "Order", "String"),
+    ("EMSX_ROUTE_ID", "Route Static", "Int32"),
+    ("EMSX_ROUTE_LAST_UPDATE_TIME", "Route", "Int32"),
+    ("EMSX_SEQUENCE", "O,R Static", "Int32"),
+    ("EMSX_SIDE", "O,R Static", "String"),
+    ("EMSX_STATUS", "O,R", "String"),
+    ("EMSX_TICKER", "O,R Static", "String"),
+    ("EMSX_TIF", "O,R", "String"),
+    ("EMSX_TIME_STAMP", "O,R Static", "Int32"),
+    ("EMSX_TRADER", "Order Static", "String"),
+    ("EMSX_WORKING", "O,R", "Int32"),
+]
+
+DEFAULT_BROKERS = {
+    "EQTY": {"BMTB": {"VWAP": ["StartTime", "EndTime", "MaxPctVolume"], "DMA": []},
+             "EFIX": {"TWAP": ["StartTime", "EndTime"]}},
+    "OPT": {"BMTB": {"DMA": []}},
+    "FUT": {"EFIX": {"DMA": []}},
+    "MULTILEG_OPT": {},
+}
+
+TICKERS = ["IBM US Equity", "AAPL US Equity", "MSFT US Equity", "VOD LN Equity", "BP/ LN Equity",
+           "7203 JT Equity", "SAP GY Equity", "BHP AU Equity"]
+
+FIRST_SEQUENCE = 1000000
+
+ORDER_REQUEST_FIELDS = [
+    ("EMSX_TICKER", "String"),
+    ("EMSX_AMOUNT", "Int32"),
+    ("EMSX_ORDER_TYPE", "String"),
+    ("EMSX_TIF", "String"),
+    ("EMSX_HAND_INSTRUCTION", "String"),
+    ("EMSX_SIDE", "String"),
+    ("EMSX_LIMIT_PRICE", "Float64"),
+    ("EMSX_ACCOUNT", "String"),
+    ("EMSX_ORDER_REF_ID", "String"),
+]
+
+ROUTE_REQUEST_FIELDS = [
+    ("EMSX_AMOUNT", "Int32"),
+    ("EMSX_BROKER", "String"),
+    ("EMSX_ORDER_TYPE", "String"),
+    ("EMSX_TIF", "String"),
+    ("EMSX_HAND_INSTRUCTION", "String"),
+    ("EMSX_LIMIT_PRICE", "Float64"),
+]
+
+ROUTE_KEY_FIELDS = [("EMSX_SEQUENCE", "Int32"), ("EMSX_ROUTE_ID", "Int32")]
+
+# request definition of every simulated operation: (name, type, max values[, min values]) where type
+# is a simple type name or a list of child fields
+REQUEST_SCHEMA = {
+    "GetTeams": [],
+    "GetBrokersWithAssetClass": [("EMSX_ASSET_CLASS", "String", 1)],
+    "GetBrokerStrategiesWithAssetClass": [("EMSX_ASSET_CLASS", "String", 1), ("EMSX_BROKER", "String", 1)],
+    "GetBrokerStrategyInfoWithAssetClass": [("EMSX_ASSET_CLASS", "String", 1), ("EMSX_BROKER", "String", 1), ("EMSX_STRATEGY", "String", 1)],
+    "CreateOrder": [(n, t, 1) for n, t in ORDER_REQUEST_FIELDS],
+    "CreateOrderAndRouteEx": [(n, t, 1) for n, t in ORDER_REQUEST_FIELDS] + [("EMSX_BROKER", "String", 1)],
+    "RouteEx": [("EMSX_SEQUENCE", "Int32", 1, 1)] + [(n, t, 1) for n, t in ROUTE_REQUEST_FIELDS],
+    "ModifyOrderEx": [("EMSX_SEQUENCE", "Int32", 1, 1)] + [(n, t, 1) for n, t in ORDER_REQUEST_FIELDS if n != "EMSX_SIDE"],
+    "ModifyRouteEx": [(n, t, 1, 1) for n, t in ROUTE_KEY_FIELDS] + [(n, t, 1) for n, t in ROUTE_REQUEST_FIELDS if n != "EMSX_BROKER"],
+    "CancelRouteEx": [("ROUTES", ROUTE_KEY_FIELDS, -1, 1)],
+    "DeleteOrder": [("EMSX_SEQUENCE", "Int32", -1, 1)],
+}
+
+DATA_TYPES = {
+    "String": blpapi.DataType.STRING,
+    "Int32": blpapi.DataType.INT32,
+    "Float64": blpapi.DataType.FLOAT64,
+}
+
+
+def seconds_since_midnight():
+    now = datetime.datetime.now()
+    return int((now - now.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds())
+
+
+class SimulatedElementDefinition:
+
+    class TypeDefinition:
+
+        def __init__(self, description, children=None):
+            self.__description = description
+            self.__children = children or []
+
+        def description(self):
+            return self.__description
+
+        def datatype(self):
+            if self.__children:
+                return blpapi.DataType.SEQUENCE
+            return DATA_TYPES.get(self.__description, blpapi.DataType.STRING)
+
+        def isComplexType(self):
+            return len(self.__children) > 0
+
+        def isEnumerationType(self):
+            return False
+
+        def numElementDefinitions(self):
+            return len(self.__children)
+
+        def getElementDefinition(self, i):
+            return self.__children[i]
+
+    def __init__(self, name, description, type_description, max_values=1, children=None, min_values=0):
+        self.__name = blpapi.Name(name)
+        self.__description = description
+        self.__max_values = max_values
+        self.__min_values = min_values
+        self.__type = SimulatedElementDefinition.TypeDefinition(type_description, children)
+
+    def name(self):
+        return self.__name
+
+    def status(self):
+        return 0
+
+    def typeDefinition(self):
+        return self.__type
+
+    def minValues(self):
+        return self.__min_values
+
+    def maxValues(self):
+        return self.__max_values
+
+    def description(self):
+        return self.__description
+
+
+class SimulatedOperation:
+
+    def __init__(self, name, fields):
+        self.__name = blpapi.Name(name)
+        self.__definition = SimulatedElementDefinition(name, "", "Sequence", 1, [self.field(f) for f in fields])
+
+    @staticmethod
+    def field(f):
+        name, type_description, max_values = f[:3]
+        min_values = f[3] if len(f) > 3 else 0
+        if isinstance(type_description, list):
+            children = [SimulatedElementDefinition(n, "", t) for n, t in type_description]
+            return SimulatedElementDefinition(name, "", "Sequence", max_values, children, min_values)
+        return SimulatedElementDefinition(name, "", type_description, max_values, None, min_values)
+
+    def name(self):
+        return self.__name
+
+    def requestDefinition(self):
+        return self.__definition
+
+
+class SimulatedSchema:
+
+    def __init__(self, field_definitions):
+        self.field_definitions = field_definitions
+
+    def typeDefinition(self):
+        return self
+
+    def numElementDefinitions(self):
+        return len(self.field_definitions)
+
+    def getElementDefinition(self, i):
+        return self.field_definitions[i]
+
+
+class SimulatedElement:
+
+    def __init__(self, name, value):
+        self.__name = blpapi.Name(name)
+        self.value = value
+
+    def name(self):
+        return self.__name
+
+    def getValueAsString(self):
+        return str(self.value)
+
+    def getValue(self, i=0):
+        if isinstance(self.value, list):
+            return self.value[i]
+        return self.value
+
+    def numValues(self):
+        if isinstance(self.value, list):
+            return len(self.value)
+        return 1
+
+    def values(self):
+        for v in self.value:
+            if isinstance(v, dict):
+                yield SimulatedMessage(None, None, v)
+            else:
+                yield v
+
+    def __str__(self):
+        return "%s = %s" % (self.__name, self.value)
+
+
+class SimulatedMessage:
+
+    def __init__(self, message_type, correlation_id, elements):
+        self.__type = message_type
+        self.__cid = correlation_id
+        self.__elements = elements
+        self.__names = None
+
+    def messageType(self):
+        return self.__type
+
+    def correlationIds(self):
+        return [self.__cid]
+
+    def numElements(self):
+        return len(self.__elements)
+
+    def hasElement(self, name):
+        return str(name) in self.__elements
+
+    def getElement(self, name_or_index):
+        if isinstance(name_or_index, int):
+            if self.__names is None:
+                self.__names = list(self.__elements)
+            name = self.__names[name_or_index]
+        else:
+            name = str(name_or_index)
+        return SimulatedElement(name, self.__elements[name])
+
+    def getElementAsInteger(self, name):
+        return int(self.__elements[str(name)])
+
+    def getElementAsFloat(self, name):
+        return float(self.__elements[str(name)])
+
+    def getElementAsString(self, name):
+        return str(self.__elements[str(name)])
+
+    def asElement(self):
+        return self
+
+    def __str__(self):
+        lines = ["%s = {" % self.__type]
+        for name, value in self.__elements.items():
+            lines.append("    %s = %s" % (name, value))
+        lines.append("}")
+        return "\n".join(lines)
+
+
+class SimulatedEvent:
+
+    def __init__(self, event_type, messages):
+        self.event_type = event_type
+        self.messages = messages
+
+    def eventType(self):
+        return self.event_type
+
+    def __iter__(self):
+        return iter(self.messages)
+
+
+class SimulatedRequestElement:
+
+    def __init__(self, name):
+        self.__name = blpapi.Name(name)
+        self.values = {}
+        self.items = []
+        self.scalar = None
+
+    def name(self):
+        return self.__name
+
+    def setElement(self, name, value):
+        self.values[str(name)] = value
+
+    def getElement(self, name):
+        name = str(name)
+        if name not in self.values:
+            self.values[name] = SimulatedRequestElement(name)
+        return self.values[name]
+
+    def setValue(self, value):
+        self.scalar = value
+
+    def appendValue(self, value):
+        self.items.append(value)
+
+    def appendElement(self):
+        e = SimulatedRequestElement(str(self.__name))
+        self.items.append(e)
+        return e
+
+    def to_python(self):
+        if self.scalar is not None:
+            return self.scalar
+        if self.items:
+            return [i.to_python() if isinstance(i, SimulatedRequestElement) else i for i in self.items]
+        if self.values:
+            return dict((k, v.to_python() if isinstance(v, SimulatedRequestElement) else v) for k, v in self.values.items())
+        return None
+
+
+class SimulatedRequest:
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.root = SimulatedRequestElement(operation)
+
+    def set(self, name, value):
+        self.root.setElement(name, value)
+
+    def append(self, name, value):
+        self.root.getElement(name).appendValue(value)
+
+    def getElement(self, name):
+        return self.root.getElement(name)
+
+    def asElement(self):
+        return self.root
+
+    def values(self):
+        return self.root.to_python() or {}
+
+    def __str__(self):
+        lines = ["%s = {" % self.operation]
+        for name, value in self.values().items():
+            lines.append("    %s = %s" % (name, value))
+        lines.append("}")
+        return "\n".join(lines)
+
+
+class SimulatedService:
+
+    def __init__(self, simulator, name):
+        self.simulator = simulator
+        self.__name = name
+
+    def name(self):
+        return self.__name
+
+    def getEventDefinition(self, name):
+        if str(name) != str(ORDER_ROUTE_FIELDS):
+            raise ValueError("Unknown event definition: " + str(name))
+        return self.simulator.schema
+
+    def hasOperation(self, name):
+        return str(name) in REQUEST_SCHEMA
+
+    def getOperation(self, name):
+        if not self.hasOperation(name):
+            raise ValueError("Unknown operation: " + str(name))
+        return SimulatedOperation(str(name), REQUEST_SCHEMA[str(name)])
+
+    def createRequest(self, operation):
+        return SimulatedRequest(str(operation))
+
+
+class SimulatedSubscription:
+
+    def __init__(self, correlation_id, topic):
+        self.correlation_id = correlation_id
+        self.topic = topic
+
+        path, _, field_list = topic.partition("?fields=")
+        path, _, options = path.partition(";")
+
+        self.kind = path.rsplit("/", 1)[-1]
+        self.team = None
+        for opt in options.split(";"):
+            if opt.startswith("team="):
+                self.team = opt[len("team="):]
+
+        self.fields = [f for f in field_list.split(",") if f]
+
+
+class SimulatedSession:
+
+    def __init__(self, simulator, options=None, eventHandler=None):
+        self.simulator = simulator
+        self.options = options
+        self.event_handler = eventHandler
+        self.events = queue.Queue()
+        self.services = {}
+        self.subscriptions = []
+        self.next_cor_id = 1 << 32
+        self.running = False
+        self.dispatcher = None
+        self.pending_events = None
+
+    def start(self):
+        self.running = True
+        if self.event_handler is not None:
+            self.dispatcher = threading.Thread(target=self.dispatch_events, name="SimulatedSession", daemon=True)
+            self.dispatcher.start()
+        self.post(blpapi.Event.SESSION_STATUS, [SimulatedMessage(SESSION_CONNECTION_UP, None, {})])
+        self.post(blpapi.Event.SESSION_STATUS, [SimulatedMessage(SESSION_STARTED, None, {})])
+        return True
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.simulator.sessions.remove(self)
+        self.post(blpapi.Event.SESSION_STATUS, [SimulatedMessage(SESSION_TERMINATED, None, {})])
+        self.events.put(None)
+        if self.dispatcher is not None and self.dispatcher is not threading.current_thread():
+            self.dispatcher.join()
+
+    def openService(self, name):
+        if name not in self.simulator.service_names:
+            return False
+        self.services[name] = SimulatedService(self.simulator, name)
+        self.post(blpapi.Event.SERVICE_STATUS, [SimulatedMessage(SERVICE_OPENED, None, {"serviceName": name})])
+        return True
+
+    def getService(self, name):
+        return self.services[name]
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None, requestLabel=""):
+        if correlationId is None:
+            self.next_cor_id += 1
+            correlationId = blpapi.CorrelationId(self.next_cor_id)
+        message_type, elements = self.simulator.handle_request(request)
+        msg = SimulatedMessage(message_type, correlationId, elements)
+        self.post(blpapi.Event.RESPONSE, [msg], self.simulator.response_latency)
+        return correlationId
+
+    def subscribe(self, subscription_list, identity=None, requestLabel=""):
+        for i in range(0, subscription_list.size()):
+            s = SimulatedSubscription(subscription_list.correlationIdAt(i), subscription_list.topicStringAt(i))
+            self.subscriptions.append(s)
+            self.post(blpapi.Event.SUBSCRIPTION_STATUS, [SimulatedMessage(SUBSCRIPTION_STARTED, s.correlation_id, {})])
+            self.post_paint(self.simulator.init_paint(s), self.simulator.subscription_latency)
+
+    def unsubscribe(self, subscription_list):
+        cids = [subscription_list.correlationIdAt(i).value() for i in range(0, subscription_list.size())]
+        self.subscriptions = [s for s in self.subscriptions if s.correlation_id.value() not in cids]
+
+    def post(self, event_type, messages, delay=0):
+        event = SimulatedEvent(event_type, messages)
+        if delay > 0:
+            t = threading.Timer(delay, self.events.put, (event,))
+            t.daemon = True
+            t.start()
+        else:
+            self.events.put(event)
+
+    def post_paint(self, paint, delay=0):
+        if delay > 0:
+            t = threading.Timer(delay, self.events.put, (paint,))
+            t.daemon = True
+            t.start()
+        else:
+            self.events.put(paint)
+
+    def publish(self, kind, messages):
+        # messages are (team, elements) pairs built by the simulator
+        for s in self.subscriptions:
+            if s.kind != kind:
+                continue
+            batch = []
+            for team, elements in messages:
+                if s.team is None or s.team == team:
+                    batch.append(SimulatedMessage(ORDER_ROUTE_FIELDS, s.correlation_id, self.simulator.select_fields(s, elements)))
+            if batch:
+                self.post(blpapi.Event.SUBSCRIPTION_DATA, batch)
+
+    def next_item(self, block, timeout):
+        # init paints are queued as generators so that large blotters are built lazily
+        while True:
+            if self.pending_events is not None:
+                event = next(self.pending_events, None)
+                if event is not None:
+                    return event
+                self.pending_events = None
+                self.events.task_done()
+            item = self.events.get(block, timeout)
+            if item is None or isinstance(item, SimulatedEvent):
+                return item
+            self.pending_events = item
+
+    def dispatch_events(self):
+        while True:
+            event = self.next_item(True, None)
+            if event is None:
+                self.events.task_done()
+                break
+            try:
+                self.event_handler(event, self)
+            except Exception as err:
+                logger.error("Simulator >> Error in event handler: " + str(err))
+            if self.pending_events is None:
+                self.events.task_done()
+
+    def nextEvent(self, timeout=0):
+        try:
+            event = self.next_item(True, timeout / 1000.0 if timeout > 0 else None)
+        except queue.Empty:
+            return SimulatedEvent(blpapi.Event.TIMEOUT, [])
+        if event is None or self.pending_events is None:
+            self.events.task_done()
+        if event is None:
+            return SimulatedEvent(blpapi.Event.TIMEOUT, [])
+        return event
+
+    def tryNextEvent(self):
+        try:
+            event = self.next_item(False, None)
+        except queue.Empty:
+            return None
+        if event is not None and self.pending_events is None:
+            self.events.task_done()
+        return event
+
+    def wait_idle(self):
+        self.events.join()
+
+
+class EMSXSimulator:
+
+    def __init__(self, num_orders=1000, routes_per_order=1, update_rate=0.0, messages_per_event=100,
+                 teams=("TEAM_A", "TEAM_B"), brokers=None, response_latency=0.0, subscription_latency=0.0, seed=1):
+
+        self.num_orders = num_orders
+        self.routes_per_order = routes_per_order
+        self.update_rate = update_rate
+        self.messages_per_event = messages_per_event
+        self.teams = list(teams)
+        self.brokers = DEFAULT_BROKERS if brokers is None else brokers
+        self.response_latency = response_latency
+        self.subscription_latency = subscription_latency
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+
+        self.service_names = ("//blp/emapisvc_beta", "//blp/emapisvc")
+        self.schema = SimulatedSchema([SimulatedElementDefinition(n, d, t) for n, d, t in ORDER_ROUTE_SCHEMA])
+
+        # the blotter is derived from the sequence number; only changed rows are stored
+        self.order_overrides = {}
+        self.route_overrides = {}
+        self.extra_routes = {}
+        self.deleted = set()
+        self.next_sequence = FIRST_SEQUENCE + num_orders
+
+        self.sessions = []
+        self.updater = None
+        self.updates_sent = 0
+
+    def create_session(self, options=None, eventHandler=None):
+        s = SimulatedSession(self, options, eventHandler)
+        self.sessions.append(s)
+        if self.update_rate > 0 and self.updater is None:
+            self.updater = threading.Thread(target=self.generate_updates, name="SimulatedUpdates", daemon=True)
+            self.updater.start()
+        return s
+
+    def sequences(self):
+        for seq in range(FIRST_SEQUENCE, self.next_sequence):
+            if seq not in self.deleted:
+                yield seq
+
+    def route_ids(self, seq):
+        if seq < FIRST_SEQUENCE + self.num_orders:
+            ids = list(range(1, self.routes_per_order + 1))
+        else:
+            ids = []
+        return ids + self.extra_routes.get(seq, [])
+
+    def team_of(self, seq):
+        if not self.teams:
+            return None
+        return self.teams[seq % len(self.teams)]
+
+    def order_values(self, seq):
+        amount = 100 * (1 + seq % 50)
+        values = {
+            "EMSX_ACCOUNT": "ACCT%d" % (seq % 7),
+            "EMSX_AMOUNT": amount,
+            "EMSX_AVG_PRICE": 0.0,
+            "EMSX_BROKER": "BMTB" if self.routes_per_order > 0 else "",
+            "EMSX_DATE": 20171221,
+            "EMSX_FILLED": 0,
+            "EMSX_HAND_INSTRUCTION": "ANY",
+            "EMSX_IDLE_AMOUNT": 0 if self.routes_per_order > 0 else amount,
+            "EMSX_LAST_FILL_DATE": 0,
+            "EMSX_LIMIT_PRICE": round(10.0 + seq % 200, 2),
+            "EMSX_ORDER_TYPE": "LMT" if seq % 3 else "MKT",
+            "EMSX_ORD_REF_ID": "REF%d" % seq,
+            "EMSX_SEQUENCE": seq,
+            "EMSX_SIDE": "BUY" if seq % 2 else "SELL",
+            "EMSX_STATUS": "WORKING" if self.routes_per_order > 0 else "NEW",
+            "EMSX_TICKER": TICKERS[seq % len(TICKERS)],
+            "EMSX_TIF": "DAY",
+            "EMSX_TIME_STAMP": 32400 + seq % 28800,
+            "EMSX_TRADER": "TRADER%d" % (seq % 3),
+            "EMSX_WORKING": amount if self.routes_per_order > 0 else 0,
+        }
+        values.update(self.order_overrides.get(seq, {}))
+        return values
+
+    def route_values(self, seq, route_id):
+        order = self.order_values(seq)
+        values = {
+            "EMSX_ACCOUNT": order["EMSX_ACCOUNT"],
+            "EMSX_AMOUNT": order["EMSX_AMOUNT"] // max(1, self.routes_per_order),
+            "EMSX_AVG_PRICE": 0.0,
+            "EMSX_BROKER": "BMTB",
+            "EMSX_DATE": order["EMSX_DATE"],
+            "EMSX_FILLED": 0,
+            "EMSX_LAST_FILL_DATE": 0,
+            "EMSX_LIMIT_PRICE": order["EMSX_LIMIT_PRICE"],
+            "EMSX_ORDER_TYPE": order["EMSX_ORDER_TYPE"],
+            "EMSX_ROUTE_ID": route_id,
+            "EMSX_ROUTE_LAST_UPDATE_TIME": order["EMSX_TIME_STAMP"],
+            "EMSX_SEQUENCE": seq,
+            "EMSX_SIDE": order["EMSX_SIDE"],
+            "EMSX_STATUS": "WORKING",
+            "EMSX_TICKER": order["EMSX_TICKER"],
+            "EMSX_TIF": order["EMSX_TIF"],
+            "EMSX_TIME_STAMP": order["EMSX_TIME_STAMP"],
+            "EMSX_WORKING": order["EMSX_AMOUNT"] // max(1, self.routes_per_order),
+        }
+        values.update(self.route_overrides.get((seq, route_id), {}))
+        return values
+
+    @staticmethod
+    def select_fields(subscription, elements):
+        selected = {"EVENT_STATUS": elements["EVENT_STATUS"]}
+        if "EMSX_SEQUENCE" in elements:
+            selected["EMSX_SEQUENCE"] = elements["EMSX_SEQUENCE"]
+        if subscription.kind == "route" and "EMSX_ROUTE_ID" in elements:
+            selected["EMSX_ROUTE_ID"] = elements["EMSX_ROUTE_ID"]
+        for f in subscription.fields:
+            if f in elements:
+                selected[f] = elements[f]
+        return selected
+
+    def init_paint(self, subscription):
+
+        batch = []
+
+        with self.lock:
+            if subscription.kind == "order":
+                keys = [(seq, None) for seq in self.sequences()]
+            else:
+                keys = [(seq, rid) for seq in self.sequences() for rid in self.route_ids(seq)]
+
+        for seq, route_id in keys:
+            if subscription.team is not None and self.team_of(seq) != subscription.team:
+                continue
+            with self.lock:
+                if route_id is None:
+                    elements = self.order_values(seq)
+                else:
+                    elements = self.route_values(seq, route_id)
+            elements["EVENT_STATUS"] = 4
+            batch.append(SimulatedMessage(ORDER_ROUTE_FIELDS, subscription.correlation_id, self.select_fields(subscription, elements)))
+            if len(batch) >= self.messages_per_event:
+                yield SimulatedEvent(blpapi.Event.SUBSCRIPTION_DATA, batch)
+                batch = []
+
+        batch.append(SimulatedMessage(ORDER_ROUTE_FIELDS, subscription.correlation_id, {"EVENT_STATUS": 11}))
+        yield SimulatedEvent(blpapi.Event.SUBSCRIPTION_DATA, batch)
+
+    def publish(self, order_changes, route_changes):
+        order_messages = []
+        for seq, event_status in order_changes:
+            elements = self.order_values(seq)
+            elements["EVENT_STATUS"] = event_status
+            order_messages.append((self.team_of(seq), elements))
+
+        route_messages = []
+        for seq, route_id, event_status in route_changes:
+            elements = self.route_values(seq, route_id)
+            elements["EVENT_STATUS"] = event_status
+            route_messages.append((self.team_of(seq), elements))
+
+        for s in list(self.sessions):
+            if order_messages:
+                s.publish("order", order_messages)
+            if route_messages:
+                s.publish("route", route_messages)
+
+    def update_order(self, seq, **values):
+        with self.lock:
+            self.order_overrides.setdefault(seq, {}).update(values)
+            self.publish([(seq, 7)], [])
+
+    def update_route(self, seq, route_id, **values):
+        with self.lock:
+            self.route_overrides.setdefault((seq, route_id), {}).update(values)
+            self.publish([], [(seq, route_id, 7)])
+
+    def random_fill(self):
+        seq = FIRST_SEQUENCE + self.random.randrange(0, max(1, self.next_sequence - FIRST_SEQUENCE))
+        if seq in self.deleted:
+            return None
+        order = self.order_values(seq)
+        remaining = order["EMSX_AMOUNT"] - order["EMSX_FILLED"]
+        if remaining <= 0:
+            # reset fully filled orders so that the update stream never dries up
+            self.order_overrides[seq] = {}
+            for route_id in self.route_ids(seq):
+                self.route_overrides.pop((seq, route_id), None)
+            return seq, None
+        qty = min(remaining, 100)
+        filled = order["EMSX_FILLED"] + qty
+        price = round(order["EMSX_LIMIT_PRICE"] * (1 + self.random.uniform(-0.01, 0.01)), 4)
+        self.order_overrides.setdefault(seq, {}).update({
+            "EMSX_FILLED": filled,
+            "EMSX_WORKING": order["EMSX_AMOUNT"] - filled,
+            "EMSX_AVG_PRICE": price,
+            "EMSX_STATUS": "FILLED" if filled == order["EMSX_AMOUNT"] else "PARTFILLED",
+        })
+        route_ids = self.route_ids(seq)
+        if not route_ids:
+            return seq, None
+        route_id = route_ids[0]
+        route = self.route_values(seq, route_id)
+        route_filled = min(route["EMSX_AMOUNT"], route["EMSX_FILLED"] + qty)
+        self.route_overrides.setdefault((seq, route_id), {}).update({
+            "EMSX_FILLED": route_filled,
+            "EMSX_WORKING": route["EMSX_AMOUNT"] - route_filled,
+            "EMSX_AVG_PRICE": price,
+            "EMSX_STATUS": "FILLED" if route_filled == route["EMSX_AMOUNT"] else "PARTFILLED",
+            "EMSX_ROUTE_LAST_UPDATE_TIME": seconds_since_midnight(),
+        })
+        return seq, route_id
+
+    def inject_updates(self, count):
+        sent = 0
+        while sent < count:
+            n = min(self.messages_per_event, count - sent)
+            order_changes = []
+            route_changes = []
+            with self.lock:
+                for _ in range(0, n):
+                    change = self.random_fill()
+                    if change is None:
+                        continue
+                    seq, route_id = change
+                    order_changes.append((seq, 7))
+                    if route_id is not None:
+                        route_changes.append((seq, route_id, 7))
+                self.publish(order_changes, route_changes)
+            sent += n
+        self.updates_sent += sent
+        return sent
+
+    def generate_updates(self):
+        interval = self.messages_per_event / float(self.update_rate)
+        next_tick = time.monotonic()
+        while self.sessions:
+            self.inject_updates(self.messages_per_event)
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()
+        self.updater = None
+
+    def wait_idle(self):
+        for s in list(self.sessions):
+            s.wait_idle()
+
+    def terminate_sessions(self):
+        for s in list(self.sessions):
+            s.stop()
+
+    def terminate_subscriptions(self):
+        for s in list(self.sessions):
+            lost = s.subscriptions
+            s.subscriptions = []
+            for sub in lost:
+                s.post(blpapi.Event.SUBSCRIPTION_STATUS, [SimulatedMessage(SUBSCRIPTION_TERMINATED, sub.correlation_id, {})])
+
+    def delete_order(self, seq):
+        with self.lock:
+            self.publish([(seq, 8)], [])
+            self.deleted.add(seq)
+
+    def slow_consumer_warning(self, cleared=False):
+        message_type = SLOW_CONSUMER_WARNING_CLEARED if cleared else SLOW_CONSUMER_WARNING
+        for s in list(self.sessions):
+            s.post(blpapi.Event.ADMIN, [SimulatedMessage(message_type, None, {})])
+
+    def handle_request(self, request):
+
+        operation = request.operation
+        values = request.values()
+
+        with self.lock:
+            handler = getattr(self, "request_" + operation, None)
+            if handler is None:
+                return self.error(99999, "Unknown operation: " + operation)
+            return handler(values)
+
+    @staticmethod
+    def error(code, message):
+        return ERROR_INFO, {"ERROR_CODE": code, "ERROR_MESSAGE": message}
+
+    def request_GetTeams(self, values):
+        return blpapi.Name("GetTeams"), {"TEAMS": list(self.teams)}
+
+    def request_GetBrokersWithAssetClass(self, values):
+        asset_class = values.get("EMSX_ASSET_CLASS", "EQTY")
+        return blpapi.Name("GetBrokersWithAssetClass"), {"EMSX_BROKERS": list(self.brokers.get(asset_class, {}))}
+
+    def request_GetBrokerStrategiesWithAssetClass(self, values):
+        strategies = self.brokers.get(values.get("EMSX_ASSET_CLASS"), {}).get(values.get("EMSX_BROKER"), {})
+        return blpapi.Name("GetBrokerStrategiesWithAssetClass"), {"EMSX_STRATEGIES": list(strategies)}
+
+    def request_GetBrokerStrategyInfoWithAssetClass(self, values):
+        strategies = self.brokers.get(values.get("EMSX_ASSET_CLASS"), {}).get(values.get("EMSX_BROKER"), {})
+        params = strategies.get(values.get("EMSX_STRATEGY"), [])
+        if not params:
+            return self.error(0, "No strategy parameters :2")
+        info = [{"FieldName": p, "Disable": 0, "StringValue": ""} for p in params]
+        return blpapi.Name("GetBrokerStrategyInfoWithAssetClass"), {"EMSX_STRATEGY_INFO": info}
+
+    def new_order(self, values):
+        seq = self.next_sequence
+        self.next_sequence += 1
+        overrides = dict((k, v) for k, v in values.items() if not isinstance(v, (list, dict)))
+        overrides.setdefault("EMSX_STATUS", "NEW")
+        overrides.setdefault("EMSX_WORKING", 0)
+        overrides.setdefault("EMSX_BROKER", "")
+        overrides["EMSX_IDLE_AMOUNT"] = overrides.get("EMSX_AMOUNT", 0)
+        self.order_overrides[seq] = overrides
+        return seq
+
+    def new_route(self, seq, values):
+        route_id = len(self.route_ids(seq)) + 1
+        self.extra_routes.setdefault(seq, []).append(route_id)
+        order = self.order_values(seq)
+        amount = values.get("EMSX_AMOUNT", order["EMSX_AMOUNT"])
+        self.route_overrides[(seq, route_id)] = {
+            "EMSX_AMOUNT": amount,
+            "EMSX_WORKING": amount,
+            "EMSX_BROKER": values.get("EMSX_BROKER", ""),
+        }
+        self.order_overrides.setdefault(seq, {}).update({"EMSX_STATUS": "WORKING", "EMSX_WORKING": amount,
+                                                          "EMSX_IDLE_AMOUNT": order["EMSX_AMOUNT"] - amount,
+                                                          "EMSX_BROKER": values.get("EMSX_BROKER", "")})
+        return route_id
+
+    def known_order(self, seq):
+        return FIRST_SEQUENCE <= seq < self.next_sequence and seq not in self.deleted
+
+    def request_CreateOrder(self, values):
+        seq = self.new_order(values)
+        self.publish([(seq, 6)], [])
+        return blpapi.Name("CreateOrder"), {"EMSX_SEQUENCE": seq, "MESSAGE": "Order created"}
+
+    def request_CreateOrderAndRouteEx(self, values):
+        seq = self.new_order(values)
+        route_id = self.new_route(seq, values)
+        self.publish([(seq, 6)], [(seq, route_id, 6)])
+        return blpapi.Name("CreateOrderAndRouteEx"), {"EMSX_SEQUENCE": seq, "EMSX_ROUTE_ID": route_id, "MESSAGE": "Order created and routed"}
+
+    def request_RouteEx(self, values):
+        seq = int(values.get("EMSX_SEQUENCE", 0))
+        if not self.known_order(seq):
+            return self.error(91, "Invalid order sequence number")
+        route_id = self.new_route(seq, values)
+        self.publish([(seq, 7)], [(seq, route_id, 6)])
+        return blpapi.Name("RouteEx"), {"EMSX_SEQUENCE": seq, "EMSX_ROUTE_ID": route_id, "MESSAGE": "Order routed"}
+
+    def request_ModifyOrderEx(self, values):
+        seq = int(values.get("EMSX_SEQUENCE", 0))
+        if not self.known_order(seq):
+            return self.error(91, "Invalid order sequence number")
+        changes = dict((k, v) for k, v in values.items() if k != "EMSX_SEQUENCE" and not isinstance(v, (list, dict)))
+        self.order_overrides.setdefault(seq, {}).update(changes)
+        self.publish([(seq, 7)], [])
+        return blpapi.Name("ModifyOrderEx"), {"EMSX_SEQUENCE": seq, "MESSAGE": "Order modified"}
+
+    def request_ModifyRouteEx(self, values):
+        seq = int(values.get("EMSX_SEQUENCE", 0))
+        route_id = int(values.get("EMSX_ROUTE_ID", 0))
+        if not self.known_order(seq) or route_id not in self.route_ids(seq):
+            return self.error(92, "Invalid route")
+        changes = dict((k, v) for k, v in values.items() if k not in ("EMSX_SEQUENCE", "EMSX_ROUTE_ID") and not isinstance(v, (list, dict)))
+        self.route_overrides.setdefault((seq, route_id), {}).update(changes)
+        self.publish([], [(seq, route_id, 7)])
+        return blpapi.Name("ModifyRouteEx"), {"EMSX_SEQUENCE": seq, "EMSX_ROUTE_ID": route_id, "MESSAGE": "Route modified"}
+
+    def request_CancelRouteEx(self, values):
+        route_changes = []
+        for r in values.get("ROUTES", []):
+            seq = int(r.get("EMSX_SEQUENCE", 0))
+            route_id = int(r.get("EMSX_ROUTE_ID", 0))
+            if not self.known_order(seq) or route_id not in self.route_ids(seq):
+                return self.error(92, "Invalid route")
+            self.route_overrides.setdefault((seq, route_id), {}).update({"EMSX_STATUS": "CANCEL", "EMSX_WORKING": 0})
+            route_changes.append((seq, route_id, 7))
+        self.publish([], route_changes)
+        return blpapi.Name("CancelRouteEx"), {"STATUS": 0, "MESSAGE": "Route cancellation request sent to broker"}
+
+    def request_DeleteOrder(self, values):
+        sequences = values.get("EMSX_SEQUENCE", [])
+        if not isinstance(sequences, list):
+            sequences = [sequences]
+        order_changes = []
+        for seq in sequences:
+            seq = int(seq)
+            if not self.known_order(seq):
+                return self.error(91, "Invalid order sequence number")
+            order_changes.append((seq, 8))
+        self.publish(order_changes, [])
+        for seq, _ in order_changes:
+            self.deleted.add(seq)
+        return blpapi.Name("DeleteOrder"), {"STATUS": 0, "MESSAGE": "Order deleted"}
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,238 @@
+# sortedview.py
+
+import bisect
+import itertools
+import logging
+import threading
+
+from .notification import Notification
+from .rules import NUMERIC_TYPES
+
+logger = logging.getLogger(__name__)
+
+# rows per bucket before it is split, small enough that inserting into a bucket is a short memmove
+BUCKET_LOAD = 256
+
+# sorts after every tie breaker, so (key, MAX_TIE) is an inclusive upper bound
+MAX_TIE = float("inf")
+
+
+class SortedEntries:
+
+    # a list of sorted buckets: finding the bucket is a bisect over the bucket maxima and the
+    # insert or delete only moves the entries of one bucket
+    def __init__(self, load=BUCKET_LOAD):
+        self.load = load
+        self.buckets = []
+        self.maxes = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, entry):
+
+        if not self.buckets:
+            self.buckets.append([entry])
+            self.maxes.append(entry)
+        else:
+            i = bisect.bisect_left(self.maxes, entry)
+            if i == len(self.maxes):
+                i -= 1
+                self.buckets[i].append(entry)
+                self.maxes[i] = entry
+            else:
+                bisect.insort(self.buckets[i], entry)
+            if len(self.buckets[i]) > 2 * self.load:
+                bucket = self.buckets[i]
+                self.buckets[i:i + 1] = [bucket[:self.load], bucket[self.load:]]
+                self.maxes[i:i + 1] = [bucket[self.load - 1], bucket[-1]]
+        self.size += 1
+
+    def remove(self, entry):
+
+        i = bisect.bisect_left(self.maxes, entry)
+        bucket = self.buckets[i]
+        j = bisect.bisect_left(bucket, entry)
+        del bucket[j]
+        self.size -= 1
+        if not bucket:
+            del self.buckets[i]
+            del self.maxes[i]
+        elif j == len(bucket):
+            self.maxes[i] = bucket[-1]
+
+    def __iter__(self):
+        for bucket in self.buckets:
+            for entry in bucket:
+                yield entry
+
+    def __reversed__(self):
+        for bucket in reversed(self.buckets):
+            for entry in reversed(bucket):
+                yield entry
+
+    def between(self, low, high):
+
+        # entries with low <= entry <= high, either bound may be None
+        i = 0 if low is None else bisect.bisect_left(self.maxes, low)
+        j = 0 if low is None or i == len(self.buckets) else bisect.bisect_left(self.buckets[i], low)
+        while i < len(self.buckets):
+            bucket = self.buckets[i]
+            while j < len(bucket):
+                entry = bucket[j]
+                if high is not None and entry > high:
+                    return
+                yield entry
+                j += 1
+            i += 1
+            j = 0
+
+
+class SortedView:
+
+    def __init__(self, collection, key, reverse=False, where=None, fields=None, convert=None):
+
+        self.collection = collection
+        self.reverse = reverse
+        self.where = where
+        self.convert = convert
+
+        if isinstance(key, str):
+            key = (key,)
+        if isinstance(key, tuple):
+            self.key_fields = key
+            self.key = self.field_key
+            # values are strings as EMSX delivers them, numeric schema fields sort as numbers unless told otherwise
+            if convert is None:
+                self.converters = [self.numeric(collection, name) for name in key]
+            else:
+                self.converters = [convert] * len(key)
+            if fields is None and where is None:
+                fields = key
+        elif callable(key):
+            self.key = key
+        else:
+            raise ValueError("A sorted view needs a field name, a tuple of field names or a key function")
+
+        # None means every change has to be looked at, the key or the filter may read any field
+        self.fields = None if fields is None else frozenset(collection.source_fields(fields))
+        self.entries = SortedEntries()
+        self.rows = {}
+        self.ties = itertools.count()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def numeric(collection, name):
+        definition = collection.field_definitions.get(name)
+        return None if definition is None else NUMERIC_TYPES.get(definition.type)
+
+    def field_key(self, row):
+        values = []
+        for name, convert in zip(self.key_fields, self.converters):
+            f = row.field(name)
+            value = None if f is None else f.value()
+            values.append(value if convert is None else convert(value))
+        return values[0] if len(values) == 1 else tuple(values)
+
+    def entry_for(self, row):
+        if self.where is not None and not self.where(row):
+            return None
+        try:
+            key = self.key(row)
+        except (ValueError, TypeError) as err:
+            logger.debug("Row left out of sorted view, no key: %s", err)
+            return None
+        if key is None:
+            return None
+        return (key, next(self.ties), row)
+
+    def load(self):
+        for row in list(self.collection):
+            if row.field("EMSX_STATUS") is None or row.field("EMSX_STATUS").value() != "DELETED":
+                self.update(row)
+
+    def update(self, row):
+
+        entry = self.entry_for(row)
+        with self.lock:
+            current = self.rows.get(id(row))
+            if current is not None:
+                if entry is not None and entry[0] == current[0]:
+                    return
+                self.entries.remove(current)
+                del self.rows[id(row)]
+            if entry is not None:
+                self.entries.add(entry)
+                self.rows[id(row)] = entry
+
+    def discard(self, row):
+        with self.lock:
+            current = self.rows.pop(id(row), None)
+            if current is not None:
+                self.entries.remove(current)
+
+    def changed(self, row, notification):
+
+        if notification.type == Notification.NotificationType.DELETE:
+            self.discard(row)
+            return
+        if self.fields is not None and id(row) in self.rows:
+            for fc in notification.field_changes:
+                if fc.field.name() in self.fields:
+                    break
+            else:
+                return
+        self.update(row)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, row):
+        return id(row) in self.rows
+
+    def __iter__(self):
+        return iter(self.top(None))
+
+    def key_of(self, row):
+        entry = self.rows.get(id(row))
+        return None if entry is None else entry[0]
+
+    def top(self, k):
+        # the first k rows in view order, all of them when k is None
+        with self.lock:
+            entries = reversed(self.entries) if self.reverse else iter(self.entries)
+            return [entry[2] for entry in itertools.islice(entries, k)]
+
+    def range(self, low=None, high=None, limit=None):
+        # rows whose key is between low and high inclusive, in view order
+        with self.lock:
+            found = [entry[2] for entry in self.entries.between(None if low is None else (low,), None if high is None else (high, MAX_TIE))]
+        if self.reverse:
+            found.reverse()
+        return found if limit is None else found[:limit]
+
+    def close(self):
+        self.collection.remove_sorted_view(self)
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
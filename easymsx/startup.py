@@ -0,0 +1,172 @@
+# startup.py
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PHASE_SESSION = "session"
+PHASE_SERVICE = "service"
+PHASE_SCHEMA = "schema"
+PHASE_TEAMS = "teams"
+PHASE_BROKERS = "brokers"
+PHASE_ORDERS = "orders"
+PHASE_ROUTES = "routes"
+
+
+class StartupPhase:
+
+    def __init__(self, name, start_ns):
+        self.name = name
+        self.start_ns = start_ns
+        self.end_ns = None
+        self.issued = False
+        self.pending = 0
+        self.requests = 0
+
+    def done(self):
+        return self.end_ns is not None
+
+    def duration_ns(self):
+        if self.end_ns is None:
+            return None
+        return self.end_ns - self.start_ns
+
+
+class StartupTracker:
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.phases = {}
+        self.request_phases = {}
+        self.started_ns = None
+
+    def begin(self, name, tracks_requests=False):
+
+        # with tracks_requests, requests submitted by this thread until issued() belong to the phase
+        now = time.perf_counter_ns()
+        with self.condition:
+            if self.started_ns is None:
+                self.started_ns = now
+            phase = self.phases[name] = StartupPhase(name, now)
+        if tracks_requests:
+            self.local.phase = phase
+        return phase
+
+    def issued(self, name):
+
+        # all first level work of the phase is out; nested requests keep it open
+        self.local.phase = None
+        with self.condition:
+            phase = self.phases[name]
+            phase.issued = True
+            if phase.pending == 0 and not phase.done():
+                self.end(phase)
+
+    def finish(self, name):
+        with self.condition:
+            phase = self.phases.get(name)
+            if phase is not None and not phase.done():
+                self.end(phase)
+
+    def end(self, phase):
+        phase.end_ns = time.perf_counter_ns()
+        self.condition.notify_all()
+        if self.metrics.enabled:
+            self.metrics.observe("startup_phase_ns", phase.end_ns - phase.start_ns, (("phase", phase.name),))
+
+    def request_submitted(self, cid):
+        phase = getattr(self.local, "phase", None)
+        if phase is None or phase.done():
+            return
+        with self.condition:
+            phase.pending += 1
+            phase.requests += 1
+            self.request_phases[cid] = phase
+
+    def response_started(self, cid):
+        # requests sent from a response handler belong to the phase of that response
+        self.local.phase = self.request_phases.get(cid)
+
+    def response_finished(self, cid):
+        self.local.phase = None
+        phase = self.request_phases.pop(cid, None)
+        if phase is None:
+            return
+        with self.condition:
+            phase.pending -= 1
+            if phase.issued and phase.pending == 0 and not phase.done():
+                self.end(phase)
+
+    def requests_failed(self):
+        # responses will never arrive for requests lost with the session
+        with self.condition:
+            self.request_phases.clear()
+            for phase in self.phases.values():
+                if phase.pending > 0:
+                    phase.pending = 0
+                    if phase.issued and not phase.done():
+                        self.end(phase)
+
+    def complete(self, names):
+        with self.condition:
+            return all(self.phases[n].done() for n in names if n in self.phases)
+
+    def wait(self, names, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: all(self.phases[n].done() for n in names if n in self.phases), timeout)
+
+    def report(self):
+
+        with self.condition:
+            phases = list(self.phases.values())
+
+        rows = []
+        end = self.started_ns
+        for p in phases:
+            rows.append({
+                "phase": p.name,
+                "start_ms": (p.start_ns - self.started_ns) / 1e6,
+                "duration_ms": None if p.end_ns is None else p.duration_ns() / 1e6,
+                "requests": p.requests,
+            })
+            if p.end_ns is not None and p.end_ns > end:
+                end = p.end_ns
+
+        total = 0.0 if self.started_ns is None else (end - self.started_ns) / 1e6
+        return {"total_ms": total, "phases": rows}
+
+    def format_report(self):
+
+        report = self.report()
+        lines = ["%-10s %10s %12s %9s" % ("phase", "start ms", "duration ms", "requests")]
+        for row in report["phases"]:
+            duration = "pending" if row["duration_ms"] is None else "%.3f" % row["duration_ms"]
+            lines.append("%-10s %10.3f %12s %9d" % (row["phase"], row["start_ms"], duration, row["requests"]))
+        lines.append("%-10s %10s %12.3f" % ("total", "", report["total_ms"]))
+        return "\n".join(lines)
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
@@ -0,0 +1,42 @@
+"""
+Base test case running EasyMSX against the in-process EMSX simulator.
+"""
+
+import shutil
+import tempfile
+import unittest
+from easymsx import easymsx
+from easymsx.simulator import EMSXSimulator
+
+
+class SimulatedTestCase(unittest.TestCase):
+
+    # keyword arguments for the EMSXSimulator and EasyMSX of every test. With easymsx_options None each test
+    # creates its own through create_easymsx; with start_emsx False it is configured before start() is called
+    simulator_options = {}
+    easymsx_options = {}
+    start_emsx = True
+
+    def setUp(self):
+        self.simulator = EMSXSimulator(**self.simulator_options)
+        self.emsx = None
+        if self.easymsx_options is not None:
+            self.create_easymsx(**self.easymsx_options)
+            if self.start_emsx:
+                self.emsx.start()
+
+    def tearDown(self):
+        if self.emsx is not None:
+            self.emsx.stop()
+
+    def create_easymsx(self, **options):
+        # the instance tearDown stops
+        options.setdefault("session_factory", self.simulator.create_session)
+        self.emsx = easymsx.EasyMSX(**options)
+        return self.emsx
+
+    def make_directory(self):
+        # removed once tearDown has stopped EasyMSX
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return directory
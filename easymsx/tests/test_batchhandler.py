@@ -0,0 +1,73 @@
+"""
+Batch notification handlers: one batch per event and time slices.
+"""
+
+import time
+import unittest
+from easymsx.notification import Notification
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestBatchHandler(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=10)
+    easymsx_options = dict(enable_metrics=True)
+
+    def setUp(self):
+        super().setUp()
+        self.batches = []
+
+    def delete(self, sequences):
+        # one request, so the simulator publishes every delete in one event
+        self.emsx.send_request(self.emsx.request_template("DeleteOrder").create(EMSX_SEQUENCE=sequences))
+        self.simulator.wait_idle()
+
+    def test_one_batch_per_event(self):
+
+        self.emsx.add_batch_handler(self.batches.append)
+        self.emsx.add_notification_handler(lambda n: setattr(n, "consumed", n.source.sequence == FIRST_SEQUENCE + 1))
+
+        self.delete([FIRST_SEQUENCE, FIRST_SEQUENCE + 1, FIRST_SEQUENCE + 2])
+
+        deletes = [b for b in self.batches if b[0].type == Notification.NotificationType.DELETE]
+        self.assertEqual(1, len(deletes))
+        self.assertEqual([FIRST_SEQUENCE, FIRST_SEQUENCE + 2], [n.source.sequence for n in deletes[0]])
+
+    def test_time_slice(self):
+
+        batch_handler = self.emsx.add_batch_handler(self.batches.append, interval=60)
+
+        self.delete([FIRST_SEQUENCE])
+        self.delete([FIRST_SEQUENCE + 3])
+        self.assertEqual([], self.batches)
+        self.assertEqual(2, len(batch_handler.pending))
+
+        self.emsx.flush_batches(force=True)
+        self.assertEqual([[FIRST_SEQUENCE, FIRST_SEQUENCE + 3]], [[n.source.sequence for n in b] for b in self.batches])
+
+        self.emsx.remove_batch_handler(self.batches.append)
+        self.assertEqual([], self.emsx.batch_handlers)
+
+
+    def test_quiet_stream_hands_over_the_last_slice(self):
+
+        self.emsx.add_batch_handler(self.batches.append, interval=0.2)
+
+        self.delete([FIRST_SEQUENCE])
+        deadline = time.monotonic() + 5
+        while not self.batches and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual([[FIRST_SEQUENCE]], [[n.source.sequence for n in b] for b in self.batches])
+
+    def test_stop_hands_over_pending_notifications(self):
+
+        self.emsx.add_batch_handler(self.batches.append, interval=60)
+
+        self.delete([FIRST_SEQUENCE])
+        self.assertEqual([], self.batches)
+        self.emsx.stop()
+        self.assertEqual([[FIRST_SEQUENCE]], [[n.source.sequence for n in b] for b in self.batches])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Bulk order and route operations over pipelined requests.
+"""
+
+import unittest
+from easymsx.bulk import rows_from_columns, STATUS_OK, STATUS_ERROR, STATUS_NO_RESPONSE, STATUS_NOT_SENT
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestBulk(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=10)
+
+    def test_basket_is_pipelined(self):
+
+        self.simulator.response_latency = 0.01
+        basket = [{"EMSX_TICKER": "IBM US Equity", "EMSX_AMOUNT": 100 + i, "EMSX_SIDE": "BUY", "EMSX_BROKER": "BMTB"} for i in range(100)]
+
+        result = self.emsx.orders.create_and_route_orders(basket, window=20)
+        summary = result.summary()
+
+        self.assertTrue(result.ok())
+        self.assertEqual({STATUS_OK: 100}, summary["status"])
+        self.assertEqual(100, len(set(i.response["EMSX_SEQUENCE"] for i in result)))
+        self.assertLess(summary["elapsed_ms"], 100 * 10 / 2)
+        self.assertTrue(all(i.latency_ns() >= 10e6 for i in result))
+
+        self.simulator.wait_idle()
+        self.assertEqual(110, len(list(self.emsx.orders)))
+
+    def test_columnar_input_with_per_item_errors(self):
+
+        columns = {"EMSX_SEQUENCE": [FIRST_SEQUENCE, 1, FIRST_SEQUENCE + 1], "EMSX_AMOUNT": [500, 600, 700]}
+        result = self.emsx.orders.modify_orders(columns)
+
+        self.assertEqual([STATUS_OK, STATUS_ERROR, STATUS_OK], [i.status for i in result])
+        self.assertEqual(91, result[1].error_code)
+        self.assertEqual([result[1]], result.failed())
+
+    def test_cancel_and_delete(self):
+
+        result = self.emsx.routes.cancel_routes([(FIRST_SEQUENCE, 1), (FIRST_SEQUENCE + 1, 1)])
+        self.assertTrue(result.ok())
+        result = self.emsx.orders.delete_orders([FIRST_SEQUENCE + 2])
+        self.assertTrue(result.ok())
+
+    def test_timeout_reports_unanswered_items(self):
+
+        self.simulator.response_latency = 5
+        result = self.emsx.bulk_request("GetTeams", [{}, {}, {}], window=1, timeout=0.1)
+
+        self.assertEqual([STATUS_NO_RESPONSE, STATUS_NOT_SENT, STATUS_NOT_SENT], [i.status for i in result])
+        self.assertEqual({}, self.emsx.response_waiters)
+        self.assertEqual({}, self.emsx.request_message_handlers)
+
+    def test_failed_send_is_not_sent(self):
+
+        def refuse(request, correlationId):
+            raise IOError("session is down")
+
+        self.emsx.session.sendRequest = refuse
+        result = self.emsx.bulk_request("GetTeams", [{}, {}], window=1)
+
+        # the requests never left, which is not the same as EMSX not answering
+        self.assertEqual([STATUS_NOT_SENT, STATUS_NOT_SENT], [i.status for i in result])
+
+    def test_columns_must_line_up(self):
+        self.assertEqual([{"A": 1, "B": 2}], rows_from_columns({"A": [1], "B": [2]}))
+        self.assertRaises(ValueError, rows_from_columns, {"A": [1, 2], "B": [2]})
+
+
+if __name__ == '__main__':
+    unittest.main()
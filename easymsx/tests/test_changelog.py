@@ -0,0 +1,72 @@
+"""
+The change data capture log: segments, replay from an offset and compaction.
+"""
+
+import unittest
+from easymsx.changelog import ChangeLog, ChangeLogReader, COMPACTED_SUFFIX, SEGMENT_SUFFIX, list_files
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestChangeLog(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=20)
+    easymsx_options = dict(enable_metrics=True)
+    start_emsx = False
+
+    def setUp(self):
+        super().setUp()
+        self.directory = self.make_directory()
+        # opened before start, so the initial paint is captured too
+        self.log = self.emsx.open_change_log(self.directory, segment_bytes=8192, index_interval=4)
+        self.emsx.start()
+
+    def modify(self, sequence, amounts):
+        for amount in amounts:
+            self.emsx.orders.get_by_sequence_no(sequence).modify({"EMSX_AMOUNT": amount})
+        self.simulator.wait_idle()
+        self.assertTrue(self.log.flush(5))
+
+    def test_records_and_index(self):
+
+        self.modify(FIRST_SEQUENCE, [11, 12])
+        records = list(ChangeLogReader(self.directory).records())
+
+        self.assertEqual(list(range(0, len(records))), [r["offset"] for r in records])
+        self.assertGreater(len(list_files(self.directory, SEGMENT_SUFFIX)), 1)
+
+        updates = [r for r in records if r["kind"] == "order" and r["sequence"] == FIRST_SEQUENCE and r["type"] == "UPDATE"]
+        self.assertEqual([["EMSX_AMOUNT", "11", "12"]], [c for c in updates[-1]["changes"] if c[0] == "EMSX_AMOUNT"])
+        self.assertEqual(updates[-2]["version"] + 1, updates[-1]["version"])
+
+        tail = list(ChangeLogReader(self.directory).records(len(records) - 7))
+        self.assertEqual(records[-7:], tail)
+
+    def test_compaction_keeps_latest_state(self):
+
+        self.modify(FIRST_SEQUENCE + 1, [21, 22, 23])
+        reader = ChangeLogReader(self.directory)
+        before = reader.latest_state()
+
+        self.assertGreater(self.log.compact(), 0)
+        self.assertEqual(before, reader.latest_state())
+        self.assertEqual(1, len(list_files(self.directory, SEGMENT_SUFFIX)))
+        self.assertEqual(1, len(list_files(self.directory, COMPACTED_SUFFIX)))
+        self.assertEqual("23", before[("order", FIRST_SEQUENCE + 1, 0)]["fields"]["EMSX_AMOUNT"])
+
+        # a reopened log carries on with offsets and versions
+        last = list(reader.records())[-1]
+        self.log.close()
+        self.emsx.change_log = ChangeLog(self.emsx, self.directory, segment_bytes=8192, index_interval=4)
+        self.log = self.emsx.change_log
+        self.log.start()
+        self.modify(FIRST_SEQUENCE + 1, [24])
+
+        records = list(reader.records())
+        record = [r for r in records if r["sequence"] == FIRST_SEQUENCE + 1 and r["kind"] == "order"][-1]
+        self.assertEqual(last["offset"] + 1, [r for r in records if r["offset"] > last["offset"]][0]["offset"])
+        self.assertEqual(before[("order", FIRST_SEQUENCE + 1, 0)]["version"] + 1, record["version"])
+
+
+if __name__ == '__main__':
+    unittest.main()
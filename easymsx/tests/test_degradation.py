@@ -0,0 +1,102 @@
+"""
+The adaptive degradation policy and the actions it takes under load.
+"""
+
+import threading
+from easymsx.degradation import DegradationPolicy, ACTION_CONFLATE
+from easymsx.notification import Notification
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestDegradation(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=10)
+
+    def setUp(self):
+        super().setUp()
+        self.normal = []
+        self.low_priority = []
+        self.field_notifications = []
+
+    def update(self, **values):
+        self.simulator.update_order(1000001, **values)
+        self.simulator.wait_idle()
+
+    def test_slow_consumer_warning_degrades_and_recovers(self):
+
+        self.emsx.set_degradation_policy(DegradationPolicy())
+        self.emsx.flight_recorder.enable()
+        self.emsx.orders.add_notification_handler(self.normal.append)
+        self.emsx.add_notification_handler(self.low_priority.append, low_priority=True)
+        self.emsx.orders.get_by_sequence_no(1000001).field("EMSX_FILLED").add_notification_handler(self.field_notifications.append)
+
+        self.simulator.slow_consumer_warning()
+        self.update(EMSX_FILLED=100)
+
+        self.assertTrue(self.emsx.degradation.degraded())
+        self.assertFalse(self.emsx.flight_recorder.enabled)
+        self.assertEqual([], self.low_priority)
+        self.assertEqual([], self.field_notifications)
+
+        self.simulator.slow_consumer_warning(cleared=True)
+        self.update(EMSX_FILLED=200)
+
+        self.assertFalse(self.emsx.degradation.degraded())
+        self.assertTrue(self.emsx.flight_recorder.enabled)
+        self.assertEqual(1, len(self.low_priority))
+        self.assertEqual(1, len(self.field_notifications))
+
+        counters = self.emsx.metrics.snapshot()["counters"]
+        self.assertEqual(1, counters[("degradation_transitions_total", (("state", "degraded"), ("reason", "slow_consumer")))])
+        self.assertEqual(1, counters[("degradation_transitions_total", (("state", "normal"), ("reason", "slow_consumer")))])
+
+    def test_conflated_delivery_merges_updates(self):
+
+        policy = DegradationPolicy(actions=(ACTION_CONFLATE,), conflation_interval=60)
+        self.emsx.set_degradation_policy(policy)
+        self.emsx.orders.add_notification_handler(self.normal.append)
+        # handlers never run under the policy lock
+        self.locked_during_delivery = []
+        self.emsx.orders.add_notification_handler(lambda n: self.locked_during_delivery.append(policy.lock.locked()))
+
+        self.simulator.slow_consumer_warning()
+        self.update(EMSX_FILLED=100)
+        self.update(EMSX_FILLED=200)
+
+        self.assertEqual([], self.normal)
+
+        self.simulator.slow_consumer_warning(cleared=True)
+        self.simulator.wait_idle()
+
+        self.assertEqual(1, len(self.normal))
+        self.assertFalse(self.locked_during_delivery[0])
+        n = self.normal[0]
+        self.assertEqual(Notification.NotificationType.UPDATE, n.type)
+        filled = [fc for fc in n.field_changes if fc.field.name() == "EMSX_FILLED"][0]
+        self.assertEqual(("0", "200"), (filled.old_value, filled.new_value))
+
+    def test_quiet_stream_flushes_on_a_timer(self):
+
+        self.emsx.set_degradation_policy(DegradationPolicy(actions=(ACTION_CONFLATE,), conflation_interval=0.1))
+        delivered = threading.Event()
+        self.emsx.orders.add_notification_handler(lambda n: delivered.set())
+
+        self.simulator.slow_consumer_warning()
+        self.update(EMSX_FILLED=100)
+
+        # no further event arrives, the window is still flushed once its interval is over
+        self.assertTrue(delivered.wait(2))
+        self.assertTrue(self.emsx.degradation.degraded())
+        self.assertEqual({}, self.emsx.conflated)
+
+    def test_queue_depth_thresholds(self):
+
+        policy = DegradationPolicy(queue_depth_high=100, queue_depth_low=10)
+        self.emsx.set_degradation_policy(policy)
+
+        policy.observe_queue_depth(150)
+        self.assertTrue(policy.degraded())
+        policy.observe_queue_depth(50)
+        self.assertTrue(policy.degraded())
+        policy.observe_queue_depth(5)
+        self.assertFalse(policy.degraded())
@@ -0,0 +1,110 @@
+"""
+Lazily computed derived fields and their invalidation.
+"""
+
+import unittest
+from easymsx.derivedfield import STANDARD_DERIVED_FIELDS, remaining
+from easymsx.notification import Notification
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestDerivedField(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=20, messages_per_event=10)
+
+    def setUp(self):
+        super().setUp()
+        self.computed = 0
+
+    def counting_remaining(self, row):
+        self.computed += 1
+        return remaining(row)
+
+    def test_computed_once_until_a_source_changes(self):
+
+        orders = self.emsx.orders
+        orders.add_derived_field("LEFT", ("EMSX_AMOUNT", "EMSX_FILLED"), self.counting_remaining)
+        orders.add_derived_field("LEFT_NOTIONAL", ("LEFT", "EMSX_LIMIT_PRICE"),
+                                 lambda o: o.field("LEFT").value() * float(o.field("EMSX_LIMIT_PRICE").value()))
+
+        o = orders.get_by_sequence_no(FIRST_SEQUENCE)
+        values = self.simulator.order_values(FIRST_SEQUENCE)
+        self.assertEqual(values["EMSX_AMOUNT"] - values["EMSX_FILLED"], o.field("LEFT").value())
+        o.field("LEFT").value()
+        o.field("LEFT_NOTIONAL").value()
+        self.assertEqual(1, self.computed)
+
+        # a field the derived field does not read leaves it alone
+        o.field("EMSX_TICKER").set_value("XYZ US Equity")
+        o.field("LEFT").value()
+        self.assertEqual(1, self.computed)
+
+        o.modify({"EMSX_AMOUNT": 12345})
+        self.simulator.wait_idle()
+        self.assertEqual(12345 - values["EMSX_FILLED"], o.field("LEFT").value())
+        self.assertEqual(2, self.computed)
+        self.assertAlmostEqual((12345 - values["EMSX_FILLED"]) * values["EMSX_LIMIT_PRICE"], o.field("LEFT_NOTIONAL").value())
+
+        self.assertIsNone(orders.get_by_sequence_no(FIRST_SEQUENCE + 1).fields.derived)
+        self.assertRaises(ValueError, orders.add_derived_field, "EMSX_AMOUNT", (), remaining)
+        self.assertRaises(ValueError, orders.add_derived_field, "X", ("NOT_A_FIELD",), remaining)
+
+    def test_source_changed_during_compute_is_not_lost(self):
+
+        o = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE)
+
+        def left(row):
+            # the dispatch thread applies a fill while the application thread is computing
+            if self.computed == 0:
+                o.field("EMSX_FILLED").set_value("777")
+            return self.counting_remaining(row)
+
+        self.emsx.orders.add_derived_field("LEFT", ("EMSX_AMOUNT", "EMSX_FILLED"), left)
+        amount = float(o.field("EMSX_AMOUNT").value())
+        o.field("LEFT").value()
+        self.assertEqual(amount - 777, o.field("LEFT").value())
+        self.assertEqual(2, self.computed)
+
+    def test_field_notification_handlers(self):
+
+        orders = self.emsx.orders
+        orders.add_derived_field("LEFT", ("EMSX_AMOUNT", "EMSX_FILLED"), self.counting_remaining)
+        o = orders.get_by_sequence_no(FIRST_SEQUENCE)
+        values = self.simulator.order_values(FIRST_SEQUENCE)
+        notifications = []
+        o.field("LEFT").add_notification_handler(notifications.append)
+
+        o.modify({"EMSX_AMOUNT": 12345})
+        self.simulator.wait_idle()
+
+        self.assertEqual(1, len(notifications))
+        self.assertEqual(Notification.NotificationType.FIELD, notifications[0].type)
+        fc = notifications[0].field_changes[0]
+        self.assertEqual("LEFT", fc.field.name())
+        self.assertEqual((values["EMSX_AMOUNT"] - values["EMSX_FILLED"], 12345 - values["EMSX_FILLED"]), (fc.old_value, fc.new_value))
+
+        # a source change that leaves the value as it was is not reported
+        o.field("EMSX_TICKER").set_value("XYZ US Equity")
+        o.modify({"EMSX_AMOUNT": 12345})
+        self.simulator.wait_idle()
+        self.assertEqual(1, len(notifications))
+
+    def test_sorted_view_over_a_derived_field(self):
+
+        for name, sources, compute in STANDARD_DERIVED_FIELDS:
+            self.emsx.orders.add_derived_field(name, sources, compute)
+        view = self.emsx.orders.add_sorted_view("PERCENT_FILLED", reverse=True)
+
+        self.simulator.inject_updates(300)
+        self.simulator.wait_idle()
+
+        expected = sorted((o.field("PERCENT_FILLED").value() for o in self.emsx.orders), reverse=True)
+        self.assertEqual(expected, [o.field("PERCENT_FILLED").value() for o in view])
+        for o in self.emsx.orders:
+            values = self.simulator.order_values(o.sequence)
+            self.assertAlmostEqual(100.0 * values["EMSX_FILLED"] / values["EMSX_AMOUNT"], o.field("PERCENT_FILLED").value())
+
+
+if __name__ == '__main__':
+    unittest.main()
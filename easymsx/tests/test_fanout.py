@@ -0,0 +1,182 @@
+"""
+The fan-out server and its read only client mirror.
+"""
+
+import os
+import socket
+import struct
+import threading
+import unittest
+from easymsx.derivedfield import remaining
+from easymsx.fanout import FanoutClient, FanoutConnection, FRAME_HEADER, FRAME_RESET
+from easymsx.notification import Notification
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestFanout(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=20)
+    easymsx_options = dict(enable_metrics=True)
+
+    def setUp(self):
+        super().setUp()
+        self.directory = self.make_directory()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        super().tearDown()
+
+    def connect(self, address):
+        client = FanoutClient(address)
+        self.clients.append(client)
+        client.connect()
+        self.assertTrue(client.wait_synced(5))
+        return client
+
+    def test_snapshot_then_deltas(self):
+
+        server = self.emsx.serve_fanout(os.path.join(self.directory, "emsx.sock"))
+        client = self.connect(server.address)
+
+        self.assertEqual(len(list(self.emsx.orders)), len(client.orders))
+        self.assertEqual(len(list(self.emsx.routes)), len(client.routes))
+        order = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE)
+        self.assertEqual(order.field("EMSX_TICKER").value(), client.orders.get_by_sequence_no(FIRST_SEQUENCE).field("EMSX_TICKER").value())
+        self.assertEqual(str(FIRST_SEQUENCE), client.routes.get_by_sequence_no_and_id(FIRST_SEQUENCE, 1).field("EMSX_SEQUENCE").value())
+
+        updated = threading.Event()
+        changes = []
+
+        def record(notification):
+            if notification.type == Notification.NotificationType.UPDATE:
+                changes.extend((fc.field.name(), fc.new_value) for fc in notification.field_changes)
+                updated.set()
+
+        client.add_notification_handler(record)
+        order.modify({"EMSX_AMOUNT": 777})
+        self.simulator.wait_idle()
+
+        self.assertTrue(updated.wait(5))
+        self.assertIn(("EMSX_AMOUNT", "777"), changes)
+        self.assertEqual("777", client.orders.get_by_sequence_no(FIRST_SEQUENCE).field("EMSX_AMOUNT").value())
+
+    def test_derived_fields_are_opted_in(self):
+
+        self.emsx.orders.add_derived_field("LEFT", ("EMSX_AMOUNT", "EMSX_FILLED"), remaining)
+        self.assertRaises(ValueError, self.emsx.serve_fanout, os.path.join(self.directory, "x.sock"), derived_fields=["NOT_DERIVED"])
+        server = self.emsx.serve_fanout(os.path.join(self.directory, "emsx.sock"), derived_fields=["LEFT"])
+        client = self.connect(server.address)
+
+        order = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE)
+        mirrored = client.orders.get_by_sequence_no(FIRST_SEQUENCE)
+        self.assertEqual(str(order.field("LEFT").value()), mirrored.field("LEFT").value())
+        self.assertIsNone(client.routes.get_by_sequence_no_and_id(FIRST_SEQUENCE, 1).field("LEFT"))
+
+        updated = threading.Event()
+        client.add_notification_handler(lambda n: n.type == Notification.NotificationType.UPDATE and updated.set())
+        order.modify({"EMSX_AMOUNT": 12345})
+        self.assertTrue(updated.wait(5))
+        self.assertEqual(str(12345 - float(order.field("EMSX_FILLED").value())), mirrored.field("LEFT").value())
+
+    def test_tcp_late_joiner(self):
+
+        server = self.emsx.serve_fanout(("127.0.0.1", 0))
+        self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 1).modify({"EMSX_AMOUNT": 55})
+        self.simulator.wait_idle()
+
+        client = self.connect(server.address)
+        self.assertEqual("55", client.orders.get_by_sequence_no(FIRST_SEQUENCE + 1).field("EMSX_AMOUNT").value())
+        self.assertEqual(1, len(server.clients))
+
+    def test_evicted_rows_are_dropped_by_clients(self):
+
+        server = self.emsx.serve_fanout(os.path.join(self.directory, "emsx.sock"))
+        client = self.connect(server.address)
+        updated = threading.Event()
+        client.add_notification_handler(lambda n: n.type == Notification.NotificationType.UPDATE and updated.set())
+
+        self.emsx.orders.evict([FIRST_SEQUENCE + 5])
+        self.emsx.routes.evict([(FIRST_SEQUENCE + 5, 1)])
+
+        # frames arrive in order, so once a later update is in the evictions have been applied
+        self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 6).modify({"EMSX_AMOUNT": 66})
+        self.assertTrue(updated.wait(5))
+        self.assertIsNone(client.orders.get_by_sequence_no(FIRST_SEQUENCE + 5))
+        self.assertIsNone(client.routes.get_by_sequence_no_and_id(FIRST_SEQUENCE + 5, 1))
+        self.assertEqual(len(list(self.emsx.orders)), len(client.orders))
+        self.assertEqual(len(list(self.emsx.routes)), len(client.routes))
+
+    def test_publish_is_not_blocked_by_a_snapshot(self):
+
+        server = self.emsx.serve_fanout(os.path.join(self.directory, "emsx.sock"))
+        reading = threading.Event()
+        release = threading.Event()
+        row_values = server.row_values
+
+        def slow_row_values(kind, row):
+            reading.set()
+            release.wait(5)
+            return row_values(kind, row)
+
+        server.row_values = slow_row_values
+        client = FanoutClient(server.address)
+        self.clients.append(client)
+        client.connect()
+        self.assertTrue(reading.wait(5))
+
+        # the update is applied and queued for the client while its snapshot is still being read
+        published = threading.Event()
+        order = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 2)
+
+        def update():
+            order.modify({"EMSX_AMOUNT": 778})
+            self.simulator.wait_idle()
+            published.set()
+
+        replayed = threading.Event()
+        client.add_notification_handler(lambda n: n.type == Notification.NotificationType.UPDATE and replayed.set())
+        threading.Thread(target=update, daemon=True).start()
+        try:
+            self.assertTrue(published.wait(5))
+            self.assertFalse(client.synced.is_set())
+        finally:
+            release.set()
+
+        self.assertTrue(client.wait_synced(5))
+        self.assertTrue(replayed.wait(5))
+        self.assertEqual(len(list(self.emsx.orders)), len(client.orders))
+        self.assertEqual("778", client.orders.get_by_sequence_no(FIRST_SEQUENCE + 2).field("EMSX_AMOUNT").value())
+
+    def test_slow_client_is_resynchronised(self):
+
+        server = self.emsx.serve_fanout(os.path.join(self.directory, "emsx.sock"))
+        server.max_buffered_bytes = 1000
+        local, remote = socket.socketpair()
+        connection = FanoutConnection(server, local)
+        connection.stale = False
+        connection.synced_once = True
+        server.clients.append(connection)
+
+        # the writer is not running, so these pile up as they would behind a blocked socket
+        connection.offer(b"x" * 600)
+        connection.offer(b"x" * 600)
+
+        self.assertTrue(connection.stale)
+        self.assertEqual([], connection.frames)
+        self.assertEqual(1, connection.resyncs)
+
+        connection.thread.start()
+        length, frame_type = struct.unpack("<IB", remote.recv(FRAME_HEADER.size))
+        self.assertEqual((0, FRAME_RESET), (length, frame_type))
+
+        snapshot = self.emsx.metrics.snapshot()["counters"]
+        self.assertEqual(1, snapshot[("fanout_resyncs_total", ())])
+        connection.close()
+        remote.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
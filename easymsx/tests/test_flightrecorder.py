@@ -0,0 +1,62 @@
+"""
+The flight recorder ring buffer and its dump triggers.
+"""
+
+import io
+from easymsx.flightrecorder import FlightRecorder, TRIGGER_ERROR
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class Unprintable:
+
+    def __str__(self):
+        raise AssertionError("formatted while recording")
+
+
+class TestFlightRecorder(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=10)
+    easymsx_options = None
+
+    def test_ring_buffer_keeps_latest_entries(self):
+
+        recorder = FlightRecorder(capacity=4, enabled=True)
+        for i in range(0, 10):
+            recorder.record("step", i)
+
+        self.assertEqual([6, 7, 8, 9], [e[3][0] for e in recorder.entries()])
+
+    def test_record_does_not_format_arguments(self):
+
+        recorder = FlightRecorder(capacity=4, enabled=True)
+        recorder.record("request.send", 1, Unprintable())
+
+        self.assertEqual(1, len(recorder.entries()))
+
+    def test_trigger_is_rate_limited(self):
+
+        out = io.StringIO()
+        recorder = FlightRecorder(capacity=4, enabled=True, min_dump_interval=60)
+        recorder.dump = lambda reason: out.write(reason)
+
+        self.assertTrue(recorder.trigger(TRIGGER_ERROR))
+        self.assertFalse(recorder.trigger(TRIGGER_ERROR))
+        self.assertEqual("error", out.getvalue())
+
+    def test_slow_consumer_warning_dumps_trace(self):
+
+        self.create_easymsx()
+        self.emsx.flight_recorder.enable()
+        dumps = []
+        self.emsx.flight_recorder.dump = lambda reason: dumps.append((reason, self.emsx.flight_recorder.format()))
+
+        self.emsx.start()
+        self.simulator.slow_consumer_warning()
+        self.simulator.wait_idle()
+        self.emsx.stop()
+
+        self.assertEqual(1, len(dumps))
+        reason, lines = dumps[0]
+        self.assertEqual("slow_consumer", reason)
+        self.assertTrue(any(" order 4 1000003" in line for line in lines))
+        self.assertTrue(any(" field EMSX_TICKER " in line for line in lines))
@@ -0,0 +1,92 @@
+"""
+Per-row field history and as-of queries.
+"""
+
+import time
+import unittest
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestHistory(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=20, messages_per_event=10)
+    start_emsx = False
+
+    def modify(self, o, amount):
+        o.modify({"EMSX_AMOUNT": amount})
+        self.simulator.wait_idle()
+        time.sleep(0.01)
+        return time.time()
+
+    def test_history_and_as_of(self):
+
+        self.emsx.enable_history()
+        self.emsx.start()
+        o = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 4)
+        values = self.simulator.order_values(FIRST_SEQUENCE + 4)
+
+        time.sleep(0.01)
+        painted = time.time()
+        first = self.modify(o, 5000)
+        self.modify(o, 6000)
+
+        self.assertEqual([values["EMSX_AMOUNT"], 5000, 6000], [v for ts, v in o.history("EMSX_AMOUNT")])
+        self.assertEqual(values["EMSX_AMOUNT"], o.as_of(painted)["EMSX_AMOUNT"])
+        self.assertEqual(5000, o.as_of(first)["EMSX_AMOUNT"])
+        self.assertEqual(6000, o.as_of(time.time())["EMSX_AMOUNT"])
+        self.assertEqual(values["EMSX_TICKER"], o.as_of(painted)["EMSX_TICKER"])
+        self.assertEqual(values["EMSX_LIMIT_PRICE"], o.as_of(painted)["EMSX_LIMIT_PRICE"])
+
+        route = self.emsx.routes.get_by_sequence_no_and_id(FIRST_SEQUENCE + 4, 1)
+        self.assertEqual([1], [v for ts, v in route.history("EMSX_ROUTE_ID")])
+        self.assertRaises(ValueError, o.history, "NOT_A_FIELD")
+
+        self.emsx.orders.evict([FIRST_SEQUENCE + 4])
+        self.assertEqual([], o.history("EMSX_AMOUNT"))
+
+    def test_caps(self):
+
+        history = self.emsx.enable_history(max_per_row=8, max_total=50)
+        self.emsx.start()
+
+        memory = history.memory()
+        self.assertLessEqual(memory["entries"], 50)
+        self.assertGreater(memory["dropped_rows"], 0)
+
+        # the paint overflowed the ring, so older values are only partly known
+        row = next(reversed(history.rows.values()))[0]
+        self.assertEqual(8, len(history.entries(row)[0]))
+        before = row.as_of(time.time() - 60)
+        self.assertNotIn("EMSX_AMOUNT", before)
+
+    def test_untracked_times_are_left_out(self):
+
+        history = self.emsx.enable_history(max_per_row=8, max_total=50)
+        started = time.time()
+        self.emsx.start()
+
+        # a row whose history was dropped is known again from its next change, not from before it
+        dropped = [o for o in self.emsx.orders if id(o) in history.dropped][0]
+        time.sleep(0.01)
+        self.modify(dropped, 5000)
+        self.assertEqual({}, dropped.as_of(started))
+        self.assertEqual(5000, dropped.as_of(time.time())["EMSX_AMOUNT"])
+
+        # rows cached before history was enabled are only known from then on
+        self.emsx.enable_history()
+        enabled = time.time()
+        o = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 1)
+        self.assertEqual({}, o.as_of(started))
+        self.assertEqual(o.field("EMSX_AMOUNT").value(), o.as_of(enabled)["EMSX_AMOUNT"])
+        self.modify(o, 7000)
+        self.assertEqual({}, o.as_of(started))
+        self.assertEqual(7000, o.as_of(time.time())["EMSX_AMOUNT"])
+
+    def test_needs_enabling(self):
+        self.emsx.start()
+        self.assertRaises(ValueError, self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE).history, "EMSX_AMOUNT")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+Notification timestamps and latency aggregation.
+"""
+
+from easymsx.latency import STAGE_RECEIVE_TO_CACHE, STAGE_RECEIVE_TO_LAST_HANDLER, STAGE_SERVER_TO_RECEIVE
+from easymsx.notification import Notification
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestLatency(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=20)
+
+    def setUp(self):
+        super().setUp()
+        self.timestamps = []
+
+    def process_notification(self, notification):
+        if notification.type == Notification.NotificationType.UPDATE:
+            self.timestamps.append(notification.timestamps)
+
+    def test_notifications_carry_no_timestamps_when_disabled(self):
+
+        self.emsx.add_notification_handler(self.process_notification)
+        self.simulator.inject_updates(5)
+        self.simulator.wait_idle()
+
+        self.assertEqual([None] * 10, self.timestamps)
+
+    def test_timestamps_are_ordered_and_aggregated(self):
+
+        self.emsx.latency.enable(compare_server_time=True)
+        self.emsx.routes.add_notification_handler(self.process_notification)
+        self.emsx.add_notification_handler(self.process_notification)
+        self.simulator.inject_updates(5)
+        self.simulator.wait_idle()
+
+        ts = self.timestamps[0]
+        self.assertTrue(ts.received_ns <= ts.cache_updated_ns <= ts.handlers[0][1])
+
+        stats = self.emsx.latency.percentiles()
+        self.assertEqual(10, stats[STAGE_RECEIVE_TO_CACHE]["count"])
+        self.assertEqual(10, stats[STAGE_RECEIVE_TO_LAST_HANDLER]["count"])
+        self.assertIn("handler:TestLatency.process_notification", stats)
+        # only route updates that change EMSX_ROUTE_LAST_UPDATE_TIME can be compared
+        self.assertTrue(0 < stats[STAGE_SERVER_TO_RECEIVE]["count"] <= 5)
@@ -0,0 +1,60 @@
+"""
+Histograms, counters and gauges of the built-in metrics.
+"""
+
+from easymsx.metrics import Histogram
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestMetrics(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=20)
+    easymsx_options = None
+
+    def test_histogram_percentiles(self):
+
+        h = Histogram()
+        for v in range(1, 101):
+            h.observe(v * 1000)
+
+        self.assertEqual(100, h.count)
+        self.assertEqual(100000, h.max)
+        self.assertTrue(32000 <= h.percentile(50) <= 64000)
+        self.assertEqual(128000, h.percentile(99))
+
+    def test_disabled_metrics_record_nothing(self):
+
+        self.create_easymsx()
+        self.emsx.start()
+        self.simulator.inject_updates(10)
+        self.simulator.wait_idle()
+        self.emsx.stop()
+
+        snap = self.emsx.metrics.snapshot()
+        self.assertEqual({}, snap["counters"])
+        self.assertEqual({}, snap["histograms"])
+
+    def test_enabled_metrics_cover_events_handlers_and_requests(self):
+
+        self.create_easymsx(enable_metrics=True)
+        self.emsx.add_notification_handler(lambda notification: None)
+        self.emsx.start()
+        self.simulator.inject_updates(10)
+        self.simulator.wait_idle()
+
+        snap = self.emsx.metrics.snapshot()
+        self.assertTrue(snap["counters"][("events_total", (("type", "SUBSCRIPTION_DATA"),))] > 0)
+        self.assertIn(("subscription_data_event_ns", ()), snap["histograms"])
+        self.assertIn(("request_round_trip_ns", (("operation", "GetTeams"),)), snap["histograms"])
+        self.assertEqual(20, snap["gauges"][("cached_orders", ())])
+        self.assertEqual(0, snap["gauges"][("pending_requests", ())])
+
+        text = self.emsx.metrics.exposition()
+        self.assertIn('easymsx_events_total{type="SUBSCRIPTION_DATA"}', text)
+        self.assertIn('easymsx_request_round_trip_ns_count{operation="GetTeams"} 1', text)
+        self.assertIn("# TYPE easymsx_events_total counter", text)
+        self.assertIn("# TYPE easymsx_request_round_trip_ns histogram", text)
+        # buckets and sums are in the nanoseconds the histogram name promises
+        self.assertIn('easymsx_request_round_trip_ns_bucket{operation="GetTeams",le="1024000"}', text)
+        types = [line for line in text.splitlines() if line.startswith("# TYPE")]
+        self.assertEqual(len(set(types)), len(types))
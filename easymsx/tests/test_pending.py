@@ -0,0 +1,112 @@
+"""
+The optimistic pending overlay on cached fields.
+"""
+
+import threading
+import unittest
+import blpapi
+from easymsx.notification import Notification
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+PENDING_TYPES = (Notification.NotificationType.PENDING, Notification.NotificationType.CONFIRMED, Notification.NotificationType.ROLLEDBACK)
+
+
+class TestPending(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=5)
+
+    def setUp(self):
+        super().setUp()
+        self.transitions = []
+        self.seen_pending = []
+        self.emsx.add_notification_handler(self.record)
+
+    def record(self, notification):
+        if notification.type in PENDING_TYPES:
+            fc = notification.field_changes[0]
+            if notification.type == Notification.NotificationType.PENDING:
+                # the subscription update can confirm the change before modify returns
+                self.seen_pending.append((fc.field.effective_value(), fc.field.pending_value(), notification.source.fields.has_pending()))
+            self.transitions.append((notification.type, fc.field.name(), fc.old_value, fc.new_value, notification.correlation_id))
+
+    def test_modify_is_pending_then_confirmed(self):
+
+        self.simulator.response_latency = 0.05
+        order = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE)
+        amount = order.field("EMSX_AMOUNT")
+        before = amount.value()
+        done = threading.Event()
+
+        order.modify({"EMSX_AMOUNT": 12345}, lambda msg: done.set())
+
+        self.assertEqual([("12345", "12345", True)], self.seen_pending)
+
+        self.assertTrue(done.wait(10))
+        self.simulator.wait_idle()
+
+        self.assertEqual("12345", amount.value())
+        self.assertIsNone(amount.pending)
+        self.assertFalse(order.fields.has_pending())
+        cid = self.transitions[0][4]
+        self.assertEqual([(Notification.NotificationType.PENDING, "EMSX_AMOUNT", before, "12345", cid),
+                          (Notification.NotificationType.CONFIRMED, "EMSX_AMOUNT", "12345", "12345", cid)], self.transitions)
+
+    def test_error_response_rolls_back(self):
+
+        order = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 1)
+        before = order.field("EMSX_AMOUNT").value()
+        self.simulator.deleted.add(FIRST_SEQUENCE + 1)
+
+        order.modify({"EMSX_AMOUNT": 1})
+
+        self.assertEqual(before, order.field("EMSX_AMOUNT").effective_value())
+        self.assertEqual([Notification.NotificationType.PENDING, Notification.NotificationType.ROLLEDBACK], [t[0] for t in self.transitions])
+        self.assertEqual(("1", before), self.transitions[1][2:4])
+
+    def test_cancel_route(self):
+
+        route = self.emsx.routes.get_by_sequence_no_and_id(FIRST_SEQUENCE + 2, 1)
+        route.cancel()
+        self.simulator.wait_idle()
+
+        self.assertEqual("CANCEL", route.field("EMSX_STATUS").value())
+        self.assertEqual([Notification.NotificationType.PENDING, Notification.NotificationType.CONFIRMED], [t[0] for t in self.transitions])
+
+    def test_cancel_passes_through_interim_statuses(self):
+
+        # the broker acknowledges first and reports the cancel in progress before the route is cancelled
+        self.simulator.request_CancelRouteEx = lambda values: (blpapi.Name("CancelRouteEx"), {"STATUS": 0, "MESSAGE": "Route cancellation request sent to broker"})
+        route = self.emsx.routes.get_by_sequence_no_and_id(FIRST_SEQUENCE + 3, 1)
+        route.cancel()
+
+        self.simulator.update_route(FIRST_SEQUENCE + 3, 1, EMSX_STATUS="CXLREQ")
+        self.simulator.wait_idle()
+        self.assertEqual("CANCEL", route.field("EMSX_STATUS").effective_value())
+        self.assertEqual([Notification.NotificationType.PENDING], [t[0] for t in self.transitions])
+
+        self.simulator.update_route(FIRST_SEQUENCE + 3, 1, EMSX_STATUS="CANCEL", EMSX_WORKING=0)
+        self.simulator.wait_idle()
+        self.assertEqual([Notification.NotificationType.PENDING, Notification.NotificationType.CONFIRMED], [t[0] for t in self.transitions])
+
+    def test_concurrent_settles_notify_once(self):
+
+        order = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 4)
+        change = order.fields.set_pending("EMSX_AMOUNT", 7, 1)
+        barrier = threading.Barrier(8)
+
+        def settle():
+            barrier.wait()
+            order.fields.resolve(change, change.CONFIRMED)
+
+        threads = [threading.Thread(target=settle) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual([Notification.NotificationType.PENDING, Notification.NotificationType.CONFIRMED], [t[0] for t in self.transitions])
+
+
+if __name__ == '__main__':
+    unittest.main()
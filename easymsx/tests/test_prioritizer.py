@@ -0,0 +1,92 @@
+"""
+Responses and status events overtaking queued subscription data.
+"""
+
+import time
+import unittest
+from easymsx.degradation import DegradationPolicy, ACTION_DROP_LOW_PRIORITY_HANDLERS
+from easymsx.notification import Notification
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestPrioritizer(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=50, messages_per_event=10)
+    easymsx_options = None
+
+    def setUp(self):
+        super().setUp()
+        self.updates = 0
+
+    def slow_handler(self, notification):
+        # an application that cannot keep up with a burst
+        if notification.type == Notification.NotificationType.UPDATE:
+            self.updates += 1
+            time.sleep(0.002)
+
+    def modify(self):
+        return self.emsx.send_request(self.emsx.request_template("ModifyOrderEx").create(EMSX_SEQUENCE=FIRST_SEQUENCE, EMSX_AMOUNT=5))
+
+    def check_cache(self):
+        for o in self.emsx.orders:
+            values = self.simulator.order_values(o.sequence)
+            self.assertEqual(str(values["EMSX_FILLED"]), o.field("EMSX_FILLED").value())
+
+    def test_response_overtakes_burst(self):
+
+        self.create_easymsx(enable_metrics=True)
+        self.emsx.set_event_prioritization()
+        self.emsx.start()
+        self.emsx.add_notification_handler(self.slow_handler)
+
+        published = self.simulator.inject_updates(300)
+        msg = self.modify()
+        self.assertEqual("ModifyOrderEx", str(msg.messageType()))
+        self.assertGreater(self.emsx.prioritizer.depth(), 0)
+        self.assertLess(self.updates, published)
+
+        self.simulator.wait_idle()
+        self.assertTrue(self.emsx.wait_dispatched(10))
+        self.assertEqual(0, self.emsx.prioritizer.depth())
+        self.check_cache()
+
+        histograms = self.emsx.metrics.snapshot()["histograms"]
+        self.assertIn(("event_dispatch_ns", (("path", "priority"),)), histograms)
+        self.assertIn(("event_dispatch_ns", (("path", "bulk"),)), histograms)
+
+    def test_queue_depth_degrades(self):
+
+        self.create_easymsx(enable_metrics=True)
+        self.emsx.set_degradation_policy(DegradationPolicy(actions=(ACTION_DROP_LOW_PRIORITY_HANDLERS,), queue_depth_high=10, queue_depth_low=0))
+        self.emsx.set_event_prioritization()
+        self.emsx.start()
+        self.emsx.add_notification_handler(self.slow_handler)
+
+        self.simulator.inject_updates(300)
+        self.simulator.wait_idle()
+        self.assertTrue(self.emsx.wait_dispatched(10))
+
+        counters = self.emsx.metrics.snapshot()["counters"]
+        # the init paint is queued too, so the policy may already have degraded once during start()
+        self.assertGreaterEqual(counters[("degradation_transitions_total", (("state", "degraded"), ("reason", "queue_depth")))], 1)
+        self.assertEqual(counters[("degradation_transitions_total", (("state", "degraded"), ("reason", "queue_depth")))],
+                         counters[("degradation_transitions_total", (("state", "normal"), ("reason", "queue_depth")))])
+        self.assertFalse(self.emsx.degradation.degraded())
+
+    def test_pull_mode_reads_the_session_dry_first(self):
+
+        self.create_easymsx(pull_mode=True)
+        self.emsx.set_event_prioritization()
+        self.emsx.start()
+
+        self.simulator.inject_updates(300)
+        self.modify()
+        self.assertGreater(self.emsx.prioritizer.depth(), 0)
+
+        self.assertTrue(self.emsx.wait_dispatched(10))
+        self.check_cache()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Pull mode, where the application's thread drains the session.
+"""
+
+import threading
+import unittest
+from easymsx import easymsx
+from easymsx.bulk import STATUS_OK
+from easymsx.notification import Notification
+from easymsx.simulator import EMSXSimulator, FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestPullMode(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=20, response_latency=0.01)
+    easymsx_options = dict(enable_metrics=True, pull_mode=True)
+    start_emsx = False
+
+    def setUp(self):
+        super().setUp()
+        self.threads = set()
+        self.updates = []
+        self.emsx.add_notification_handler(self.record)
+
+    def record(self, notification):
+        self.threads.add(threading.current_thread())
+        if notification.type == Notification.NotificationType.UPDATE:
+            self.updates.append(notification.source.sequence)
+
+    def test_everything_runs_on_the_calling_thread(self):
+
+        self.emsx.start()
+        self.assertEqual(20, len(self.emsx.orders.orders))
+
+        msg = self.emsx.send_request(self.emsx.request_template("ModifyOrderEx").create(EMSX_SEQUENCE=FIRST_SEQUENCE, EMSX_AMOUNT=5))
+        self.assertEqual("ModifyOrderEx", str(msg.messageType()))
+
+        self.assertTrue(self.emsx.run_until(lambda: FIRST_SEQUENCE in self.updates, timeout=5))
+        self.assertEqual({threading.current_thread()}, self.threads)
+        self.assertEqual("5", self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE).field("EMSX_AMOUNT").value())
+
+        result = self.emsx.orders.modify_orders([{"EMSX_SEQUENCE": FIRST_SEQUENCE + i, "EMSX_AMOUNT": 10} for i in range(0, 5)], window=2)
+        self.assertTrue(all(i.status == STATUS_OK for i in result))
+
+        snapshot = self.emsx.metrics.snapshot()
+        self.assertGreater(snapshot["counters"][("polls_total", ())], 0)
+
+    def test_poll_returns_when_idle(self):
+
+        self.emsx.start()
+        self.emsx.run_until(lambda: False, timeout=0.05)
+
+        self.assertEqual(0, self.emsx.poll(0.01))
+        self.assertFalse(self.emsx.run_until(lambda: False, timeout=0.05))
+
+        self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE).modify({"EMSX_AMOUNT": 7}, lambda msg: None)
+        self.assertEqual(0, len(self.updates))
+        self.assertGreaterEqual(self.emsx.poll(1.0, max_events=1), 1)
+
+    def test_poll_needs_pull_mode(self):
+        emsx = easymsx.EasyMSX(session_factory=EMSXSimulator(num_orders=1).create_session)
+        self.assertRaises(ValueError, emsx.poll)
+        emsx.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
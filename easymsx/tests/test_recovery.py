@@ -0,0 +1,89 @@
+"""
+Session recovery and cache reconciliation.
+"""
+
+from easymsx.notification import Notification
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestRecovery(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=20)
+    start_emsx = False
+
+    def setUp(self):
+        super().setUp()
+        self.emsx.recovery.initial_delay = 0.01
+        self.emsx.start()
+        self.notifications = []
+        self.emsx.add_notification_handler(self.notifications.append)
+
+    def changes_while_away(self):
+        # one changed order, one order gone and one new order
+        self.simulator.order_overrides[FIRST_SEQUENCE + 1] = {"EMSX_AMOUNT": 12345}
+        self.simulator.deleted.add(FIRST_SEQUENCE + 2)
+        self.simulator.new_order({"EMSX_TICKER": "IBM US Equity", "EMSX_AMOUNT": 10})
+
+    def check_reconciled(self):
+
+        orders = [n for n in self.notifications if n.category == Notification.NotificationCategory.ORDER]
+        by_type = dict((n.type, n) for n in orders)
+
+        self.assertEqual(3, len(orders))
+        self.assertEqual(FIRST_SEQUENCE + 1, by_type[Notification.NotificationType.UPDATE].source.sequence)
+        self.assertEqual(["EMSX_AMOUNT"], [fc.field.name() for fc in by_type[Notification.NotificationType.UPDATE].field_changes])
+        self.assertEqual(FIRST_SEQUENCE + 2, by_type[Notification.NotificationType.DELETE].source.sequence)
+        self.assertEqual(FIRST_SEQUENCE + 20, by_type[Notification.NotificationType.NEW].source.sequence)
+        self.assertEqual(21, len(list(self.emsx.orders)))
+        self.assertEqual([], [n for n in self.notifications if n.type == Notification.NotificationType.INITIALPAINT])
+
+    def test_session_terminated_recovers_and_reconciles(self):
+
+        old_session = self.emsx.session
+        brokers = self.emsx.brokers
+
+        self.changes_while_away()
+        self.simulator.terminate_sessions()
+        self.assertTrue(self.emsx.recovery.wait(10))
+        self.simulator.wait_idle()
+
+        self.assertIsNot(old_session, self.emsx.session)
+        self.assertEqual([self.emsx.session], self.simulator.sessions)
+        self.assertIs(brokers, self.emsx.brokers)
+        self.check_reconciled()
+
+    def test_subscription_terminated_resubscribes(self):
+
+        self.changes_while_away()
+        self.simulator.terminate_subscriptions()
+        self.simulator.wait_idle()
+        self.assertTrue(self.emsx.recovery.wait(10))
+        self.simulator.wait_idle()
+
+        self.check_reconciled()
+
+    def test_paint_that_never_completes_is_retried_then_given_up(self):
+
+        self.emsx.recovery.paint_timeout = 0.2
+        self.emsx.recovery.max_attempts = 3
+        # the fresh init paint is held back far longer than the recovery waits for it
+        self.simulator.subscription_latency = 3600
+        self.simulator.terminate_sessions()
+        self.assertTrue(self.emsx.recovery.wait(10))
+
+        counters = self.emsx.metrics.snapshot()["counters"]
+        self.assertEqual(3, counters[("session_recovery_failures_total", ())])
+        self.assertIsNone(self.emsx.recovery.worker)
+        # every failed attempt stopped the session it started
+        self.assertEqual([], self.simulator.sessions)
+
+        # the worker has gone, so the next termination is recovered
+        self.simulator.subscription_latency = 0.0
+        self.changes_while_away()
+        self.emsx.recovery.session_terminated()
+        self.assertTrue(self.emsx.recovery.wait(10))
+        self.simulator.wait_idle()
+        self.assertEqual(21, len(list(self.emsx.orders)))
+        self.assertEqual([self.emsx.session], self.simulator.sessions)
+        self.assertEqual(1, self.emsx.metrics.snapshot()["counters"][("session_recoveries_total", ())])
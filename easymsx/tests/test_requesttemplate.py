@@ -0,0 +1,73 @@
+"""
+Request templates built from the EMSX operation schema.
+"""
+
+import unittest
+from easymsx.bulk import STATUS_INVALID, STATUS_OK
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestRequestTemplate(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=5)
+    easymsx_options = dict(enable_metrics=True)
+    start_emsx = False
+
+    def test_create_with_defaults(self):
+
+        template = self.emsx.request_template("CreateOrder").with_defaults(EMSX_ORDER_TYPE="MKT", EMSX_TIF="DAY", EMSX_SIDE="BUY")
+        req = template.create({"EMSX_TICKER": "IBM US Equity", "EMSX_AMOUNT": 100}, EMSX_SIDE="SELL")
+
+        values = req.values()
+        self.assertEqual("SELL", values["EMSX_SIDE"])
+        self.assertEqual("MKT", values["EMSX_ORDER_TYPE"])
+        self.assertEqual(100, values["EMSX_AMOUNT"])
+        self.assertIs(template.fields, self.emsx.request_template("CreateOrder").fields)
+
+    def test_arrays_of_elements(self):
+
+        req = self.emsx.request_template("CancelRouteEx").create(ROUTES=[{"EMSX_SEQUENCE": FIRST_SEQUENCE, "EMSX_ROUTE_ID": 1}])
+        self.assertEqual([{"EMSX_SEQUENCE": FIRST_SEQUENCE, "EMSX_ROUTE_ID": 1}], req.values()["ROUTES"])
+
+        msg = self.emsx.send_request(req)
+        self.assertEqual("CancelRouteEx", str(msg.messageType()))
+
+    def test_rejected_locally(self):
+
+        template = self.emsx.request_template("ModifyRouteEx")
+
+        with self.assertRaises(ValueError) as ctx:
+            template.create(EMSX_SEQUENCE="1000000", EMSX_ROUTE_ID=1, EMSX_LIMT_PRICE=10.5)
+        self.assertIn("EMSX_SEQUENCE: expected a 32 bit integer", str(ctx.exception))
+        self.assertIn("EMSX_LIMT_PRICE: unknown field", str(ctx.exception))
+
+        problems = self.emsx.request_template("CancelRouteEx").validate({"ROUTES": [{"EMSX_SEQUENCE": 1, "EMSX_ROUTE": 1}]})
+        self.assertEqual(["ROUTES[0].EMSX_ROUTE: unknown field"], problems)
+
+        self.assertRaises(ValueError, self.emsx.request_template, "CreateOrderAndRoute2")
+
+        snapshot = self.emsx.metrics.snapshot()
+        self.assertEqual(1, snapshot["counters"][("requests_rejected_total", (("operation", "ModifyRouteEx"),))])
+
+    def test_bulk_rejects_invalid_items_without_sending(self):
+
+        self.emsx.start()
+        sent = []
+        handle_request = self.simulator.handle_request
+        self.simulator.handle_request = lambda request: sent.append(request) or handle_request(request)
+
+        result = self.emsx.orders.modify_orders([{"EMSX_SEQUENCE": FIRST_SEQUENCE, "EMSX_AMOUNT": 10},
+                                                 {"EMSX_SEQUENCE": FIRST_SEQUENCE, "EMSX_AMOUNT": 1.5},
+                                                 {"EMSX_AMOUNT": 20}])
+
+        self.assertEqual([STATUS_OK, STATUS_INVALID, STATUS_INVALID], [i.status for i in result])
+        self.assertIn("EMSX_SEQUENCE: required by ModifyOrderEx", result[2].error_message)
+        self.assertEqual(1, len(sent))
+
+        snapshot = self.emsx.metrics.snapshot()
+        self.assertEqual(2, snapshot["counters"][("requests_rejected_total", (("operation", "ModifyOrderEx"),))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Eviction of terminal orders and routes, and the on-disk archive.
+"""
+
+import os
+import time
+import unittest
+from easymsx.retention import RetentionPolicy, RowArchive
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestRetention(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=10)
+    easymsx_options = dict(enable_metrics=True)
+
+    def setUp(self):
+        super().setUp()
+        self.directory = self.make_directory()
+
+    def delete(self, sequences):
+        self.emsx.orders.delete_orders(sequences)
+        self.simulator.wait_idle()
+
+    def test_count_limit_keeps_newest_terminal_orders(self):
+
+        archive = RowArchive(os.path.join(self.directory, "archive.db"))
+        self.emsx.set_retention_policy(RetentionPolicy(max_terminal_rows=2, archive=archive))
+        sequences = [FIRST_SEQUENCE + i for i in range(0, 5)]
+        amount = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE).field("EMSX_AMOUNT").value()
+
+        self.delete(sequences)
+
+        self.assertEqual([None, None, None], [self.emsx.orders.get_by_sequence_no(s) for s in sequences[:3]])
+        self.assertIsNotNone(self.emsx.orders.get_by_sequence_no(sequences[3]))
+        self.assertEqual(7, len(list(self.emsx.orders)))
+
+        archived = archive.get_order(FIRST_SEQUENCE)
+        self.assertEqual("DELETED", archived.value("EMSX_STATUS"))
+        self.assertEqual(amount, archived.value("EMSX_AMOUNT"))
+        self.assertIsNone(archive.get_order(sequences[3]))
+        self.assertEqual(3, archive.count())
+
+        snapshot = self.emsx.metrics.snapshot()
+        self.assertEqual(3, snapshot["counters"][("retention_evicted_total", (("kind", "order"),))])
+
+    def test_age_limit_and_routes(self):
+
+        policy = RetentionPolicy(statuses=("DELETED", "CANCEL"), max_age=0.3, sweep_interval=0.02)
+        self.emsx.set_retention_policy(policy)
+
+        self.delete([FIRST_SEQUENCE])
+        self.emsx.routes.cancel_routes([(FIRST_SEQUENCE + 1, 1)])
+        self.simulator.wait_idle()
+        self.assertIsNotNone(self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE))
+        self.assertIsNotNone(self.emsx.routes.get_by_sequence_no_and_id(FIRST_SEQUENCE + 1, 1))
+
+        # nothing else changes, the housekeeping timer sweeps them once they age out
+        deadline = time.monotonic() + 5
+        while policy.evicted["route"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertIsNone(self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE))
+        self.assertIsNone(self.emsx.routes.get_by_sequence_no_and_id(FIRST_SEQUENCE + 1, 1))
+
+        self.emsx.set_retention_policy(None)
+        self.assertIsNone(policy.timer)
+
+    def test_late_update_does_not_rebuild_an_evicted_row(self):
+
+        policy = RetentionPolicy(max_terminal_rows=0)
+        self.emsx.set_retention_policy(policy)
+        self.delete([FIRST_SEQUENCE + 2])
+        self.assertIsNone(self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 2))
+
+        self.simulator.update_order(FIRST_SEQUENCE + 2, EMSX_AMOUNT=5)
+        self.simulator.wait_idle()
+
+        self.assertIsNone(self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 2))
+        self.assertEqual(9, len(list(self.emsx.orders)))
+        self.assertEqual(1, policy.suppressed["order"])
+        self.assertEqual(1, self.emsx.metrics.snapshot()["counters"][("retention_suppressed_total", (("kind", "order"),))])
+
+    def test_policy_needs_a_limit(self):
+        self.assertRaises(ValueError, RetentionPolicy)
+
+
+if __name__ == '__main__':
+    unittest.main()
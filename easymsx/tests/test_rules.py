@@ -0,0 +1,146 @@
+"""
+The rule engine and its timer wheel.
+"""
+
+import time
+import unittest
+from easymsx.rules import Rule, RuleEngine, KIND_ROUTE
+from easymsx.simulator import FIRST_SEQUENCE, seconds_since_midnight
+from easymsx.tests.simulated import SimulatedTestCase
+from easymsx.timerwheel import TimerWheel
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTimerWheel(unittest.TestCase):
+
+    def test_expiry_and_cancel(self):
+
+        clock = FakeClock()
+        wheel = TimerWheel(tick=0.1, slots=8, clock=clock)
+        soon = wheel.schedule(0.25, "soon")
+        cancelled = wheel.schedule(0.5, "cancelled")
+        later = wheel.schedule(5.0, "later")
+        wheel.cancel(cancelled)
+        self.assertEqual(2, len(wheel))
+
+        clock.now += 0.2
+        self.assertEqual([], wheel.advance())
+        clock.now += 0.2
+        self.assertEqual([soon], wheel.advance())
+
+        # several turns of the wheel go by before the long timer is due
+        clock.now += 4.0
+        self.assertEqual([], wheel.advance())
+        clock.now += 1.0
+        self.assertEqual([later], wheel.advance())
+        self.assertEqual(0, len(wheel))
+
+
+class TestRules(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=20, messages_per_event=10)
+    easymsx_options = dict(enable_metrics=True)
+
+    def setUp(self):
+        super().setUp()
+        self.fired = []
+        self.engine = RuleEngine(tick=0.05)
+
+    def record(self, rule, row):
+        self.fired.append((rule.name, row.sequence))
+
+    def test_only_rules_over_changed_fields_run(self):
+
+        filled = self.engine.add_rule(Rule("filled", "EMSX_STATUS == 'FILLED'", self.record))
+        ticker = self.engine.add_rule(Rule("ticker", "EMSX_TICKER == 'NOPE US Equity'", self.record))
+        big = self.engine.add_rule(Rule("big", "EMSX_AMOUNT >= 1500 and EMSX_FILLED == 0", self.record))
+        cancelled = self.engine.add_rule(Rule("cancelled", "EMSX_STATUS == 'CANCEL'", self.record, kind=KIND_ROUTE))
+        self.emsx.set_rule_engine(self.engine)
+        self.assertEqual(frozenset(("EMSX_AMOUNT", "EMSX_FILLED")), big.fields)
+
+        # amounts are compared as numbers, not strings
+        self.assertEqual(6, big.fired)
+
+        self.simulator.inject_updates(500)
+        self.simulator.wait_idle()
+
+        self.assertEqual(20, ticker.evaluations)
+        self.assertGreater(filled.evaluations, 20)
+        self.assertGreater(filled.fired, 0)
+        now_filled = set(o.sequence for o in self.emsx.orders if o.field("EMSX_STATUS").value() == "FILLED")
+        self.assertEqual(now_filled, set(row.sequence for row, timer in filled.active.values()))
+
+        self.emsx.routes.cancel_routes([(FIRST_SEQUENCE + 3, 1)])
+        self.simulator.wait_idle()
+        self.assertEqual(1, cancelled.fired)
+        self.assertIn(("cancelled", FIRST_SEQUENCE + 3), self.fired)
+
+        stats = dict((s["rule"], s) for s in self.engine.stats())
+        self.assertEqual(filled.fired, stats["filled"]["fired"])
+        self.assertEqual(filled.fired, self.emsx.metrics.snapshot()["counters"][("rule_fired_total", (("rule", "filled"),))])
+
+    def test_rule_must_hold_for_a_while(self):
+
+        self.emsx.set_rule_engine(self.engine)
+        # since=None counts the hold from the first evaluation, the simulated orders were all created earlier today
+        small = self.engine.add_rule(Rule("small", "EMSX_AMOUNT < 1000 and EMSX_FILLED == 0", self.record, for_seconds=0.3, since=None))
+        self.assertEqual(9, len(small.active))
+        self.assertEqual(0, small.fired)
+
+        self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE).modify({"EMSX_AMOUNT": 5000})
+        self.simulator.wait_idle()
+        self.assertEqual(8, len(small.active))
+
+        time.sleep(0.6)
+        self.assertEqual(8, small.fired)
+        self.assertNotIn(("small", FIRST_SEQUENCE), self.fired)
+        self.assertEqual(0, len(self.engine.wheel))
+
+    def test_evicted_rows_release_rule_state(self):
+
+        self.emsx.set_rule_engine(self.engine)
+        small = self.engine.add_rule(Rule("small", "EMSX_AMOUNT < 1000 and EMSX_FILLED == 0", self.record, for_seconds=0.3, since=None))
+        waiting = [row.sequence for row, timer in small.active.values()]
+
+        self.emsx.orders.evict(waiting[:4])
+        self.assertEqual(len(waiting) - 4, len(small.active))
+        self.assertEqual(len(waiting) - 4, len(self.engine.wheel))
+
+        time.sleep(0.6)
+        self.assertEqual(sorted(waiting[4:]), sorted(seq for name, seq in self.fired))
+
+    def test_hold_counts_from_the_row_time_when_painted(self):
+
+        # one route last changed ten minutes ago, the other just now
+        now = seconds_since_midnight()
+        self.simulator.update_route(FIRST_SEQUENCE + 1, 1, EMSX_ROUTE_LAST_UPDATE_TIME=now - 600)
+        self.simulator.update_route(FIRST_SEQUENCE + 2, 1, EMSX_ROUTE_LAST_UPDATE_TIME=now)
+        self.simulator.wait_idle()
+
+        self.emsx.set_rule_engine(self.engine)
+        condition = "EMSX_SEQUENCE in (%d, %d)" % (FIRST_SEQUENCE + 1, FIRST_SEQUENCE + 2)
+        stuck = self.engine.add_rule(Rule("stuck", condition, self.record, kind=KIND_ROUTE, for_seconds=60))
+
+        self.assertEqual([("stuck", FIRST_SEQUENCE + 1)], self.fired)
+        self.assertEqual(2, len(stuck.active))
+        self.assertEqual(1, len(self.engine.wheel))
+
+    def test_expressions_are_restricted(self):
+
+        rule = Rule("mixed", "abs(EMSX_FILLED - 10) < max(EMSX_AMOUNT, 5) and EMSX_SIDE not in ('SELL', 'SHRT')")
+        self.assertEqual(frozenset(("EMSX_FILLED", "EMSX_AMOUNT", "EMSX_SIDE")), rule.fields)
+        for source in ("__import__('os').system('true')", "EMSX_TICKER.lower()", "EMSX_TICKER[0]",
+                       "[x for x in EMSX_TICKER]", "(lambda: 1)()", "abs", "EMSX_AMOUNT ==", "int(EMSX_AMOUNT, base=2)"):
+            self.assertRaises(ValueError, Rule, "bad", source)
+
+
+if __name__ == '__main__':
+    unittest.main()
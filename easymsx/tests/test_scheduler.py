@@ -0,0 +1,106 @@
+"""
+Token buckets and the client side request scheduler.
+"""
+
+import threading
+import time
+import unittest
+from easymsx.scheduler import RequestScheduler, TokenBucket, PRIORITY_HIGH
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(10, 2)
+        now = bucket.updated
+        for i in range(2):
+            self.assertEqual(0.0, bucket.delay(now))
+            bucket.take()
+        self.assertAlmostEqual(0.1, bucket.delay(now))
+        self.assertEqual(0.0, bucket.delay(now + 0.11))
+
+    def test_invalid_limits(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+        self.assertRaises(ValueError, RequestScheduler, 0)
+        self.assertRaises(ValueError, RequestScheduler, None, None, None, {"RouteEx": 7})
+
+
+class TestRequestScheduler(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=10)
+    easymsx_options = dict(enable_metrics=True)
+
+    def setUp(self):
+        super().setUp()
+        self.sent = []
+        handle_request = self.simulator.handle_request
+
+        def record(request):
+            self.sent.append(request.operation)
+            return handle_request(request)
+
+        self.simulator.handle_request = record
+
+    def send_all(self, requests):
+        done = threading.Semaphore(0)
+        for req in requests:
+            self.emsx.send_request(req, lambda msg: done.release())
+        for req in requests:
+            self.assertTrue(done.acquire(timeout=10))
+
+    def create_order(self):
+        req = self.emsx.create_request("CreateOrderAndRouteEx")
+        req.set("EMSX_TICKER", "IBM US Equity")
+        req.set("EMSX_AMOUNT", 100)
+        return req
+
+    def cancel_route(self):
+        req = self.emsx.create_request("CancelRouteEx")
+        route = req.getElement("ROUTES").appendElement()
+        route.setElement("EMSX_SEQUENCE", FIRST_SEQUENCE)
+        route.setElement("EMSX_ROUTE_ID", 1)
+        return req
+
+    def test_cancels_overtake_queued_creates(self):
+
+        self.simulator.response_latency = 0.05
+        self.emsx.set_request_scheduler(RequestScheduler(max_in_flight=1))
+
+        # the first create takes the only slot, the rest queue behind it
+        first = threading.Event()
+        self.emsx.send_request(self.create_order(), lambda msg: first.set())
+        while not self.sent:
+            time.sleep(0.001)
+        self.send_all([self.create_order() for i in range(3)] + [self.cancel_route()])
+        self.assertTrue(first.wait(10))
+
+        self.assertEqual(["CreateOrderAndRouteEx", "CancelRouteEx"], self.sent[:2])
+        self.assertEqual(5, len(self.sent))
+        self.assertEqual(0, len(self.emsx.scheduler.in_flight))
+
+    def test_rate_limit_and_metrics(self):
+
+        self.emsx.set_request_scheduler(RequestScheduler(rate_limits={"GetTeams": (20, 1)}))
+
+        t0 = time.monotonic()
+        self.send_all([self.emsx.create_request("GetTeams") for i in range(6)])
+        self.assertGreaterEqual(time.monotonic() - t0, 5 / 20.0 * 0.9)
+
+        snapshot = self.emsx.metrics.snapshot()
+        labels = (("operation", "GetTeams"),)
+        self.assertEqual(6, snapshot["histograms"][("request_queue_wait_ns", labels)]["count"])
+        self.assertEqual(6, snapshot["counters"][("requests_sent_total", labels)])
+
+    def test_blocking_request_and_explicit_priority(self):
+
+        self.emsx.set_request_scheduler(RequestScheduler())
+        msg = self.emsx.send_request(self.create_order(), priority=PRIORITY_HIGH)
+        self.assertEqual("CreateOrderAndRouteEx", str(msg.messageType()))
+        self.assertRaises(ValueError, self.emsx.send_request, self.create_order(), lambda msg: None, 9)
+        self.assertEqual({}, self.emsx.request_message_handlers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+Sharded dispatch of subscription data.
+"""
+
+import threading
+import time
+import unittest
+import blpapi
+from easymsx.notification import Notification
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestSharding(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=50, messages_per_event=20)
+    easymsx_options = dict(enable_metrics=True)
+    start_emsx = False
+
+    def setUp(self):
+        super().setUp()
+        self.emsx.set_dispatch_shards(4)
+        self.lock = threading.Lock()
+        self.seen = {}
+        self.emsx.add_notification_handler(self.record)
+
+    def record(self, notification):
+        if notification.type != Notification.NotificationType.UPDATE or notification.category != Notification.NotificationCategory.ORDER:
+            return
+        filled = notification.source.field("EMSX_FILLED").value()
+        with self.lock:
+            self.seen.setdefault(notification.source.sequence, []).append((threading.current_thread().name, filled))
+
+    def capture_published(self):
+        published = {}
+        publish = self.simulator.publish
+
+        def capture(order_changes, route_changes):
+            for seq, event_status in order_changes:
+                published.setdefault(seq, []).append(str(self.simulator.order_values(seq)["EMSX_FILLED"]))
+            publish(order_changes, route_changes)
+
+        self.simulator.publish = capture
+        return published
+
+    def test_paint_and_updates_keep_per_order_order(self):
+
+        self.emsx.start()
+        self.assertEqual(50, len(self.emsx.orders.orders))
+        self.assertTrue(self.emsx.orders.initialized)
+
+        published = self.capture_published()
+        self.simulator.inject_updates(2000)
+        self.simulator.wait_idle()
+        self.assertTrue(self.emsx.wait_dispatched(5))
+
+        self.assertEqual(sorted(published), sorted(self.seen))
+        for seq, seen in self.seen.items():
+            # every update for an order is applied by one shard, in the order it was published
+            self.assertEqual(1, len(set(thread for thread, filled in seen)))
+            self.assertEqual(published[seq], [filled for thread, filled in seen])
+
+        self.assertEqual(4, len(set(seen[0][0] for seen in self.seen.values())))
+
+    def test_notifications_keep_their_own_receive_time(self):
+
+        self.emsx.start()
+        self.emsx.latency.enable()
+        first, second = FIRST_SEQUENCE, FIRST_SEQUENCE + 1
+        stamped = {}
+        self.emsx.orders.add_notification_handler(
+            lambda n: n.type == Notification.NotificationType.UPDATE and stamped.setdefault(n.source.sequence, n.timestamps.received_ns))
+
+        # the first order's shard is held until an event for the second order has been received and dispatched
+        holding = threading.Event()
+        released = threading.Event()
+
+        def hold(o, notification):
+            if o.sequence == first and not holding.is_set():
+                holding.set()
+                released.wait(5)
+
+        self.emsx.orders.add_cache_listener(hold)
+        process_event = self.emsx.session.event_handler
+        second_arrived = []
+
+        def receive(event, session):
+            if holding.is_set() and not released.is_set() and event.eventType() == blpapi.Event.SUBSCRIPTION_DATA:
+                second_arrived.append(time.monotonic_ns())
+                process_event(event, session)
+                released.set()
+                return
+            process_event(event, session)
+
+        self.emsx.session.event_handler = receive
+        self.emsx.orders.get_by_sequence_no(first).modify({"EMSX_AMOUNT": 5})
+        self.assertTrue(holding.wait(5))
+        self.emsx.orders.get_by_sequence_no(second).modify({"EMSX_AMOUNT": 5})
+        self.simulator.wait_idle()
+        self.assertTrue(self.emsx.wait_dispatched(5))
+
+        # the held order was stamped after the later event came in, but keeps its own event's receive time
+        self.assertLess(stamped[first], second_arrived[0])
+        self.assertGreaterEqual(stamped[second], second_arrived[0])
+        self.assertTrue(all(v >= 0 for v in self.emsx.latency.samples["receive_to_cache"]))
+
+    def test_back_to_single_threaded(self):
+
+        self.emsx.start()
+        self.emsx.set_dispatch_shards(0)
+        self.simulator.inject_updates(100)
+        self.simulator.wait_idle()
+
+        self.assertIsNone(self.emsx.dispatcher)
+        self.assertEqual({"SimulatedSession"}, set(thread for seen in self.seen.values() for thread, filled in seen))
+
+
+if __name__ == '__main__':
+    unittest.main()
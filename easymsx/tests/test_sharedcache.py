@@ -0,0 +1,138 @@
+"""
+The shared memory cache, read from this process and from a separate one.
+"""
+
+import os
+import subprocess
+import sys
+import unittest
+from easymsx.derivedfield import remaining
+from easymsx.sharedcache import SharedCachePublisher, SharedCacheReader, KIND_ORDER
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.tests.simulated import SimulatedTestCase
+
+READER_SCRIPT = """
+import sys
+from easymsx.sharedcache import SharedCacheReader
+reader = SharedCacheReader(sys.argv[1])
+order = reader.get_order(int(sys.argv[2]))
+print(len(reader.orders()), len(reader.routes()), order.value("EMSX_AMOUNT"))
+"""
+
+
+class TestSharedCache(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=20)
+    easymsx_options = dict(enable_metrics=True)
+    start_emsx = False
+
+    def setUp(self):
+        super().setUp()
+        self.directory = self.make_directory()
+        self.path = os.path.join(self.directory, "emsx.cache")
+        self.emsx.start()
+        self.publisher = self.emsx.publish_shared_cache(self.path, capacity=100, ring_size=8)
+
+    def test_snapshot_matches_cache(self):
+
+        reader = SharedCacheReader(self.path)
+
+        self.assertEqual(len(list(self.emsx.orders)), len(reader.orders()))
+        self.assertEqual(len(list(self.emsx.routes)), len(reader.routes()))
+
+        order = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE)
+        shared = reader.get_order(FIRST_SEQUENCE)
+        self.assertEqual(order.field("EMSX_TICKER").value(), shared.value("EMSX_TICKER"))
+        self.assertEqual(dict((f.name(), f.value()) for f in order.fields.fields), shared.values())
+        self.assertIsNone(shared.value("NOT_A_FIELD"))
+
+        route = reader.get_route(FIRST_SEQUENCE, 1)
+        self.assertEqual(str(FIRST_SEQUENCE), route.value("EMSX_SEQUENCE"))
+        reader.close()
+
+    def test_updates_are_visible(self):
+
+        reader = SharedCacheReader(self.path)
+        since = reader.change_sequence()
+
+        self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 1).modify({"EMSX_AMOUNT": 4321})
+        self.simulator.wait_idle()
+
+        self.assertGreater(reader.wait_for_change(since, timeout=5), since)
+        changed = reader.refresh()
+        self.assertIn(reader.get_order(FIRST_SEQUENCE + 1), changed)
+        self.assertEqual("4321", reader.get_order(FIRST_SEQUENCE + 1).value("EMSX_AMOUNT"))
+
+        # more changes than the ring holds fall back to a full rescan
+        for amount in range(10):
+            self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 2).modify({"EMSX_AMOUNT": 100 + amount})
+        self.simulator.wait_idle()
+        self.assertEqual(len(reader.orders()) + len(reader.routes()), len(reader.refresh()))
+        self.assertEqual("109", reader.get_order(FIRST_SEQUENCE + 2).value("EMSX_AMOUNT"))
+
+        self.emsx.shared_cache.close()
+        self.assertFalse(reader.publisher_alive())
+        self.assertIsNone(reader.wait_for_change(timeout=1))
+        reader.close()
+
+    def test_evicted_slot_is_reused(self):
+
+        reader = SharedCacheReader(self.path)
+        evicted = reader.get_order(FIRST_SEQUENCE + 3)
+        slot = evicted.slot
+
+        self.emsx.orders.evict([FIRST_SEQUENCE + 3])
+        self.assertIn(evicted, reader.refresh())
+        self.assertTrue(evicted.removed)
+        self.assertIsNone(reader.get_order(FIRST_SEQUENCE + 3))
+        self.assertIsNone(evicted.value("EMSX_AMOUNT"))
+
+        with self.simulator.lock:
+            seq = self.simulator.new_order({"EMSX_TICKER": "IBM US Equity", "EMSX_AMOUNT": 10})
+            self.simulator.publish([(seq, 6)], [])
+        self.simulator.wait_idle()
+
+        reader.refresh()
+        added = reader.get_order(seq)
+        self.assertEqual(slot, added.slot)
+        self.assertEqual("10", added.value("EMSX_AMOUNT"))
+        self.assertIsNone(evicted.values())
+        self.assertEqual(self.publisher.used, len(self.publisher.slots))
+        reader.close()
+
+    def test_row_size_is_checked_against_the_schema(self):
+
+        self.assertRaises(ValueError, SharedCachePublisher, self.emsx, os.path.join(self.directory, "small.cache"), row_size=256)
+        self.assertGreaterEqual(self.publisher.row_size, self.publisher.row_size_for(KIND_ORDER, self.emsx.order_fields))
+
+    def test_derived_fields_are_opted_in(self):
+
+        self.emsx.orders.add_derived_field("LEFT", ("EMSX_AMOUNT", "EMSX_FILLED"), remaining)
+        path = os.path.join(self.directory, "derived.cache")
+        publisher = SharedCachePublisher(self.emsx, path, capacity=100, derived_fields=["LEFT"])
+        publisher.start()
+        reader = SharedCacheReader(path)
+
+        order = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE)
+        self.assertEqual(str(order.field("LEFT").value()), reader.get_order(FIRST_SEQUENCE).value("LEFT"))
+        self.assertIsNone(reader.get_route(FIRST_SEQUENCE, 1).value("LEFT"))
+
+        order.modify({"EMSX_AMOUNT": 12345})
+        self.simulator.wait_idle()
+        reader.refresh()
+        self.assertEqual(str(12345 - float(order.field("EMSX_FILLED").value())), reader.get_order(FIRST_SEQUENCE).value("LEFT"))
+        publisher.close()
+        reader.close()
+
+    def test_reader_in_another_process(self):
+
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ, PYTHONPATH=root)
+        output = subprocess.check_output([sys.executable, "-c", READER_SCRIPT, self.path, str(FIRST_SEQUENCE)], env=env)
+
+        amount = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE).field("EMSX_AMOUNT").value()
+        self.assertEqual("%d %d %s" % (len(list(self.emsx.orders)), len(list(self.emsx.routes)), amount), output.decode().strip())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+EasyMSX end to end: schema, teams, brokers, paints and updates.
+"""
+
+from easymsx.notification import Notification
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestSimulator(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=50, routes_per_order=2, messages_per_event=10)
+    start_emsx = False
+
+    def setUp(self):
+        super().setUp()
+        self.notifications = []
+
+    def process_notification(self, notification):
+        self.notifications.append(notification)
+
+    def test_initialize_loads_schema_teams_and_brokers(self):
+
+        self.assertTrue(len(self.emsx.order_fields) > 0)
+        self.assertTrue(len(self.emsx.route_fields) > 0)
+        self.assertEqual(["TEAM_A", "TEAM_B"], [t.name for t in self.emsx.teams])
+
+        brokers = [(b.asset_class, b.name) for b in self.emsx.brokers]
+        self.assertIn(("EQTY", "BMTB"), brokers)
+
+        bmtb = [b for b in self.emsx.brokers if b.asset_class == "EQTY" and b.name == "BMTB"][0]
+        vwap = [s for s in bmtb.strategies if s.name == "VWAP"][0]
+        self.assertEqual(["StartTime", "EndTime", "MaxPctVolume"], [p.name for p in vwap.parameters])
+
+    def test_init_paint_fills_cache(self):
+
+        self.emsx.start()
+
+        self.assertEqual(50, len(list(self.emsx.orders)))
+        self.assertEqual(100, len(list(self.emsx.routes)))
+
+        o = self.emsx.orders.get_by_sequence_no(1000010)
+        self.assertEqual("REF1000010", o.field("EMSX_ORDER_REF_ID").value())
+
+    def test_team_subscription_filters_blotter(self):
+
+        self.emsx.teams.get("TEAM_A").select()
+        self.emsx.start()
+
+        self.assertEqual(25, len(list(self.emsx.orders)))
+
+    def test_updates_are_notified(self):
+
+        self.emsx.start()
+        self.emsx.orders.add_notification_handler(self.process_notification)
+
+        self.simulator.inject_updates(20)
+        self.simulator.wait_idle()
+
+        updates = [n for n in self.notifications if n.type == Notification.NotificationType.UPDATE]
+        self.assertEqual(20, len(updates))
+
+    def test_create_order_round_trip(self):
+
+        self.emsx.start()
+        self.emsx.orders.add_notification_handler(self.process_notification)
+
+        req = self.emsx.create_request("CreateOrder")
+        req.set("EMSX_TICKER", "IBM US Equity")
+        req.set("EMSX_AMOUNT", 1000)
+        req.set("EMSX_ORDER_TYPE", "MKT")
+        req.set("EMSX_TIF", "DAY")
+        req.set("EMSX_HAND_INSTRUCTION", "ANY")
+        req.set("EMSX_SIDE", "BUY")
+
+        msg = self.emsx.send_request(req)
+        self.simulator.wait_idle()
+
+        seq = msg.getElementAsInteger("EMSX_SEQUENCE")
+        self.assertEqual("1000", self.emsx.orders.get_by_sequence_no(seq).field("EMSX_AMOUNT").value())
+        self.assertTrue(any(n.type == Notification.NotificationType.NEW for n in self.notifications))
+
+    def test_unknown_operation_returns_error_info(self):
+
+        msg = self.emsx.send_request(self.emsx.create_request("NotAnOperation"))
+
+        self.assertEqual("ErrorInfo", str(msg.messageType()))
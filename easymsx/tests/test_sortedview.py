@@ -0,0 +1,92 @@
+"""
+Incrementally maintained sorted views.
+"""
+
+import random
+import unittest
+from easymsx.simulator import FIRST_SEQUENCE
+from easymsx.sortedview import SortedEntries
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestSortedView(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=200, routes_per_order=1, messages_per_event=20)
+
+    @staticmethod
+    def filled(o):
+        return int(o.field("EMSX_FILLED").value())
+
+    def test_entries_stay_sorted(self):
+
+        rnd = random.Random(7)
+        entries = SortedEntries(load=4)
+        expected = []
+        for i in range(0, 2000):
+            if expected and rnd.random() < 0.4:
+                entry = expected.pop(rnd.randrange(len(expected)))
+                entries.remove(entry)
+            else:
+                entry = (rnd.randrange(100), i)
+                entries.add(entry)
+                expected.append(entry)
+        expected.sort()
+
+        self.assertEqual(expected, list(entries))
+        self.assertEqual(expected[::-1], list(reversed(entries)))
+        self.assertEqual([e for e in expected if 20 <= e[0] <= 40], list(entries.between((20,), (40, float("inf")))))
+
+    def test_view_follows_updates(self):
+
+        view = self.emsx.orders.add_sorted_view("EMSX_FILLED", reverse=True, convert=int)
+        self.assertEqual(200, len(view))
+
+        self.simulator.inject_updates(1000)
+        self.simulator.wait_idle()
+
+        expected = sorted((self.filled(o) for o in self.emsx.orders), reverse=True)
+        self.assertEqual(expected[:10], [self.filled(o) for o in view.top(10)])
+        self.assertEqual(expected, [self.filled(o) for o in view])
+
+        in_range = view.range(100, 300)
+        self.assertEqual(len([f for f in expected if 100 <= f <= 300]), len(in_range))
+        self.assertEqual(sorted((self.filled(o) for o in in_range), reverse=True), [self.filled(o) for o in in_range])
+
+    def test_numeric_fields_sort_as_numbers(self):
+
+        # amounts run from 100 to 5000, as strings "500" would sort after "1000"
+        view = self.emsx.orders.add_sorted_view("EMSX_AMOUNT")
+        amounts = [int(o.field("EMSX_AMOUNT").value()) for o in view]
+        self.assertEqual(sorted(amounts), amounts)
+        self.assertGreater(len(set(len(str(a)) for a in amounts)), 1)
+
+        mixed = self.emsx.orders.add_sorted_view(("EMSX_TICKER", "EMSX_LIMIT_PRICE"))
+        keys = [(o.field("EMSX_TICKER").value(), float(o.field("EMSX_LIMIT_PRICE").value())) for o in mixed]
+        self.assertEqual(sorted(keys), keys)
+        self.assertEqual(len([a for a in amounts if 500 <= a <= 1000]), len(view.range(500, 1000)))
+
+    def test_deleted_and_evicted_rows_leave(self):
+
+        view = self.emsx.orders.add_sorted_view(("EMSX_TICKER", "EMSX_SEQUENCE"), convert=str)
+        routes = self.emsx.routes.add_sorted_view(lambda r: r.field("EMSX_ROUTE_ID").value(), where=lambda r: r.field("EMSX_STATUS").value() != "CANCEL")
+        self.assertEqual(200, len(routes))
+
+        self.emsx.orders.delete_orders([FIRST_SEQUENCE])
+        self.simulator.wait_idle()
+        self.assertNotIn(self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE), view)
+
+        o = self.emsx.orders.get_by_sequence_no(FIRST_SEQUENCE + 1)
+        self.emsx.orders.evict([FIRST_SEQUENCE + 1])
+        self.assertNotIn(o, view)
+        self.assertEqual(198, len(view))
+
+        self.emsx.routes.cancel_routes([(FIRST_SEQUENCE + 2, 1)])
+        self.simulator.wait_idle()
+        self.assertEqual(199, len(routes))
+
+        view.close()
+        self.assertEqual([], self.emsx.orders.sorted_views)
+
+
+if __name__ == '__main__':
+    unittest.main()
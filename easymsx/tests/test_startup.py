@@ -0,0 +1,58 @@
+"""
+The startup pipeline and its phase report.
+"""
+
+import unittest
+from easymsx.simulator import EMSXSimulator
+from easymsx.tests.simulated import SimulatedTestCase
+
+LATENCY = 0.1
+
+
+class TestStartup(SimulatedTestCase):
+
+    # each test sets up the simulator latencies it measures against
+    easymsx_options = None
+
+    def phases(self):
+        return dict((row["phase"], row) for row in self.emsx.startup_report()["phases"])
+
+    def test_auto_start_overlaps_requests_and_subscriptions(self):
+
+        # brokers need three nested round trips, the init paints one slow one
+        self.simulator = EMSXSimulator(num_orders=50, response_latency=LATENCY, subscription_latency=3 * LATENCY)
+        emsx = self.create_easymsx(team="TEAM_A", auto_start=True)
+
+        phases = self.phases()
+        total = emsx.startup_report()["total_ms"] / 1000.0
+
+        self.assertEqual(["session", "service", "schema", "teams", "brokers", "orders", "routes"], list(phases))
+        self.assertGreaterEqual(phases["brokers"]["duration_ms"] / 1000.0, 3 * LATENCY)
+        self.assertGreater(phases["brokers"]["requests"], 4)
+        self.assertLess(total, 6 * LATENCY)
+
+        self.assertTrue(all(len(list(b.strategies)) > 0 for b in emsx.brokers))
+        self.assertIs(emsx.teams.get("TEAM_A"), emsx.team)
+        self.assertEqual(25, len(list(emsx.orders)))
+        self.assertEqual(25, len(list(emsx.routes)))
+
+        # subscriptions are already up
+        emsx.start()
+        self.assertEqual(25, len(list(emsx.orders)))
+
+    def test_start_paints_orders_and_routes_together(self):
+
+        self.simulator = EMSXSimulator(num_orders=20, subscription_latency=2 * LATENCY)
+        emsx = self.create_easymsx()
+
+        self.assertNotIn("orders", self.phases())
+        emsx.start()
+        phases = self.phases()
+
+        self.assertTrue(emsx.orders.initialized)
+        self.assertTrue(emsx.routes.initialized)
+        self.assertLess(phases["routes"]["start_ms"] - phases["orders"]["start_ms"], LATENCY * 1000)
+        self.assertIn("routes", emsx.startup.format_report())
+
+if __name__ == '__main__':
+    unittest.main()
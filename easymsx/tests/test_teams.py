@@ -0,0 +1,119 @@
+"""
+Several team subscriptions sharing one EasyMSX instance.
+"""
+
+import unittest
+from easymsx.notification import Notification
+from easymsx.tests.simulated import SimulatedTestCase
+
+
+class TestTeams(SimulatedTestCase):
+
+    # one change per event, so every update published differs from the cached order
+    simulator_options = dict(num_orders=50, messages_per_event=1)
+    start_emsx = False
+
+    def setUp(self):
+        super().setUp()
+        self.updates = []
+        self.deletes = []
+        self.emsx.orders.add_notification_handler(self.record)
+
+    def record(self, notification):
+        if notification.type == Notification.NotificationType.UPDATE:
+            self.updates.append(notification.source.sequence)
+        elif notification.type == Notification.NotificationType.DELETE:
+            self.deletes.append(notification.source.sequence)
+
+    def refuse_team(self, team):
+        # sessions whose subscriptions to one team are refused, as for a team the user is not entitled to
+        def create_session(*args, **kwargs):
+            session = self.simulator.create_session(*args, **kwargs)
+            subscribe = session.subscribe
+
+            def refusing_subscribe(subscriptions, *more):
+                if ";team=" + team in subscriptions.topicStringAt(0):
+                    raise RuntimeError("Not entitled to " + team)
+                return subscribe(subscriptions, *more)
+
+            session.subscribe = refusing_subscribe
+            return session
+        return create_session
+
+    def test_teams_merge_into_one_cache(self):
+
+        self.emsx.set_teams([self.emsx.teams.get("TEAM_A"), "TEAM_B"])
+        team_a = []
+        self.emsx.orders.add_team_notification_handler("TEAM_A", lambda n: team_a.append(n.source.sequence))
+        self.emsx.start()
+
+        self.assertEqual(2, len(self.emsx.orders.subscriptions))
+        self.assertEqual(50, len(self.emsx.orders.orders))
+        self.assertEqual(50, len(self.emsx.routes.routes))
+        self.assertEqual(25, len(self.emsx.orders.for_team("TEAM_A")))
+        self.assertTrue(all(self.simulator.team_of(o.sequence) == "TEAM_A" for o in self.emsx.orders.for_team(self.emsx.teams.get("TEAM_A"))))
+        self.assertEqual(25, len(self.emsx.routes.for_team("TEAM_B")))
+
+        del team_a[:]
+        sent = self.simulator.inject_updates(100)
+        self.simulator.wait_idle()
+
+        self.assertEqual(sent, len(self.updates))
+        self.assertEqual([seq for seq in self.updates if self.simulator.team_of(seq) == "TEAM_A"], team_a)
+
+    def test_overlapping_views_deliver_once(self):
+
+        self.emsx.set_teams([None, "TEAM_A"])
+        self.emsx.start()
+
+        self.assertTrue(self.emsx.orders.initialized)
+        self.assertEqual(50, len(self.emsx.orders.orders))
+        self.assertEqual(50, len(self.emsx.orders.for_team(None)))
+        self.assertEqual(25, len(self.emsx.orders.for_team("TEAM_A")))
+
+        sent = self.simulator.inject_updates(100)
+        self.simulator.wait_idle()
+
+        # TEAM_A orders are published on both subscriptions, the second copy changes nothing
+        self.assertEqual(sent, len(self.updates))
+
+        # an update that changes nothing is still delivered, once
+        seq = self.emsx.orders.for_team("TEAM_A")[0].sequence
+        del self.updates[:]
+        self.simulator.update_order(seq)
+        self.simulator.wait_idle()
+        self.assertEqual([seq], self.updates)
+
+        # a delete is never taken for a copy
+        self.emsx.orders.delete_orders([seq])
+        self.simulator.wait_idle()
+        self.assertIn(seq, self.deletes)
+        self.assertEqual("DELETED", self.emsx.orders.get_by_sequence_no(seq).field("EMSX_STATUS").value())
+
+    def test_failed_team_subscription_is_left_out(self):
+
+        self.emsx.stop()
+        self.create_easymsx(session_factory=self.refuse_team("TEAM_B"))
+        self.emsx.set_teams(["TEAM_A", "TEAM_B"])
+        self.emsx.start()
+
+        self.assertEqual(["TEAM_A"], list(self.emsx.orders.subscriptions.values()))
+        self.assertTrue(self.emsx.orders.initialized)
+        self.assertFalse(self.emsx.orders.painting)
+        self.assertEqual(25, len(self.emsx.orders.orders))
+        self.assertEqual(25, len(self.emsx.routes.for_team("TEAM_A")))
+        self.assertEqual(0, len(self.emsx.orders.for_team("TEAM_B")))
+
+    def test_no_subscription_at_all_raises(self):
+
+        self.emsx.stop()
+        self.create_easymsx(session_factory=self.refuse_team("TEAM_B"))
+        self.emsx.set_teams(["TEAM_B"])
+        self.assertRaises(ValueError, self.emsx.start)
+
+    def test_needs_a_view(self):
+        self.assertRaises(ValueError, self.emsx.set_teams, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
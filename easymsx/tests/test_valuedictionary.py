@@ -0,0 +1,48 @@
+"""
+Dictionary encoding of low cardinality field values.
+"""
+
+import unittest
+from easymsx.tests.simulated import SimulatedTestCase
+from easymsx.valuedictionary import FieldDictionary
+
+
+class TestValueDictionary(SimulatedTestCase):
+
+    simulator_options = dict(num_orders=100, messages_per_event=20)
+
+    def test_rows_share_values(self):
+
+        self.simulator.inject_updates(200)
+        self.simulator.wait_idle()
+
+        for name in ("EMSX_SIDE", "EMSX_STATUS", "EMSX_TICKER"):
+            shared = {}
+            for row in list(self.emsx.orders) + list(self.emsx.routes):
+                value = row.field(name).value()
+                self.assertIs(shared.setdefault(value, value), value)
+
+        report = self.emsx.memory_report()
+        self.assertEqual(2, report["fields"]["EMSX_SIDE"]["distinct_values"])
+        self.assertEqual(200, report["fields"]["EMSX_SIDE"]["row_values"])
+        self.assertGreater(report["total"]["saved_bytes"], 0)
+        self.assertEqual(len(self.emsx.value_dictionary.table("EMSX_STATUS")),
+                         len(set(o.field("EMSX_STATUS").value() for o in list(self.emsx.orders) + list(self.emsx.routes))))
+
+    def test_high_cardinality_overflows(self):
+
+        table = FieldDictionary("EMSX_TICKER", max_values=2)
+        a = table.canonical("A US Equity")
+        self.assertIs(a, table.canonical("".join(["A US ", "Equity"])))
+        table.canonical("B US Equity")
+        self.assertEqual("C US Equity", table.canonical("C US Equity"))
+        self.assertEqual(1, table.overflow)
+        self.assertEqual(a, table.decode(table.encode("A US Equity")))
+
+        self.emsx.set_encoded_fields([])
+        self.assertEqual({"fields": {}, "total": {"row_values": 0, "plain_bytes": 0, "encoded_bytes": 0, "saved_bytes": 0}},
+                         self.emsx.memory_report())
+
+
+if __name__ == '__main__':
+    unittest.main()
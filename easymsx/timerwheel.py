@@ -0,0 +1,98 @@
+# timerwheel.py
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+
+    __slots__ = ("due", "item", "cancelled")
+
+    def __init__(self, due, item):
+        self.due = due
+        self.item = item
+        self.cancelled = False
+
+
+class TimerWheel:
+
+    # a hashed timing wheel: scheduling and cancelling are O(1), each tick only looks at one slot.
+    # Timers further out than one turn of the wheel wait in their slot until their tick comes round
+    def __init__(self, tick=0.1, slots=512, clock=time.monotonic):
+        if tick <= 0 or slots < 1:
+            raise ValueError("A timer wheel needs a positive tick and at least one slot")
+        self.tick = tick
+        self.slots = [[] for i in range(0, slots)]
+        self.clock = clock
+        self.current = int(clock() / tick)
+        self.live = 0
+
+    def schedule(self, delay, item):
+        due = max(self.current + 1, int((self.clock() + delay) / self.tick) + 1)
+        timer = Timer(due, item)
+        self.slots[due % len(self.slots)].append(timer)
+        self.live += 1
+        return timer
+
+    def cancel(self, timer):
+        # cancelled timers are dropped when their slot is next swept
+        if not timer.cancelled:
+            timer.cancelled = True
+            self.live -= 1
+
+    def advance(self, now=None):
+
+        # returns the timers that came due, the caller acts on their items
+        target = int((self.clock() if now is None else now) / self.tick)
+        expired = []
+        if target <= self.current:
+            return expired
+
+        count = len(self.slots)
+        ticks = range(self.current + 1, target + 1) if target - self.current < count else range(target - count + 1, target + 1)
+        for t in ticks:
+            i = t % count
+            slot = self.slots[i]
+            if not slot:
+                continue
+            keep = []
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.due <= target:
+                    timer.cancelled = True
+                    self.live -= 1
+                    expired.append(timer)
+                else:
+                    keep.append(timer)
+            self.slots[i] = keep
+
+        self.current = target
+        return expired
+
+    def __len__(self):
+        return self.live
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""
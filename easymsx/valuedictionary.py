@@ -0,0 +1,129 @@
+# valuedictionary.py
+
+import sys
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# fields with a handful of distinct values repeated on every row
+DEFAULT_ENCODED_FIELDS = ("EMSX_STATUS", "EMSX_SIDE", "EMSX_BROKER", "EMSX_TIF", "EMSX_ORDER_TYPE", "EMSX_TRADER",
+                          "EMSX_TICKER", "EMSX_ACCOUNT", "EMSX_HAND_INSTRUCTION", "EMSX_EXCHANGE", "EMSX_STRATEGY_TYPE")
+
+DEFAULT_MAX_VALUES = 65536
+
+
+class FieldDictionary:
+
+    def __init__(self, name, max_values=DEFAULT_MAX_VALUES):
+        self.name = name
+        self.max_values = max_values
+        self.codes = {}
+        self.values = []
+        self.overflow = 0
+        self.lock = threading.Lock()
+
+    def encode(self, value):
+
+        # returns the code of the value, adding it on first sight; None once the field turns out not to be low cardinality
+        code = self.codes.get(value)
+        if code is not None:
+            return code
+        with self.lock:
+            code = self.codes.get(value)
+            if code is None:
+                if len(self.values) >= self.max_values:
+                    self.overflow += 1
+                    return None
+                code = len(self.values)
+                self.values.append(value)
+                self.codes[value] = code
+        return code
+
+    def decode(self, code):
+        return self.values[code]
+
+    def canonical(self, value):
+        # every row holding a value shares one copy of it, equal values are then also the same object
+        code = self.codes.get(value)
+        if code is None:
+            code = self.encode(value)
+            if code is None:
+                return value
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class ValueDictionary:
+
+    def __init__(self, fields=DEFAULT_ENCODED_FIELDS, max_values=DEFAULT_MAX_VALUES):
+        # one table per field name, shared by orders and routes
+        self.tables = dict((name, FieldDictionary(name, max_values)) for name in fields)
+
+    def table(self, name):
+        return self.tables.get(name)
+
+    def encode(self, name, value):
+        table = self.tables.get(name)
+        return None if table is None else table.encode(value)
+
+    def decode(self, name, code):
+        return self.tables[name].decode(code)
+
+    def size(self):
+        return sum(len(t) for t in self.tables.values())
+
+    def memory_report(self, rows):
+
+        # blpapi hands out a new string for every element, so without encoding each row keeps its own copy
+        report = {}
+        for name, table in self.tables.items():
+            copies = 0
+            plain_bytes = 0
+            for row in rows:
+                f = row.fields.field_index.get(name)
+                if f is None:
+                    continue
+                current = f.value()
+                if current:
+                    copies += 1
+                    plain_bytes += sys.getsizeof(current)
+                old = f.old_value()
+                if old and old is not current:
+                    copies += 1
+                    plain_bytes += sys.getsizeof(old)
+            shared_bytes = sum(sys.getsizeof(v) for v in table.values)
+            report[name] = {
+                "distinct_values": len(table),
+                "row_values": copies,
+                "plain_bytes": plain_bytes,
+                "encoded_bytes": shared_bytes,
+                "saved_bytes": max(0, plain_bytes - shared_bytes),
+                "overflow": table.overflow,
+            }
+        total = dict((k, sum(r[k] for r in report.values())) for k in ("row_values", "plain_bytes", "encoded_bytes", "saved_bytes"))
+        return {"fields": report, "total": total}
+
+
+__copyright__ = """
+Copyright 2017. Bloomberg Finance L.P.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to
+deal in the Software without restriction, including without limitation the
+rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+sell copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:  The above
+copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NON-INFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+IN THE SOFTWARE.
+"""